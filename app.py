@@ -11,45 +11,553 @@
 # [A2] 系統特性
 # - 整合 FLUX API (Black-Forest-Labs)
 # - 全程以 SHA-256 驗證雜湊鏈結
-# - 可離線驗證 JSON 與 PDF 對應一致性
+# - 可離線驗證 JSON 與 PDF 對應一致性 (python verify_proof.py)
 # ====================================================================
 
 # === B1. 套件匯入 ===
-import requests, json, hashlib, uuid, datetime, random, time, os, io, base64
-from flask import Flask, render_template, request, jsonify, send_from_directory, url_for
+import requests, json, hashlib, uuid, datetime, random, time, os, io, base64, copy, sqlite3, threading, multiprocessing, glob, hmac, contextlib, cProfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import click
+import verify_proof
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, url_for, g
 from PIL import Image
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos
+from fpdf.fonts import TTFFont, SubsetMap
+from fpdf.image_parsing import get_img_info
+from fontTools import ttLib
 import qrcode
+try:
+    import fcntl # 多個 worker 之間以檔案鎖確保同時只有一個背景清理 (Windows 上沒有，改為各自執行)
+except ImportError:
+    fcntl = None
 
 # === B2. 讀取環境變數 (已修改為 OPENAI_API_KEY) ===
 API_key = os.getenv("OPENAI_API_KEY")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/") # 壓力測試時可指向 bench/fake_openai.py
+
+# B2-1. 會話儲存設定 (memory: 單一行程 / sqlite: 多個 gunicorn worker 共用)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_COOKIE = "wesmart_sid"
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_MAX_PREVIEWS = int(os.getenv("SESSION_MAX_PREVIEWS", "50"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(128 * 1024 * 1024)))
+SESSION_MAX_TOTAL_BYTES = int(os.getenv("SESSION_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+DATA_DIR = os.getenv("DATA_DIR", "data") # 後端私有資料 (不可放在 static/ 以免被公開下載)
+PROOF_DIR = os.path.join(DATA_DIR, "proofs") # 證據正本 JSON (含申請人與 report_id，僅供後端渲染報告與離線驗證)
+
+# B2-2. 背景生成工作設定 (每個 worker 行程的執行緒數與每位使用者的公平性上限)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ACTIVE_PER_USER = int(os.getenv("JOB_MAX_ACTIVE_PER_USER", "2"))
+JOB_MAX_PENDING_PER_USER = int(os.getenv("JOB_MAX_PENDING_PER_USER", "5"))
+JOB_HISTORY_PER_USER = int(os.getenv("JOB_HISTORY_PER_USER", "20"))
+
+# B2-3. 批次生成設定 (單一行程內同時進行的 API 呼叫數與每分鐘請求預算，0 表示不限制)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10"))
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", "4"))
+API_RATE_LIMIT_PER_MINUTE = int(os.getenv("API_RATE_LIMIT_PER_MINUTE", "0"))
+
+# B2-4. 對外 HTTP 連線設定 (連線池、重試、斷路器與逾時秒數)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "8"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+HTTP_BREAKER_THRESHOLD = int(os.getenv("HTTP_BREAKER_THRESHOLD", "5"))
+HTTP_BREAKER_COOLDOWN = float(os.getenv("HTTP_BREAKER_COOLDOWN", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# B2-5. PDF 報告渲染設定 (背景行程數與渲染逾時秒數)
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_RENDER_TIMEOUT = int(os.getenv("REPORT_RENDER_TIMEOUT", "600"))
+
+# B2-6. final_event_hash 計算模式 (compat: 原本的 Step Hash 陣列雜湊 / merkle: 增量 Merkle 樹根)
+FINAL_HASH_MODE = os.getenv("FINAL_HASH_MODE", "compat")
+
+# B2-7. 證據列表 API 的存取權杖 (未設定時停用 /reports)
+EVIDENCE_ADMIN_TOKEN = os.getenv("EVIDENCE_ADMIN_TOKEN")
+
+# B2-8. 生成結果快取設定 (相同 model/prompt/size 重送時沿用圖檔，預設關閉)
+GENERATION_CACHE = os.getenv("GENERATION_CACHE", "0") == "1"
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", "86400"))
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "1000"))
+
+# B2-9. 衍生圖檔設定 (背景產生的執行緒數與 PDF 內嵌圖片的解析度)
+RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", "2"))
+PDF_IMAGE_DPI = int(os.getenv("PDF_IMAGE_DPI", "150"))
+
+# B2-10. 請求剖析 (帶有 X-Profile: <PROFILE_TOKEN> 標頭的請求以 cProfile 執行；未設定時停用)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(DATA_DIR, "profiles")) # 不可放在 static/
+
+# B2-10a. 指標 (各 worker 定期將計數與直方圖寫入 METRICS_DIR，/metrics 合併所有 worker 的值)
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(DATA_DIR, "metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# B2-11. 保存期限與磁碟配額 (背景清理每 RETENTION_INTERVAL_SECONDS 秒執行一次，0 表示停用)
+#        未結束任務的預覽圖隨會話保存 SESSION_TTL_SECONDS；證據正本引用的圖檔與 JSON 永久保存
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL_SECONDS", "600"))
+RETENTION_GRACE = int(os.getenv("RETENTION_GRACE_SECONDS", "3600")) # 無參照圖檔與暫存檔的保留時間
+PREVIEW_MAX_BYTES = int(os.getenv("PREVIEW_MAX_BYTES", str(2 * 1024 ** 3))) # 未結束任務的預覽圖總量上限
+REPORT_TTL = int(os.getenv("REPORT_TTL_SECONDS", str(7 * 86400))) # PDF 報告可由證據正本重新渲染
+REPORT_MAX_BYTES = int(os.getenv("REPORT_MAX_BYTES", str(5 * 1024 ** 3)))
 
 # === B3. Flask App 初始化 ===
 app = Flask(__name__)
 static_folder = 'static'
 if not os.path.exists(static_folder): os.makedirs(static_folder)
 app.config['UPLOAD_FOLDER'] = static_folder
+if not os.path.exists(DATA_DIR): os.makedirs(DATA_DIR)
 
 # === C1. 工具函式 ===
 def sha256_bytes(b): return hashlib.sha256(b).hexdigest()
 
+def is_sha256_hex(value): return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+# C1-1. 令牌桶限流 (每個行程一份，API 呼叫前取得令牌)
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.per_minute = per_minute; self.lock = threading.Lock()
+        self.tokens = float(per_minute); self.updated = time.monotonic()
+
+    def acquire(self):
+        if self.per_minute <= 0: return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60); self.updated = now
+                if self.tokens >= 1: self.tokens -= 1; return
+                wait = (1 - self.tokens) * 60 / self.per_minute
+            time.sleep(wait)
+
+api_rate_limiter = RateLimiter(API_RATE_LIMIT_PER_MINUTE)
+
+# C1-5. 增量證據鏈：每次生成即延伸雜湊鏈與 Merkle 樹 (RFC 6962 結構，葉節點為 Step Hash)，結束任務時無需重算
+#       chain_hash_i = SHA256(chain_hash_{i-1} + step_hash_i)；Merkle 樹僅保存各完整子樹的頂點 (peaks)
+CHAIN_GENESIS = "0" * 64
+
+def new_evidence_chain(): return {"count": 0, "chain_hash": CHAIN_GENESIS, "merkle_peaks": []}
+
+def merkle_leaf(step_hash): return hashlib.sha256(b"\x00" + bytes.fromhex(step_hash)).digest()
+
+def merkle_node(left, right): return hashlib.sha256(b"\x01" + left + right).digest()
+
+def extend_evidence_chain(chain, step_hash):
+    chain['chain_hash'] = sha256_bytes((chain['chain_hash'] + step_hash).encode('utf-8'))
+    chain['count'] += 1
+    peaks = chain['merkle_peaks']; peaks.append([0, merkle_leaf(step_hash).hex()])
+    while len(peaks) > 1 and peaks[-1][0] == peaks[-2][0]:
+        height, right = peaks.pop(); _, left = peaks.pop()
+        peaks.append([height + 1, merkle_node(bytes.fromhex(left), bytes.fromhex(right)).hex()])
+    return chain
+
+def merkle_root_from_peaks(peaks):
+    if not peaks: return sha256_bytes(b"")
+    root = bytes.fromhex(peaks[-1][1])
+    for _, peak in reversed(peaks[:-1]): root = merkle_node(bytes.fromhex(peak), root)
+    return root.hex()
+
+# 相容模式：原本的 final_event_hash 定義 (所有 Step Hash 的 JSON 陣列再雜湊一次)
+def legacy_final_event_hash(step_hashes): return sha256_bytes(json.dumps(step_hashes, sort_keys=True).encode('utf-8'))
+
+def _merkle_split(n): return 1 << ((n - 1).bit_length() - 1) # 小於 n 的最大 2 的次方
+
+def _merkle_tree_hash(leaves):
+    if len(leaves) == 1: return leaves[0]
+    k = _merkle_split(len(leaves))
+    return merkle_node(_merkle_tree_hash(leaves[:k]), _merkle_tree_hash(leaves[k:]))
+
+# C1-5a. 單一版本的包含證明 (index 由 0 起算)，可在不揭露其他版本內容的情況下驗證其屬於 merkle_root
+def merkle_inclusion_proof(step_hashes, index):
+    def path(leaves, m):
+        if len(leaves) <= 1: return []
+        k = _merkle_split(len(leaves))
+        if m < k: return path(leaves[:k], m) + [_merkle_tree_hash(leaves[k:])]
+        return path(leaves[k:], m - k) + [_merkle_tree_hash(leaves[:k])]
+    return [node.hex() for node in path([merkle_leaf(h) for h in step_hashes], index)]
+
+def verify_merkle_inclusion(step_hash, index, tree_size, proof_path, merkle_root):
+    if index >= tree_size: return False
+    fn, sn, node = index, tree_size - 1, merkle_leaf(step_hash)
+    for sibling in proof_path:
+        sibling = bytes.fromhex(sibling)
+        if sn == 0: return False
+        if fn & 1 or fn == sn:
+            node = merkle_node(sibling, node)
+            while not fn & 1 and fn != 0: fn >>= 1; sn >>= 1
+        else: node = merkle_node(node, sibling)
+        fn >>= 1; sn >>= 1
+    return sn == 0 and node.hex() == merkle_root
+
+# C1-2. PNG 檔頭檢查 (簽章 + IHDR 區塊，回傳寬高)，取代完整的 PIL 解碼
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def validate_png_header(header):
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        raise ValueError("下載的檔案不是有效的 PNG 圖片")
+    width, height = int.from_bytes(header[16:20], 'big'), int.from_bytes(header[20:24], 'big')
+    if not width or not height: raise ValueError("PNG 圖片尺寸無效")
+    return width, height
+
+# C1-3. 指標 (計數、延遲直方圖與即時量測值，由 /stats 輸出 JSON、/metrics 輸出 Prometheus 格式)
+#       gunicorn 的每個 worker 各自累計，並每 flush_interval 秒寫入 directory/<pid>_<id>.json；
+#       輸出時合併所有 worker 的檔案 (計數與直方圖相加)，因此任一 worker 回應的 /metrics 都是全體的值。
+#       已結束 worker 的檔案保留 (計數不倒退)，部署時可清空 METRICS_DIR。
+#       量測值預設於輸出時計算 (會話、Blob Store 等共用狀態)；merge="sum" / "latest" 者為各行程的值，隨檔案寫入後合併
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf"))
+
+class Metrics:
+    def __init__(self, prefix="wesmart_", directory=None, flush_interval=5):
+        self.prefix = prefix; self.directory = directory; self.flush_interval = flush_interval
+        self.lock = threading.Lock(); self.start_lock = threading.Lock()
+        self.counters = {} # (name, labels) -> 值
+        self.timings = {} # (name, labels) -> {"count", "sum", "max", "buckets"}
+        self.gauges = {} # name -> (回傳 {labels: 值} 的函式, merge)
+        self.pid = None; self.path = None; self.flusher = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._attach()
+        with self.lock: self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._attach()
+        with self.lock:
+            t = self.timings.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(HISTOGRAM_BUCKETS)})
+            t['count'] += 1; t['sum'] += seconds; t['max'] = max(t['max'], seconds)
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if seconds <= bound: t['buckets'][i] += 1; break
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try: yield
+        finally: self.observe(name, time.monotonic() - start, **labels)
+
+    def gauge(self, name, fn, merge=None): self.gauges[name] = (fn, merge)
+
+    # C1-3a. 每個行程一個檔案；fork 後 (例如 gunicorn --preload) 的子行程重新計數並改寫自己的檔案
+    def _attach(self):
+        if self.directory is None or self.pid == os.getpid(): return
+        with self.start_lock:
+            if self.pid == os.getpid(): return
+            if self.pid is not None:
+                with self.lock: self.counters.clear(); self.timings.clear()
+            self.path = os.path.join(self.directory, f"{os.getpid()}_{uuid.uuid4().hex[:8]}.json")
+            self.flusher = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+            self.pid = os.getpid(); self.flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try: self.flush()
+            except Exception as e: print(f"指標寫入失敗: {e}")
+
+    def _local_gauges(self):
+        values = {}
+        for name, (fn, merge) in self.gauges.items():
+            if merge is None: continue
+            try: values[name] = fn()
+            except Exception as e: print(f"指標 {name} 計算失敗: {e}")
+        return values
+
+    def flush(self):
+        if self.path is None: return
+        with self.lock:
+            data = {"updated_at": time.time(),
+                    "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                    "timings": [[name, labels, t] for (name, labels), t in self.timings.items()]}
+        data['gauges'] = {name: [[labels, value] for labels, value in values.items()] for name, values in self._local_gauges().items()}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    # C1-3b. 合併所有行程：本行程使用記憶體中的最新值，其他行程讀取其最近一次寫入的檔案
+    def collect(self):
+        with self.lock:
+            counters = dict(self.counters); timings = {key: dict(t, buckets=list(t['buckets'])) for key, t in self.timings.items()}
+        def key(name, labels): return (name, tuple(tuple(pair) for pair in labels))
+        local = {name: [(time.time(), values)] for name, values in self._local_gauges().items() if values}
+        paths = glob.glob(os.path.join(self.directory, "*.json")) if self.directory and os.path.isdir(self.directory) else []
+        for path in paths:
+            if path == self.path: continue
+            try:
+                with open(path, encoding='utf-8') as f: data = json.load(f)
+            except (OSError, ValueError): continue # 寫入中或已刪除
+            for name, labels, value in data['counters']: counters[key(name, labels)] = counters.get(key(name, labels), 0) + value
+            for name, labels, t in data['timings']:
+                merged = timings.setdefault(key(name, labels), {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(HISTOGRAM_BUCKETS)})
+                merged['count'] += t['count']; merged['sum'] += t['sum']; merged['max'] = max(merged['max'], t['max'])
+                merged['buckets'] = [a + b for a, b in zip(merged['buckets'], t['buckets'])]
+            if time.time() - data['updated_at'] > 3 * self.flush_interval: continue # 已結束的 worker 不再計入各行程的量測值
+            for name, values in data.get('gauges', {}).items():
+                if values: local.setdefault(name, []).append((data['updated_at'], {tuple(tuple(pair) for pair in labels): value for labels, value in values}))
+        gauges = {}
+        for name, (fn, merge) in self.gauges.items():
+            if merge is None:
+                try: gauges[name] = fn()
+                except Exception as e: print(f"指標 {name} 計算失敗: {e}")
+            elif local.get(name):
+                if merge == "latest": gauges[name] = max(local[name], key=lambda item: item[0])[1]
+                else:
+                    gauges[name] = {}
+                    for _, values in local[name]:
+                        for labels, value in values.items(): gauges[name][labels] = gauges[name].get(labels, 0) + value
+        return counters, timings, gauges
+
+    def snapshot(self):
+        def label(name, labels): return name + ("{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else "")
+        counters, timings, _ = self.collect()
+        return {
+            "counters": {label(*key): value for key, value in counters.items()},
+            "timings": {label(*key): {"count": t['count'], "sum": t['sum'], "max": t['max'], "avg": t['sum'] / t['count']} for key, t in timings.items()}
+        }
+
+    # C1-3c. Prometheus 文字格式 (直方圖的 bucket 為累計值)
+    def exposition(self):
+        def label(labels, **extra):
+            pairs = [(k, v) for k, v in labels] + list(extra.items())
+            if not pairs: return ""
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs) + "}"
+        counters, timings, gauges = self.collect()
+        lines = []; typed = set()
+        def declare(name, kind):
+            if name not in typed: typed.add(name); lines.append(f"# TYPE {self.prefix}{name} {kind}")
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter"); lines.append(f"{self.prefix}{name}{label(labels)} {value}")
+        for (name, labels), t in sorted(timings.items(), key=lambda item: item[0]):
+            declare(name, "histogram"); cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS, t['buckets']):
+                cumulative += count
+                lines.append(f"{self.prefix}{name}_bucket{label(labels, le='+Inf' if bound == float('inf') else bound)} {cumulative}")
+            lines.append(f"{self.prefix}{name}_sum{label(labels)} {t['sum']}")
+            lines.append(f"{self.prefix}{name}_count{label(labels)} {t['count']}")
+        for name, values in sorted(gauges.items()):
+            declare(name, "gauge")
+            for labels, value in sorted(values.items()): lines.append(f"{self.prefix}{name}{label(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL)
+
+# C1-4. 共用 HTTP 用戶端：keep-alive 連線池、指數退避 + 抖動重試 (遵守 Retry-After)、
+#       每個主機的斷路器與並行上限、連線/讀取分開逾時，並依階段 (api / cdn / font) 記錄延遲
+#       非冪等請求 (POST /images/generations 每次呼叫皆計費) 只在確定未被處理時重試：連線逾時、連線被拒與 429
+class CircuitOpenError(requests.exceptions.ConnectionError): pass
+
+def request_not_sent(e):
+    if isinstance(e, requests.exceptions.ConnectTimeout): return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(e, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+class HttpClient:
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    RETRY_STATUS_NON_IDEMPOTENT = {429}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES, backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX,
+                 per_host_limit=HTTP_PER_HOST_LIMIT, breaker_threshold=HTTP_BREAKER_THRESHOLD, breaker_cooldown=HTTP_BREAKER_COOLDOWN):
+        self.max_retries = max_retries; self.backoff_base = backoff_base; self.backoff_max = backoff_max
+        self.per_host_limit = per_host_limit; self.breaker_threshold = breaker_threshold; self.breaker_cooldown = breaker_cooldown
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+        self.host_slots = {} # host -> BoundedSemaphore
+        self.breakers = {} # host -> {"failures": int, "opened_at": float}
+
+    def _slot(self, host):
+        with self.lock:
+            if host not in self.host_slots: self.host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self.host_slots[host]
+
+    # C1-4a. 斷路器：連續失敗達門檻後暫停呼叫該主機，冷卻後放行試探請求
+    def _check_breaker(self, host):
+        with self.lock:
+            breaker = self.breakers.get(host)
+            if breaker and breaker['failures'] >= self.breaker_threshold and time.monotonic() - breaker['opened_at'] < self.breaker_cooldown:
+                raise CircuitOpenError(f"{host} 暫時無法連線 (斷路器開啟中)")
+
+    def _record(self, host, ok):
+        with self.lock:
+            breaker = self.breakers.setdefault(host, {"failures": 0, "opened_at": 0.0})
+            if ok: breaker['failures'] = 0
+            else: breaker['failures'] += 1; breaker['opened_at'] = time.monotonic()
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try: return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                try: return min(max((parsedate_to_datetime(retry_after) - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0), self.backoff_max)
+                except (TypeError, ValueError): pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))) # full jitter
+
+    # C1-4b. 主機並行上限涵蓋整個回應：stream=True 時直到回應被 close() (或 with 區塊結束) 才釋放名額，
+    #        串流下載的本體也受限制；呼叫端須以 with 使用串流回應
+    def _hold_slot(self, response, slot):
+        close = response.close; released = []
+        def close_and_release():
+            try: close()
+            finally:
+                if not released: released.append(True); slot.release()
+        response.close = close_and_release
+
+    def request(self, method, url, phase, timeout, **kwargs):
+        host = urlsplit(url).netloc
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        retry_status = self.RETRY_STATUS if idempotent else self.RETRY_STATUS_NON_IDEMPOTENT
+        for attempt in range(self.max_retries + 1):
+            self._check_breaker(host)
+            start = time.monotonic(); slot = self._slot(host)
+            slot.acquire()
+            try:
+                try: response = self.session.request(method, url, timeout=timeout, **kwargs)
+                except BaseException: slot.release(); raise
+                if kwargs.get('stream'): self._hold_slot(response, slot)
+                else: slot.release()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(host, ok=False)
+                metrics.observe("http_request_seconds", time.monotonic() - start, phase=phase)
+                metrics.inc("http_errors_total", phase=phase, status=type(e).__name__)
+                if attempt == self.max_retries or not (idempotent or request_not_sent(e)): raise
+                delay = self._backoff(attempt)
+            else:
+                metrics.observe("http_request_seconds", time.monotonic() - start, phase=phase)
+                metrics.inc("http_responses_total", phase=phase, status=response.status_code)
+                self._record(host, ok=response.status_code < 500)
+                if response.status_code not in retry_status or attempt == self.max_retries: return response
+                delay = self._backoff(attempt, response.headers.get('Retry-After')); response.close()
+            metrics.inc("http_retries_total", phase=phase)
+            time.sleep(delay)
+
+    def get(self, url, phase, timeout, **kwargs): return self.request("GET", url, phase, timeout, **kwargs)
+
+    def post(self, url, phase, timeout, **kwargs): return self.request("POST", url, phase, timeout, **kwargs)
+
+http_client = HttpClient()
+
+# === C2-0. PDF 素材快取 (字型、Logo、QR Code；每個行程一份，跨報告共用) ===
+# 字型：渲染子行程啟動時於背景預先下載並驗證 (匯入 app 時不下載)，解析後的字寬/字碼表只做一次，每份報告僅以記憶體中的字型位元組建立獨立子集
+# Logo：解碼後的影像資料只做一次；QR Code：直接以 PIL 影像嵌入，不再寫入 static/ 再讀回
+FONT_PATH = "NotoSansTC.otf"
+FONT_URL = os.getenv("FONT_URL", "https://github.com/googlefonts/noto-cjk/raw/main/Sans/OTF/TraditionalChinese/NotoSansCJKtc-Regular.otf") # 空字串表示不下載 (需自行放置 FONT_PATH)
+FONT_MAGICS = (b"OTTO", b"\x00\x01\x00\x00", b"true")
+LOGO_PATH = "LOGO.jpg"
+
+class PdfAssets:
+    def __init__(self, font_path=FONT_PATH, font_url=FONT_URL, logo_path=LOGO_PATH):
+        self.font_path = font_path; self.font_url = font_url; self.logo_path = logo_path
+        self.lock = threading.RLock()
+        self.font_bytes = None
+        self.font_templates = {} # fontkey -> 已解析的 TTFFont (僅作為複製來源，不輸出)
+        self.logo_info = None
+        self.prefetch_started = False
+
+    # C2-0a. 確保字型存在且格式正確 (下載至暫存檔後原子性改名；多個行程同時啟動時以檔案鎖確保只下載一次)
+    def ensure_font(self):
+        with self.lock:
+            if os.path.exists(self.font_path) or not self.font_url: return
+            lock_file = open(f"{self.font_path}.lock", 'a') if fcntl is not None else None
+            tmp_path = f"{self.font_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                if lock_file is not None: fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if os.path.exists(self.font_path): return # 其他行程已下載完成
+                print("正在下載中文字型...")
+                with http_client.get(self.font_url, phase="font", timeout=(HTTP_CONNECT_TIMEOUT, 120), stream=True) as r:
+                    r.raise_for_status()
+                    with open(tmp_path, "wb") as f:
+                        for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE): f.write(chunk)
+                with open(tmp_path, "rb") as f:
+                    if f.read(4) not in FONT_MAGICS: raise ValueError("下載的字型檔格式無效")
+                os.replace(tmp_path, self.font_path)
+                print("字型下載完成。")
+            except Exception as e:
+                print(f"字型下載失敗: {e}")
+                if os.path.exists(tmp_path): os.remove(tmp_path)
+            finally:
+                if lock_file is not None: lock_file.close()
+
+    # C2-0b. 於背景預先下載並解析字型與 Logo，避免第一份報告承擔延遲 (每個行程只執行一次)
+    def prefetch(self):
+        with self.lock:
+            if self.prefetch_started: return
+            self.prefetch_started = True
+        def run():
+            try: self.load_font(); self.load_logo()
+            except Exception as e: print(f"PDF 素材預載失敗: {e}")
+        threading.Thread(target=run, name="pdf-assets-prefetch", daemon=True).start()
+
+    def load_font(self):
+        with self.lock:
+            if self.font_bytes is None:
+                self.ensure_font()
+                with open(self.font_path, "rb") as f: data = f.read()
+                if data[:4] not in FONT_MAGICS: raise ValueError(f"字型檔格式無效: {self.font_path}")
+                self.font_bytes = data
+            return self.font_bytes
+
+    def load_logo(self):
+        with self.lock:
+            if self.logo_info is None and os.path.exists(self.logo_path):
+                self.logo_info = get_img_info(self.logo_path)
+            return self.logo_info
+
+    # C2-0c. 為單一報告加入字型：複製已解析的字寬/字碼表，並由記憶體位元組開啟新的 TTFont 供該報告的子集化使用
+    #        (依賴 fpdf2==2.7.8 的 TTFFont 結構，失敗時退回標準 add_font)
+    def add_font(self, pdf, family):
+        fontkey = family.lower()
+        try:
+            with self.lock:
+                font_bytes = self.load_font()
+                template = self.font_templates.get(fontkey)
+                if template is None:
+                    template = self.font_templates[fontkey] = TTFFont(pdf, self.font_path, fontkey, "")
+            font = TTFFont.__new__(TTFFont)
+            for slot in TTFFont.__slots__:
+                if slot != "hbfont" and hasattr(template, slot): setattr(font, slot, getattr(template, slot))
+            font.desc = copy.copy(template.desc) # output() 會寫入 font_name、font_file2 與物件編號，每份報告各用一份
+            font.i = len(pdf.fonts) + 1
+            font.ttfont = ttLib.TTFont(io.BytesIO(font_bytes), recalcTimestamp=False, fontNumber=0, lazy=True)
+            font.missing_glyphs = []
+            identities = "\x00 \r\n" + ("0123456789" + pdf.str_alias_nb_pages if pdf.str_alias_nb_pages else "")
+            font.subset = SubsetMap(font, [ord(char) for char in identities])
+            pdf.fonts[fontkey] = font
+        except (AttributeError, TypeError) as e:
+            print(f"字型快取無法使用，改為直接載入: {e}")
+            pdf.add_font(family, "", self.font_path)
+
+    # C2-0d. 預先放入已解碼的 Logo (含 ICC 色彩設定檔時交由 fpdf2 自行處理)
+    def add_logo(self, pdf):
+        info = self.load_logo()
+        if info is None: return None
+        if not info.get("iccp"):
+            images = pdf.image_cache.images
+            images[self.logo_path] = type(info)(info, i=len(images) + 1, usages=0, iccp_i=None)
+        return self.logo_path
+
+    def qr_image(self, data): return qrcode.make(data).get_image()
+
+pdf_assets = PdfAssets()
+
+def warm_pdf_assets(): pdf_assets.prefetch() # 報告渲染行程池的 initializer (gunicorn worker、CLI 與測試匯入 app 時不下載)
+
 # === C2. PDF 報告類別 ===
 class WesmartPDFReport(FPDF):
-    # C2-1. 初始化 (含字型下載)
+    # C2-1. 初始化 (字型與 Logo 取自行程內的素材快取)
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if not os.path.exists("NotoSansTC.otf"):
-            print("正在下載中文字型...")
-            try:
-                r = requests.get("https://github.com/googlefonts/noto-cjk/raw/main/Sans/OTF/TraditionalChinese/NotoSansCJKtc-Regular.otf")
-                r.raise_for_status()
-                with open("NotoSansTC.otf", "wb") as f: f.write(r.content)
-                print("字型下載完成。")
-            except Exception as e: print(f"字型下載失敗: {e}")
-        self.add_font("NotoSansTC", "", "NotoSansTC.otf")
+        pdf_assets.add_font(self, "NotoSansTC")
         self.set_auto_page_break(auto=True, margin=25); self.alias_nb_pages()
-        self.logo_path = "LOGO.jpg" if os.path.exists("LOGO.jpg") else None
+        self.logo_path = pdf_assets.add_logo(self)
     
     # C2-2. 頁首
     def header(self):
@@ -77,12 +585,12 @@ class WesmartPDFReport(FPDF):
         for row in data: self.cell(20); self.cell(45, 10, row[0], align='L'); self.multi_cell(0, 10, row[1], new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L')
     
     # C2-7. 任務細節頁 (已更新為 DALL-E 3 五重雜湊 + 圖片放大 + 強制分頁)
-    def create_generation_details_page(self, proof_data):
+    def create_generation_details_page(self, proof_data, progress=None):
         self.add_page();
         self.chapter_title("一、各版本生成快照")
         
         is_first_snapshot = True # 追蹤迴圈的第一次
-        for snapshot in proof_data['event_proof']['snapshots']:
+        for done_count, snapshot in enumerate(proof_data['event_proof']['snapshots'], 1):
             
             # 每一版本強制分頁
             if not is_first_snapshot:
@@ -134,15 +642,15 @@ class WesmartPDFReport(FPDF):
             # 顯示圖像 (圖片等比放大，確保不超出高度限制)
             self.ln(5)
             try:
-                img_bytes = base64.b64decode(snapshot['content_base64'])
-                img_file_obj = io.BytesIO(img_bytes)
+                # 由 Blob Store 檔案延遲讀取 (舊版 JSON 正本仍內嵌 Base64)
+                if 'blob_path' in snapshot: img_file_obj = os.path.join(app.config['UPLOAD_FOLDER'], snapshot['blob_path'])
+                else: img_file_obj = io.BytesIO(base64.b64decode(snapshot['content_base64']))
                 
-                # 1. 讀取原始尺寸並定義可用區域
-                orig_img = Image.open(img_file_obj)
-                orig_w, orig_h = orig_img.size
+                # 1. 讀取原始尺寸並定義可用區域 (PIL 僅解析檔頭)
+                with Image.open(img_file_obj) as orig_img: orig_w, orig_h = orig_img.size
                 
                 available_width = self.w - self.l_margin - self.r_margin # 頁面寬度
-                MAX_IMAGE_HEIGHT = 100 # 設定圖片最大高度 (單位: mm)
+                MAX_IMAGE_HEIGHT = PDF_MAX_IMAGE_HEIGHT # 設定圖片最大高度 (單位: mm)
                 
                 # 2. 計算縮放比例 (確保圖片在寬高上都不被裁切)
                 ratio_w = available_width / orig_w
@@ -158,8 +666,12 @@ class WesmartPDFReport(FPDF):
                 # 4. 居中放置
                 x_center = self.l_margin + (available_width - draw_w) / 2
                 
-                # 5. 繪製圖片
-                self.image(img_file_obj, x=x_center, y=self.get_y(), w=draw_w, h=draw_h, type='PNG') 
+                # 5. 繪製圖片 (Blob Store 圖檔改用已縮至版面解析度的 JPEG 衍生圖，原圖僅作為雜湊證據)
+                draw_src, draw_type = img_file_obj, 'PNG'
+                if 'blob_path' in snapshot:
+                    try: draw_src, draw_type = renditions.ensure(snapshot['hashes']['file_hash'], "pdf"), 'JPEG'
+                    except Exception as e: print(f"產生 PDF 衍生圖失敗，改用原圖: {e}")
+                self.image(draw_src, x=x_center, y=self.get_y(), w=draw_w, h=draw_h, type=draw_type) 
                 
                 # 6. 移動到圖片下方，並加上間距
                 self.ln(draw_h + 5) 
@@ -167,6 +679,9 @@ class WesmartPDFReport(FPDF):
             except Exception as e: 
                 print(f"在PDF中顯示圖片失敗: {e}")
                 self.ln(5) # 保持間距
+
+            # 回報進度 (已完成的快照數)
+            if progress: progress(done_count)
     
     # C2-8. 結論驗證頁 (已更新為 DALL-E 3 五重雜湊說明)
     def create_conclusion_page(self, proof_data):
@@ -185,93 +700,992 @@ class WesmartPDFReport(FPDF):
         self.set_font("Courier", "B", 11)
         self.multi_cell(0, 8, proof_data['event_proof']['final_event_hash'], border=1, align='C', padding=5)
         qr_data = proof_data['verification']['verify_url']
-        qr = qrcode.make(qr_data); qr_path = os.path.join(app.config['UPLOAD_FOLDER'], f"qr_{proof_data['report_id'][:10]}.png"); qr.save(qr_path)
+        qr_img = pdf_assets.qr_image(qr_data) # 於記憶體中產生，不落地
         self.ln(10); self.set_font("NotoSansTC", "", 10); self.cell(0, 10, "掃描 QR Code 前往驗證頁面", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-        self.image(qr_path, w=50, x=(self.w-50)/2)
+        self.image(qr_img, w=50, x=(self.w-50)/2)
+
+# === C2-9. 背景 PDF 報告渲染 (子行程執行，輸出依 final_event_hash 快取) ===
+# PDF 位於 static/reports/<前兩碼>/<final_event_hash>/，進度檔位於 DATA_DIR/reports/ 供任一 worker 查詢
+def report_paths(final_event_hash, report_id):
+    report_relpath = f"reports/{final_event_hash[:2]}/{final_event_hash}/WesmartAI_Report_{report_id}.pdf"
+    progress_path = os.path.join(DATA_DIR, "reports", f"{final_event_hash}_{report_id}.json")
+    return report_relpath, progress_path
+
+def write_report_progress(progress_path, **fields):
+    tmp_path = f"{progress_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(dict(fields, updated_at=time.time()), f, ensure_ascii=False)
+    os.replace(tmp_path, progress_path)
+
+def read_report_progress(progress_path):
+    try:
+        with open(progress_path, encoding='utf-8') as f: return json.load(f)
+    except (FileNotFoundError, ValueError): return None
+
+# C2-9a. 渲染單一報告 (於行程池的子行程中執行)
+def render_report(json_filepath, report_relpath, progress_path):
+    try:
+        phases = {}; mark = time.monotonic() # 各階段秒數 (子行程無法直接寫入父行程的指標，隨結果回傳)
+        def lap(phase):
+            nonlocal mark
+            now = time.monotonic(); phases[phase] = now - mark; mark = now
+        with open(json_filepath, encoding='utf-8') as f: proof_data = json.load(f)
+        total = len(proof_data['event_proof']['snapshots'])
+        write_report_progress(progress_path, status="rendering", done=0, total=total); lap("load")
+        pdf = WesmartPDFReport(); lap("assets") # 字型與 Logo
+        pdf.create_cover(proof_data); lap("cover")
+        pdf.create_generation_details_page(proof_data, progress=lambda done: write_report_progress(progress_path, status="rendering", done=done, total=total)); lap("snapshots")
+        pdf.create_conclusion_page(proof_data); lap("conclusion")
+
+        report_filepath = os.path.join(app.config['UPLOAD_FOLDER'], report_relpath)
+        os.makedirs(os.path.dirname(report_filepath), exist_ok=True)
+        tmp_path = f"{report_filepath}.{uuid.uuid4().hex}.tmp"
+        pdf.output(tmp_path); os.replace(tmp_path, report_filepath); lap("output") # 圖片壓縮與 PDF 序列化
+        write_report_progress(progress_path, status="done", done=total, total=total)
+        return {"report_relpath": report_relpath, "phases": phases}
+    except Exception as e:
+        print(f"報告生成失敗: {e}")
+        write_report_progress(progress_path, status="error", error=f"報告生成失敗: {str(e)}")
+        raise
+
+# C2-9b. 行程池 (spawn 啟動，避免複製 worker 內的執行緒狀態)
+#        子行程異常結束 (例如被 OOM 終止) 後整個行程池會永久處於 BrokenProcessPool，需捨棄並重新建立
+report_executor = None
+report_executor_lock = threading.Lock()
+
+def get_report_executor():
+    global report_executor
+    with report_executor_lock:
+        if report_executor is None:
+            report_executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=warm_pdf_assets)
+        return report_executor
+
+def discard_report_executor(executor):
+    global report_executor
+    with report_executor_lock:
+        if report_executor is not executor: return # 其他執行緒已替換
+        report_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# C2-9c. 提交渲染：已有 PDF 回傳 "done"；其他 worker 正在渲染則不重複提交
+def submit_report(json_filepath, final_event_hash, report_id):
+    report_relpath, progress_path = report_paths(final_event_hash, report_id)
+    report_filepath = os.path.join(app.config['UPLOAD_FOLDER'], report_relpath)
+    if os.path.exists(report_filepath):
+        try: os.utime(report_filepath) # 更新時間戳，背景清理依最近使用時間淘汰
+        except FileNotFoundError: pass
+        else: return "done"
+    os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+    try:
+        fd = os.open(progress_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f: json.dump({"status": "queued", "updated_at": time.time()}, f)
+    except FileExistsError:
+        progress = read_report_progress(progress_path)
+        if progress and progress['status'] in ("queued", "rendering") and time.time() - progress['updated_at'] < REPORT_RENDER_TIMEOUT:
+            return progress['status']
+        write_report_progress(progress_path, status="queued") # 先前失敗、逾時或 PDF 已被清除，重新渲染
+    try:
+        executor = get_report_executor()
+        try: future = executor.submit(render_report, json_filepath, report_relpath, progress_path)
+        except BrokenProcessPool:
+            discard_report_executor(executor); executor = get_report_executor()
+            future = executor.submit(render_report, json_filepath, report_relpath, progress_path)
+    except Exception as e:
+        write_report_progress(progress_path, status="error", error=f"報告生成失敗: {str(e)}") # 未提交成功，不可留在 queued
+        raise
+    future.add_done_callback(lambda future: record_report_render(future, executor, progress_path))
+    return "queued"
+
+def record_report_render(future, executor, progress_path):
+    if future.exception():
+        metrics.inc("report_renders_total", status="error")
+        if isinstance(future.exception(), BrokenProcessPool): # 子行程來不及寫入錯誤狀態
+            write_report_progress(progress_path, status="error", error="報告生成失敗: 渲染行程異常結束，請重試")
+            discard_report_executor(executor)
+        return
+    metrics.inc("report_renders_total", status="done")
+    for phase, seconds in future.result()['phases'].items(): metrics.observe("report_phase_seconds", seconds, phase=phase)
+
+# === C3. 內容定址圖檔儲存 (Blob Store) ===
+# 圖檔以 file_hash 為鍵存於 static/blobs/<前兩碼>/<file_hash>.png，相同內容只存一份；
+# 參照計數記錄於 DATA_DIR/blobs.sqlite3 (會話預覽與證據正本各持有一份參照)
+class BlobStore:
+    def __init__(self, root=os.path.join(static_folder, "blobs"), index_path=os.path.join(DATA_DIR, "blobs.sqlite3"), ext=".png"):
+        self.root = root; self.index_path = index_path; self.ext = ext
+        self.local = threading.local()
+        if not os.path.exists(root): os.makedirs(root)
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, refcount INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, pinned INTEGER NOT NULL DEFAULT 0)")
+        if "pinned" not in [row[1] for row in conn.execute("PRAGMA table_info(blobs)")]: # 舊版索引補上欄位
+            try: conn.execute("ALTER TABLE blobs ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError: pass # 其他 worker 已同時補上
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    # C3-1. 路徑 (relpath 相對於 static/，供 url_for 使用)
+    def relpath(self, file_hash): return f"blobs/{file_hash[:2]}/{file_hash}{self.ext}"
+
+    def path(self, file_hash): return os.path.join(self.root, file_hash[:2], file_hash + self.ext)
+
+    # C3-2. 串流寫入：邊寫入暫存檔邊更新 SHA-256，完成後以 os.replace 原子性地放到最終位置 (已存在相同雜湊則直接去重)
+    #       validate_header(header) 於收到前 header_size 個位元組時呼叫，不合法時拋出 ValueError
+    def put_stream(self, chunks, validate_header=None, header_size=24):
+        hasher = hashlib.sha256(); size = 0; header = b''
+        tmp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    if not chunk: continue
+                    if validate_header and len(header) < header_size:
+                        header += chunk[:header_size - len(header)]
+                        if len(header) == header_size: validate_header(header)
+                    hasher.update(chunk); f.write(chunk); size += len(chunk)
+            if validate_header and len(header) < header_size: validate_header(header)
+            file_hash = hasher.hexdigest(); path = self.path(file_hash)
+            if os.path.exists(path): os.remove(tmp_path)
+            else: os.makedirs(os.path.dirname(path), exist_ok=True); os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+        self._conn().execute("INSERT OR IGNORE INTO blobs (hash, size, refcount, created_at) VALUES (?, ?, 0, ?)", (file_hash, size, time.time()))
+        return file_hash
+
+    def put(self, data, validate_header=None): return self.put_stream([data], validate_header)
+
+    def open(self, file_hash): return open(self.path(file_hash), 'rb')
+
+    def hashes(self): return {row[0] for row in self._conn().execute("SELECT hash FROM blobs")}
+
+    def size(self, file_hash):
+        row = self._conn().execute("SELECT size FROM blobs WHERE hash = ?", (file_hash,)).fetchone()
+        return row[0] if row else 0
+
+    def usage(self): # 依狀態 (證據正本引用 / 僅預覽或快取引用 / 無參照) 分別統計圖檔數與位元組數
+        rows = self._conn().execute("SELECT CASE WHEN pinned THEN 'pinned' WHEN refcount > 0 THEN 'referenced' ELSE 'unreferenced' END AS state, COUNT(*), COALESCE(SUM(size), 0) FROM blobs GROUP BY state").fetchall()
+        return {state: (count, size) for state, count, size in rows}
+
+    # C3-3. 參照計數
+    def incref(self, hashes): self._add_refs(hashes, 1)
+
+    def decref(self, hashes): self._add_refs(hashes, -1)
+
+    # C3-3a. 證據正本引用的圖檔永久保存 (不受參照計數與配額影響)
+    def pin(self, hashes):
+        if hashes: self._conn().executemany("UPDATE blobs SET pinned = 1 WHERE hash = ?", [(h,) for h in hashes])
+
+    def _add_refs(self, hashes, delta):
+        if not hashes: return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("UPDATE blobs SET refcount = MAX(refcount + ?, 0) WHERE hash = ?", [(delta, h) for h in hashes])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+
+    # C3-4. 垃圾回收：刪除無參照的圖檔與中斷寫入的暫存檔
+    #       索引中沒有紀錄的 <file_hash>.png 一律保留 (DATA_DIR 遺失或指向他處時，可能是證據正本引用的原圖)；
+    #       舊版的 static/preview_v*.png 是先前已發出的下載連結，同樣保留
+    def gc(self, grace_seconds=3600):
+        conn = self._conn(); cutoff = time.time() - grace_seconds; freed = 0
+        for file_hash, size in conn.execute("SELECT hash, size FROM blobs WHERE refcount <= 0 AND pinned = 0 AND created_at < ?", (cutoff,)).fetchall():
+            if evidence_index.has_file(file_hash): self.pin([file_hash]); continue # 索引重建後遺漏的證據圖檔
+            conn.execute("DELETE FROM blobs WHERE hash = ? AND refcount <= 0 AND pinned = 0", (file_hash,))
+            try: os.remove(self.path(file_hash)); freed += size
+            except FileNotFoundError: pass
+        candidates = [os.path.join(d, name) for d, _, names in os.walk(self.root) for name in names if name.endswith(".tmp")]
+        candidates += [os.path.join(static_folder, name) for name in os.listdir(static_folder) if name.startswith(".tmp_") and name.endswith(".png")]
+        for path in candidates:
+            try:
+                if os.path.getmtime(path) >= cutoff: continue
+                size = os.path.getsize(path); os.remove(path); freed += size
+            except FileNotFoundError: pass
+        return freed
+
+blob_store = BlobStore()
+metrics.gauge("blob_store_files", lambda: {(("state", state),): count for state, (count, _) in blob_store.usage().items()})
+metrics.gauge("blob_store_bytes", lambda: {(("state", state),): size for state, (_, size) in blob_store.usage().items()})
+
+def preview_blob_hashes(state): return [p['hashes']['file_hash'] for p in state['previews']]
+
+# === C4. 證據索引 (DATA_DIR/evidence.sqlite3) ===
+# 結束任務時寫入，可依 final_event_hash / step_hash / file_hash、申請人與出證時間查詢，免去掃描 PROOF_DIR 中的所有證據檔
+class EvidenceIndex:
+    def __init__(self, path=os.path.join(DATA_DIR, "evidence.sqlite3")):
+        self.path = path
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS reports (report_id TEXT PRIMARY KEY, final_event_hash TEXT NOT NULL, applicant TEXT NOT NULL, issued_at TEXT NOT NULL, proof_path TEXT NOT NULL, snapshot_count INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS snapshots (report_id TEXT NOT NULL, version_index INTEGER NOT NULL, step_hash TEXT NOT NULL, file_hash TEXT NOT NULL, PRIMARY KEY (report_id, version_index))")
+        conn.execute("CREATE INDEX IF NOT EXISTS reports_final_event_hash ON reports (final_event_hash)")
+        conn.execute("CREATE INDEX IF NOT EXISTS reports_issued_at ON reports (issued_at, report_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS reports_applicant ON reports (applicant, issued_at, report_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS snapshots_step_hash ON snapshots (step_hash)")
+        conn.execute("CREATE INDEX IF NOT EXISTS snapshots_file_hash ON snapshots (file_hash)")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    # C4-1. 寫入 (同一 report_id 重複寫入時覆蓋)
+    def add(self, report, snapshots, proof_path):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert(conn, report, snapshots, proof_path)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+
+    def _insert(self, conn, report, snapshots, proof_path):
+        conn.execute("INSERT OR REPLACE INTO reports (report_id, final_event_hash, applicant, issued_at, proof_path, snapshot_count) VALUES (?, ?, ?, ?, ?, ?)",
+                     (report['report_id'], report['final_event_hash'], report['applicant'], report['issued_at'], proof_path, len(snapshots)))
+        conn.execute("DELETE FROM snapshots WHERE report_id = ?", (report['report_id'],))
+        conn.executemany("INSERT INTO snapshots (report_id, version_index, step_hash, file_hash) VALUES (?, ?, ?, ?)",
+                         [(report['report_id'], s['version_index'], s['step_hash'], s['file_hash']) for s in snapshots])
+
+    # C4-2. 依雜湊查詢 (任一種雜湊皆可)
+    def lookup(self, value):
+        conn = self._conn(); matches = []
+        for row in conn.execute("SELECT report_id, final_event_hash, applicant, issued_at, snapshot_count FROM reports WHERE final_event_hash = ?", (value,)):
+            matches.append(dict(row, match="final_event_hash"))
+        for column in ("step_hash", "file_hash"):
+            query = f"SELECT r.report_id, r.final_event_hash, r.applicant, r.issued_at, r.snapshot_count, s.version_index FROM snapshots s JOIN reports r USING (report_id) WHERE s.{column} = ?"
+            for row in conn.execute(query, (value,)): matches.append(dict(row, match=column))
+        return matches
+
+    def proof_file(self, value): # report_id 或 final_event_hash 對應的證據檔路徑
+        row = self._conn().execute("SELECT proof_path FROM reports WHERE report_id = ? OR final_event_hash = ? LIMIT 1", (value, value)).fetchone()
+        return row[0] if row else None
+
+    # C4-3. 分頁列表 (依出證時間由新到舊，以 cursor 接續上一頁)
+    def list(self, applicant=None, since=None, until=None, limit=50, cursor=None):
+        clauses, params = [], []
+        if applicant: clauses.append("applicant = ?"); params.append(applicant)
+        if since: clauses.append("issued_at >= ?"); params.append(since)
+        if until: clauses.append("issued_at < ?"); params.append(until)
+        if cursor:
+            issued_at, report_id = cursor.split("|", 1)
+            clauses.append("(issued_at, report_id) < (?, ?)"); params += [issued_at, report_id]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = [dict(row) for row in self._conn().execute(
+            f"SELECT report_id, final_event_hash, applicant, issued_at, snapshot_count FROM reports {where} ORDER BY issued_at DESC, report_id DESC LIMIT ?", params + [limit + 1])]
+        next_cursor = f"{rows[limit - 1]['issued_at']}|{rows[limit - 1]['report_id']}" if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    # C4-4. 由磁碟上的證據檔重建索引 (串流解析，適用於內嵌 Base64 的舊版大型檔案)
+    def file_hashes(self): return [row[0] for row in self._conn().execute("SELECT DISTINCT file_hash FROM snapshots")]
+
+    def has_file(self, file_hash): return self._conn().execute("SELECT 1 FROM snapshots WHERE file_hash = ? LIMIT 1", (file_hash,)).fetchone() is not None
+
+    def rebuild(self, paths, batch_size=500):
+        conn = self._conn(); count = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for path in paths:
+                meta = {}
+                with open(path, 'rb') as f:
+                    snapshots = [{"version_index": int(s['version_index']), "step_hash": s['hashes']['step_hash'], "file_hash": s['hashes']['file_hash']}
+                                 for s in verify_proof.iter_snapshots(f, meta)]
+                report = {"report_id": meta['report_id'], "final_event_hash": meta['event_proof.final_event_hash'],
+                          "applicant": meta.get('applicant') or "", "issued_at": meta.get('issued_at') or ""}
+                self._insert(conn, report, snapshots, path); count += 1
+                if count % batch_size == 0: conn.execute("COMMIT"); conn.execute("BEGIN IMMEDIATE")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+        return count
+
+evidence_index = EvidenceIndex()
+
+def proof_path(report_id): return os.path.join(PROOF_DIR, report_id[:2], f"proof_event_{report_id}.json") # 分層存放，避免單一目錄過大
+
+# C4-5. 啟動時的一次性遷移 (以 blobs.sqlite3 的 user_version 記錄是否已完成)：
+#       舊版寫在 static/ 的證據檔移至 PROOF_DIR 並重建索引；既有證據正本引用的圖檔補上 pinned，不計入預覽配額也不被清理
+def migrate_evidence():
+    conn = blob_store._conn()
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= 1: return
+    moved = []
+    for path in glob.glob(os.path.join(static_folder, "**", "proof_event_*.json"), recursive=True):
+        target = proof_path(os.path.basename(path)[len("proof_event_"):-len(".json")])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try: os.replace(path, target); moved.append(target)
+        except FileNotFoundError: pass # 其他 worker 已移動
+    if moved: evidence_index.rebuild(moved); print(f"已將 {len(moved)} 份證據檔移至 {PROOF_DIR}")
+    blob_store.pin(evidence_index.file_hashes())
+    conn.execute("PRAGMA user_version = 1")
+
+try: migrate_evidence()
+except Exception as e: print(f"證據檔遷移失敗 (下次啟動時重試): {e}")
+
+# === C5. 生成結果快取 (DATA_DIR/generation_cache.sqlite3，多個 worker 共用；預設關閉) ===
+# 以 (model, prompt_hash, size_hash) 為鍵，命中時沿用先前下載的圖檔，但時間戳與 Step Hash 仍重新產生，
+# 快照以 replay_of 標記其重播自哪一個 file_hash。快取本身持有一份 Blob 參照，淘汰時釋放
+class GenerationCache:
+    def __init__(self, path=os.path.join(DATA_DIR, "generation_cache.sqlite3"), ttl=GENERATION_CACHE_TTL, max_entries=GENERATION_CACHE_MAX_ENTRIES):
+        self.path = path; self.ttl = ttl; self.max_entries = max_entries
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, file_hash TEXT NOT NULL, revised_prompt TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    # C5-1. 快取鍵沿用證據中的 prompt_hash 與 size_hash
+    def key(self, model, prompt, size):
+        return sha256_bytes(json.dumps([model, sha256_bytes(prompt.encode('utf-8')), sha256_bytes(size.encode('utf-8'))]).encode('utf-8'))
+
+    # C5-2. 查詢 (過期或圖檔已不存在時視為未命中)
+    def get(self, key):
+        conn = self._conn(); now = time.time()
+        row = conn.execute("SELECT file_hash, revised_prompt, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[2] > self.ttl or not os.path.exists(blob_store.path(row[0])): return None
+        conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        return {"file_hash": row[0], "revised_prompt": row[1]}
+
+    # C5-3. 寫入並依 TTL 與筆數上限淘汰 (最久未使用者優先)
+    def put(self, key, file_hash, revised_prompt):
+        conn = self._conn(); now = time.time(); released = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT file_hash FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None: released.append(row[0])
+            conn.execute("INSERT OR REPLACE INTO entries (key, file_hash, revised_prompt, created_at, last_used) VALUES (?, ?, ?, ?, ?)", (key, file_hash, revised_prompt, now, now))
+            expired = conn.execute("SELECT key, file_hash FROM entries WHERE created_at < ?", (now - self.ttl,)).fetchall()
+            overflow = max(conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - len(expired) - self.max_entries, 0)
+            if overflow:
+                expired += conn.execute("SELECT key, file_hash FROM entries WHERE created_at >= ? ORDER BY last_used LIMIT ?", (now - self.ttl, overflow)).fetchall()
+            conn.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in expired])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+        blob_store.incref([file_hash])
+        blob_store.decref(released + [h for _, h in expired])
+        if expired: metrics.inc("generation_cache_evictions_total", len(expired))
+
+generation_cache = GenerationCache() if GENERATION_CACHE else None
+
+# === C6. 衍生圖檔 (縮圖、WebP/JPEG 預覽與 PDF 版面解析度 JPEG；原始 PNG 保持不變，作為雜湊證據) ===
+# 存於 static/renditions/<前兩碼>/<file_hash>_<名稱><副檔名>，內容完全由原圖決定，可永久快取
+PDF_MAX_IMAGE_WIDTH = 190 # A4 寬度扣除左右邊界 (mm)
+PDF_MAX_IMAGE_HEIGHT = 100 # PDF 中圖片的最大高度 (mm)
+RENDITIONS = {
+    "thumb": {"box": (256, 256), "format": "WEBP", "ext": ".webp", "mimetype": "image/webp", "options": {"quality": 75, "method": 4}},
+    "preview": {"box": (1024, 1024), "format": "WEBP", "ext": ".webp", "mimetype": "image/webp", "options": {"quality": 82, "method": 4}},
+    "preview_jpg": {"box": (1024, 1024), "format": "JPEG", "ext": ".jpg", "mimetype": "image/jpeg", "options": {"quality": 85, "optimize": True, "progressive": True}},
+    "pdf": {"box": (round(PDF_MAX_IMAGE_WIDTH / 25.4 * PDF_IMAGE_DPI), round(PDF_MAX_IMAGE_HEIGHT / 25.4 * PDF_IMAGE_DPI)),
+            "format": "JPEG", "ext": ".jpg", "mimetype": "image/jpeg", "options": {"quality": 88, "optimize": True}},
+}
+RENDITION_PREWARM = ("thumb", "preview", "pdf") # 生成後即於背景產生
+
+class Renditions:
+    def __init__(self, root=os.path.join(static_folder, "renditions"), workers=RENDITION_WORKERS):
+        self.root = root; self.workers = workers
+        self.executor = None; self.lock = threading.Lock()
+
+    def relpath(self, file_hash, name): return f"renditions/{file_hash[:2]}/{file_hash}_{name}{RENDITIONS[name]['ext']}"
+
+    def path(self, file_hash, name): return os.path.join(static_folder, self.relpath(file_hash, name))
+
+    # C6-1. 產生單一衍生圖 (已存在則直接回傳；寫入暫存檔後以 os.replace 原子性地放到最終位置)
+    def ensure(self, file_hash, name):
+        path = self.path(file_hash, name); spec = RENDITIONS[name]
+        if os.path.exists(path): return path
+        start = time.monotonic()
+        with Image.open(blob_store.path(file_hash)) as img:
+            img.thumbnail(spec['box'], Image.LANCZOS, reducing_gap=3.0)
+            if spec['format'] == "JPEG" and img.mode != "RGB":
+                rgba = img.convert("RGBA"); img = Image.new("RGB", rgba.size, (255, 255, 255)); img.paste(rgba, mask=rgba.getchannel("A"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                img.save(tmp_path, spec['format'], **spec['options']); os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path): os.remove(tmp_path)
+                raise
+        metrics.observe("rendition_seconds", time.monotonic() - start, rendition=name)
+        metrics.inc("rendition_bytes_total", os.path.getsize(path), rendition=name)
+        return path
+
+    # C6-2. 於背景執行緒產生 (不佔用請求與生成工作的時間)
+    def schedule(self, file_hash, names=RENDITION_PREWARM):
+        with self.lock:
+            if self.executor is None: self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rendition")
+        for name in names: self.executor.submit(self._ensure_quietly, file_hash, name)
 
-# === D1. 全域狀態 ===
-session_previews = []
-latest_proof_data = None
+    def _ensure_quietly(self, file_hash, name):
+        try: self.ensure(file_hash, name)
+        except Exception as e: print(f"產生衍生圖 {name} 失敗 ({file_hash}): {e}")
 
-# === D2. 首頁 (重置狀態) ===
+    # C6-3. 刪除原圖已不存在的衍生圖
+    def prune(self, known_hashes, grace_seconds=3600):
+        cutoff = time.time() - grace_seconds; freed = 0
+        for d, _, names in os.walk(self.root):
+            for name in names:
+                if name[:64] in known_hashes: continue
+                path = os.path.join(d, name)
+                try:
+                    if os.path.getmtime(path) >= cutoff: continue
+                    size = os.path.getsize(path); os.remove(path); freed += size
+                except FileNotFoundError: pass
+        return freed
+
+renditions = Renditions()
+
+# === C7. 請求剖析 (除錯用；剖析檔寫入 PROFILE_DIR，可用 python -m pstats 或 snakeviz 檢視) ===
+# 同一行程同時只能有一個 cProfile (Python 3.12 起以 sys.monitoring 實作，第二個 enable() 會拋出 ValueError)：
+# 以全域鎖串行化，已有剖析進行中時略過 (回應標頭 X-Profile-Skipped)，不讓請求失敗
+profile_lock = threading.Lock()
+
+def dump_profile(profiler, label):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = f"{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S')}_{label}_{uuid.uuid4().hex[:8]}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+    return filename
+
+@app.before_request
+def start_profile():
+    token = request.headers.get('X-Profile')
+    if not (PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN)): return
+    if not profile_lock.acquire(blocking=False): g.profile_skipped = "busy"; return
+    profiler = cProfile.Profile()
+    try: profiler.enable()
+    except ValueError: profile_lock.release(); g.profile_skipped = "active"; return # 其他剖析工具已在執行
+    g.profiler = profiler
+
+@app.after_request
+def stop_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        try:
+            profiler.disable()
+            response.headers['X-Profile-Dump'] = dump_profile(profiler, request.endpoint or "unknown")
+        finally: profile_lock.release()
+    elif getattr(g, 'profile_skipped', None): response.headers['X-Profile-Skipped'] = g.profile_skipped
+    return response
+
+@app.teardown_request
+def release_profile(exc): # after_request 未執行時 (例如回應處理失敗) 仍須釋放剖析鎖
+    profiler = g.pop('profiler', None)
+    if profiler is not None: profiler.disable(); profile_lock.release()
+
+# === D1. 會話儲存 (取代全域 session_previews / latest_proof_data) ===
+# 每個瀏覽器以 cookie 中的 session ID 區分，狀態格式為 {"previews": [...], "proof": None | dict, "jobs": {job_id: dict}, "chain": 證據鏈, "preview_bytes": int}
+# preview_bytes 為尚未結束任務的預覽圖位元組數 (背景清理據此計算預覽配額；結束任務後圖檔改由證據正本持有)
+class SessionLimitError(Exception): pass
+
+def new_session_state(): return {"previews": [], "proof": None, "jobs": {}, "chain": new_evidence_chain(), "preview_bytes": 0}
+
+# 取得與預覽紀錄一致的證據鏈 (舊版會話沒有 chain 時由既有紀錄重建)
+def session_evidence_chain(state):
+    chain = state.get('chain')
+    if chain is None or chain['count'] != len(state['previews']):
+        chain = new_evidence_chain()
+        for preview in state['previews']: extend_evidence_chain(chain, preview['hashes']['step_hash'])
+    return chain
+
+def session_state_size(state): return len(json.dumps(state, ensure_ascii=False))
+
+def check_session_limits(state, size):
+    if len(state['previews']) > SESSION_MAX_PREVIEWS:
+        raise SessionLimitError(f"單一任務最多 {SESSION_MAX_PREVIEWS} 個預覽版本，請先結束任務")
+    if size > SESSION_MAX_BYTES:
+        raise SessionLimitError("單一任務暫存資料已超過上限，請先結束任務")
+
+# D1-1. 行程內儲存 (TTL + LRU 淘汰，限單一 worker 使用)
+# on_release(state) 於會話被重置或淘汰時呼叫，用以釋放其持有的圖檔參照
+class MemorySessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX_SESSIONS, max_total_bytes=SESSION_MAX_TOTAL_BYTES, on_release=None):
+        self.ttl = ttl; self.max_sessions = max_sessions; self.max_total_bytes = max_total_bytes
+        self.on_release = on_release or (lambda state: None)
+        self.lock = threading.RLock()
+        self.entries = OrderedDict() # sid -> (state, size, touched_at)
+        self.total_bytes = 0; self.preview_bytes = 0
+
+    def _pop(self, sid):
+        old = self.entries.pop(sid, None)
+        if old: self.total_bytes -= old[1]; self.preview_bytes -= old[0].get('preview_bytes', 0); self.on_release(old[0])
+        return old
+
+    def _evict(self, now):
+        while self.entries:
+            sid, (state, size, touched_at) = next(iter(self.entries.items()))
+            over_limit = len(self.entries) > self.max_sessions or self.total_bytes > self.max_total_bytes
+            if not over_limit and now - touched_at <= self.ttl: break
+            self._pop(sid)
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None or time.time() - entry[2] > self.ttl: return new_session_state()
+            self.entries.move_to_end(sid)
+            return copy.deepcopy(entry[0])
+
+    def update(self, sid, fn):
+        with self.lock:
+            state = self.get(sid)
+            result = fn(state)
+            size = session_state_size(state)
+            check_session_limits(state, size)
+            old = self.entries.pop(sid, None)
+            if old:
+                self.total_bytes -= old[1]; self.preview_bytes -= old[0].get('preview_bytes', 0)
+                if time.time() - old[2] > self.ttl: self.on_release(old[0]) # 已過期的舊狀態被新狀態取代
+            self.entries[sid] = (state, size, time.time()); self.total_bytes += size; self.preview_bytes += state.get('preview_bytes', 0)
+            self._evict(time.time())
+            return result
+
+    def reset(self, sid):
+        with self.lock: self._pop(sid)
+
+    def count(self):
+        with self.lock: return len(self.entries)
+
+    # D1-1a. 背景清理：移除過期會話；預覽圖超過配額時逐一淘汰最久未使用、且仍持有預覽圖的會話
+    #        (已結束任務的會話 preview_bytes 為 0，保留其 proof 供 /create_report 使用)
+    def expire(self):
+        with self.lock: self._evict(time.time())
+
+    def evict_oldest(self):
+        with self.lock:
+            sid = next((sid for sid, entry in self.entries.items() if entry[0].get('preview_bytes', 0) > 0), None)
+            if sid is None: return False
+            self._pop(sid); return True
+
+    def usage(self):
+        with self.lock: return {"sessions": len(self.entries), "previews": sum(len(entry[0]['previews']) for entry in self.entries.values()), "bytes": self.total_bytes, "preview_bytes": self.preview_bytes}
+
+# D1-2. SQLite 共用儲存 (多個 gunicorn worker / 執行緒共用同一個資料庫檔)
+class SQLiteSessionStore:
+    def __init__(self, path=os.path.join(DATA_DIR, "sessions.sqlite3"), ttl=SESSION_TTL, max_sessions=SESSION_MAX_SESSIONS, max_total_bytes=SESSION_MAX_TOTAL_BYTES, on_release=None):
+        self.path = path; self.ttl = ttl; self.max_sessions = max_sessions; self.max_total_bytes = max_total_bytes
+        self.on_release = on_release or (lambda state: None)
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, state TEXT NOT NULL, size INTEGER NOT NULL, updated_at REAL NOT NULL, preview_bytes INTEGER NOT NULL DEFAULT 0)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        if "preview_bytes" not in [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]: # 舊版資料庫補上欄位
+            try: conn.execute("ALTER TABLE sessions ADD COLUMN preview_bytes INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError: pass # 其他 worker 已同時補上
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _load(self, conn, sid, released=None):
+        row = conn.execute("SELECT state, updated_at FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None: return new_session_state()
+        if time.time() - row[1] > self.ttl:
+            if released is not None: released.append(json.loads(row[0]))
+            return new_session_state()
+        return json.loads(row[0])
+
+    def _evict(self, conn, now, released):
+        victims = [row[0] for row in conn.execute("SELECT sid FROM sessions WHERE updated_at < ?", (now - self.ttl,))]
+        victims += [row[0] for row in conn.execute("SELECT sid FROM sessions WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?", (now - self.ttl, self.max_sessions))]
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM sessions").fetchone()[0]
+        if total > self.max_total_bytes:
+            evicted = set(victims)
+            for sid, size in conn.execute("SELECT sid, size FROM sessions ORDER BY updated_at").fetchall():
+                if total <= self.max_total_bytes: break
+                total -= size
+                if sid not in evicted: victims.append(sid)
+        for sid in victims:
+            row = conn.execute("SELECT state FROM sessions WHERE sid = ?", (sid,)).fetchone()
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            if row: released.append(json.loads(row[0]))
+
+    def get(self, sid): return self._load(self._conn(), sid)
+
+    def update(self, sid, fn):
+        conn = self._conn(); released = []
+        conn.execute("BEGIN IMMEDIATE") # 寫入鎖：跨 worker 的讀-改-寫保持原子性
+        try:
+            state = self._load(conn, sid, released)
+            result = fn(state)
+            blob = json.dumps(state, ensure_ascii=False)
+            check_session_limits(state, len(blob))
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO sessions (sid, state, size, updated_at, preview_bytes) VALUES (?, ?, ?, ?, ?)", (sid, blob, len(blob), now, state.get('preview_bytes', 0)))
+            self._evict(conn, now, released)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+        for old_state in released: self.on_release(old_state)
+        return result
+
+    def reset(self, sid):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state FROM sessions WHERE sid = ?", (sid,)).fetchone()
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+        if row: self.on_release(json.loads(row[0]))
+
+    def count(self): return self._conn().execute("SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (time.time() - self.ttl,)).fetchone()[0]
+
+    def expire(self): self._transaction(lambda conn, released: self._evict(conn, time.time(), released))
+
+    def evict_oldest(self):
+        def evict(conn, released):
+            row = conn.execute("SELECT sid, state FROM sessions WHERE preview_bytes > 0 ORDER BY updated_at LIMIT 1").fetchone()
+            if row is None: return False
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (row[0],)); released.append(json.loads(row[1]))
+            return True
+        return self._transaction(evict)
+
+    def _transaction(self, fn):
+        conn = self._conn(); released = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, released)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK"); raise
+        for old_state in released: self.on_release(old_state)
+        return result
+
+    def usage(self):
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(json_array_length(state, '$.previews')), 0), COALESCE(SUM(size), 0), COALESCE(SUM(preview_bytes), 0) FROM sessions WHERE updated_at >= ?",
+                                   (time.time() - self.ttl,)).fetchone()
+        return {"sessions": row[0], "previews": row[1], "bytes": row[2], "preview_bytes": row[3]}
+
+# D1-3. 依環境變數選擇儲存後端 (會話釋放時一併釋放預覽圖的參照)
+def release_session_blobs(state): blob_store.decref(preview_blob_hashes(state))
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == "sqlite": return SQLiteSessionStore(on_release=release_session_blobs)
+    if backend == "memory": return MemorySessionStore(on_release=release_session_blobs)
+    raise ValueError(f"未知的 SESSION_BACKEND: {backend}")
+
+session_store = create_session_store()
+metrics.gauge("sessions", lambda: {(): session_store.usage()['sessions']})
+metrics.gauge("session_previews", lambda: {(): session_store.usage()['previews']})
+metrics.gauge("session_state_bytes", lambda: {(): session_store.usage()['bytes']})
+metrics.gauge("session_preview_bytes", lambda: {(): session_store.usage()['preview_bytes']})
+
+# D1-4. 每個請求綁定 session ID (cookie)
+@app.before_request
+def load_session_id():
+    sid = request.cookies.get(SESSION_COOKIE, '')
+    g.new_sid = not (len(sid) == 32 and all(c in '0123456789abcdef' for c in sid))
+    g.sid = uuid.uuid4().hex if g.new_sid else sid
+
+@app.after_request
+def save_session_id(response):
+    if getattr(g, 'new_sid', False):
+        response.set_cookie(SESSION_COOKIE, g.sid, max_age=SESSION_TTL, httponly=True, samesite='Lax')
+    return response
+
+# === D2. 首頁 (僅重置此瀏覽器的狀態) ===
 @app.route('/')
 def index():
-    global session_previews, latest_proof_data
-    session_previews = []
-    latest_proof_data = None
+    session_store.reset(g.sid)
     return render_template('index.html', api_key_set=bool(API_key))
 
-# === E1. /generate: 步驟1: 生成預覽圖 (已升級為 DALL-E 3) ===
-@app.route('/generate', methods=['POST'])
-def generate():
-    if not API_key: 
-        return jsonify({"error": "後端尚未設定 OPENAI_API_KEY 環境變數"}), 500
-    
-    data = request.json
-    prompt = data.get('prompt')
-    size = data.get('size') # 從 index.html 獲取 "1024x1024" 格式
-    if not prompt or not size: 
-        return jsonify({"error": "Prompt 和 Size 為必填項"}), 400
+# === D3. 非同步生成工作佇列 ===
+# 工作狀態寫入會話儲存 (state['jobs'])，因此任一 worker 都能回應 /jobs/<id> 查詢；
+# 實際執行由接收請求的 worker 內的有界執行緒池負責，並以輪轉方式在使用者之間公平排程
+class JobQueueFullError(Exception): pass
 
-    try:
-        # E1-1. 提交生成任務到 DALL-E 3 API
-        endpoint = "https://api.openai.com/v1/images/generations"
-        headers = {"Authorization": f"Bearer {API_key}", "Content-Type": "application/json"}
-        payload = {
-            "model": "dall-e-3",
-            "prompt": prompt,
-            "size": size,
-            "n": 1,
-            "response_format": "url" # DALL-E 3 可以返回 URL 或 Base64，URL 較快
-        }
-        
-        # DALL-E 3 是同步請求，不需要輪詢
-        response = requests.post(endpoint, headers=headers, json=payload, timeout=120) # 增加超時
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, max_active_per_user=JOB_MAX_ACTIVE_PER_USER, max_pending_per_user=JOB_MAX_PENDING_PER_USER):
+        self.workers = workers; self.max_active_per_user = max_active_per_user; self.max_pending_per_user = max_pending_per_user
+        self.cond = threading.Condition()
+        self.pending = OrderedDict() # sid -> deque[fn]，OrderedDict 的順序即輪轉順序
+        self.active = {} # sid -> 執行中的工作數
+        self.threads = []
+
+    # D3-1. 提交工作 (每位使用者的排隊數有上限)
+    def submit(self, sid, fn):
+        with self.cond:
+            queue = self.pending.setdefault(sid, deque())
+            if len(queue) + self.active.get(sid, 0) >= self.max_pending_per_user:
+                if not queue: del self.pending[sid]
+                raise JobQueueFullError(f"同時最多 {self.max_pending_per_user} 個生成工作，請稍候再試")
+            queue.append(fn)
+            if not self.threads: self._start()
+            self.cond.notify()
+
+    def stats(self):
+        with self.cond: return {"pending": sum(len(queue) for queue in self.pending.values()), "active": sum(self.active.values())}
+
+    def _start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"generation-worker-{i}", daemon=True); t.start(); self.threads.append(t)
+
+    # D3-2. 公平排程：依序輪轉，略過已達同時執行上限的使用者
+    def _next(self):
+        for sid, queue in self.pending.items():
+            if self.active.get(sid, 0) >= self.max_active_per_user: continue
+            fn = queue.popleft()
+            if queue: self.pending.move_to_end(sid)
+            else: del self.pending[sid]
+            self.active[sid] = self.active.get(sid, 0) + 1
+            return sid, fn
+        return None
+
+    def _run(self):
+        while True:
+            with self.cond:
+                item = self._next()
+                while item is None: self.cond.wait(); item = self._next()
+            sid, fn = item
+            try: fn()
+            except Exception as e: print(f"背景工作失敗: {e}")
+            finally:
+                with self.cond:
+                    self.active[sid] -= 1
+                    if not self.active[sid]: del self.active[sid]
+                    self.cond.notify_all()
+
+job_queue = JobQueue()
+metrics.gauge("jobs", lambda: {(("state", state),): count for state, count in job_queue.stats().items()}, merge="sum")
+
+# D3-3. 工作狀態紀錄 (每個會話僅保留最近 JOB_HISTORY_PER_USER 筆)
+def set_job_state(sid, job_id, **fields):
+    def apply(state):
+        jobs = state.setdefault('jobs', {})
+        jobs.setdefault(job_id, {"created_at": time.time()}).update(fields)
+        for old_id in sorted(jobs, key=lambda k: jobs[k]['created_at'])[:-JOB_HISTORY_PER_USER]: del jobs[old_id]
+    session_store.update(sid, apply)
+
+def submit_job(sid, work, **initial):
+    job_id = uuid.uuid4().hex; submitted_at = time.monotonic()
+    def run():
+        metrics.observe("job_queue_wait_seconds", time.monotonic() - submitted_at)
+        set_job_state(sid, job_id, status="running")
+        try: set_job_state(sid, job_id, status="done", **work(job_id))
+        except Exception as e: set_job_state(sid, job_id, status="error", error=generation_error_message(e))
+    set_job_state(sid, job_id, status="queued", **initial)
+    try: job_queue.submit(sid, run)
+    except JobQueueFullError:
+        session_store.update(sid, lambda state: state.get('jobs', {}).pop(job_id, None)); raise
+    return job_id
+
+def submit_generation_job(sid, prompt, size): return submit_job(sid, lambda job_id: run_generation(sid, prompt, size))
+
+# D3-4. 批次工作：各項目的 API 呼叫與下載於共用執行緒池並行，完成後依提交順序追加 (version_index 與項目順序一致)
+fetch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_PARALLEL, thread_name_prefix="batch-fetch")
+
+def set_batch_item(sid, job_id, index, **fields):
+    def apply(state):
+        job = state.get('jobs', {}).get(job_id)
+        if job: job['items'][index].update(fields)
+    session_store.update(sid, apply)
+
+def run_batch(sid, job_id, items):
+    futures = [fetch_executor.submit(fetch_generation, item['prompt'], item['size']) for item in items]
+    index_of = {future: i for i, future in enumerate(futures)}
+    next_commit = 0; committed = 0
+    for future in as_completed(futures):
+        i = index_of[future]
+        if future.exception(): set_batch_item(sid, job_id, i, status="error", error=generation_error_message(future.exception()))
+        elif i >= next_commit: set_batch_item(sid, job_id, i, status="fetched", preview_path=blob_store.relpath(future.result()['file_hash']), file_hash=future.result()['file_hash']) # 已由前綴迴圈追加者不再覆寫為 fetched
+        # 依序追加所有已完成的前綴項目
+        while next_commit < len(futures) and futures[next_commit].done():
+            if not futures[next_commit].exception():
+                try: set_batch_item(sid, job_id, next_commit, status="done", **commit_generation(sid, futures[next_commit].result())); committed += 1
+                except Exception as e: set_batch_item(sid, job_id, next_commit, status="error", error=generation_error_message(e))
+            next_commit += 1
+    return {"completed": committed}
+
+def submit_batch_job(sid, items):
+    initial_items = [{"status": "queued", "prompt": item['prompt'], "size": item['size'], "seed": item.get('seed')} for item in items]
+    return submit_job(sid, lambda job_id: run_batch(sid, job_id, items), kind="batch", items=initial_items)
+
+# === D4. 保存期限與背景清理 (static/ 磁碟用量上限) ===
+# 清理順序：過期會話 (釋放預覽圖參照) -> 預覽圖超過配額時淘汰最久未使用的會話 -> 無參照圖檔與衍生圖 -> PDF 報告 (TTL 與配額)
+# 預覽配額只計算未結束任務的會話所持有的預覽圖 (不含生成結果快取與證據正本引用的圖檔)
+# 證據正本 JSON 與其引用的圖檔 (pinned) 永不刪除；PDF 報告刪除後可由證據正本重新渲染
+class RetentionSweeper:
+    def __init__(self, interval=RETENTION_INTERVAL, lock_path=os.path.join(DATA_DIR, "retention.lock")):
+        self.interval = interval; self.lock_path = lock_path
+        self.thread = None; self.start_lock = threading.Lock()
+        self.last_usage = {} # 最近一次清理後各類檔案的位元組數 (供 /metrics)
+
+    # D4-1. 於第一個請求時啟動 (每個 worker 一個執行緒，以檔案鎖確保同時只有一個在清理)
+    def start(self):
+        if self.interval <= 0 or self.thread is not None: return
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True); self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval * random.uniform(0.9, 1.1)) # 錯開各 worker 的執行時間
+            try: self.sweep_locked()
+            except Exception as e: print(f"背景清理失敗: {e}")
+
+    def sweep_locked(self):
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                try: fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError: return None # 其他 worker 正在清理
+            try: return self.sweep()
+            finally:
+                if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reclaim(self, kind, freed, files=0):
+        metrics.inc("retention_reclaimed_bytes_total", freed, kind=kind)
+        if files: metrics.inc("retention_deleted_files_total", files, kind=kind)
+        return freed
+
+    # D4-2. 執行一次完整清理，回傳各類回收的位元組數
+    def sweep(self, grace_seconds=RETENTION_GRACE):
+        start = time.monotonic(); reclaimed = {}
+        session_store.expire()
+        evicted = 0
+        while session_store.usage()['preview_bytes'] > PREVIEW_MAX_BYTES and session_store.evict_oldest(): evicted += 1
+        if evicted: metrics.inc("retention_evicted_sessions_total", evicted)
+        reclaimed['blobs'] = self.reclaim("blobs", blob_store.gc(grace_seconds=grace_seconds))
+        reclaimed['renditions'] = self.reclaim("renditions", renditions.prune(blob_store.hashes(), grace_seconds=grace_seconds))
+        reclaimed['reports'] = self.sweep_reports(grace_seconds)
+        metrics.observe("retention_sweep_seconds", time.monotonic() - start)
+        return reclaimed
+
+    # D4-3. PDF 報告：刪除超過 REPORT_TTL 未使用者，總量仍超過 REPORT_MAX_BYTES 時由最久未使用者開始刪除
+    # 舊版直接寫在 static/ 下的 WesmartAI_Report_*.pdf 與 qr_*.png 一併計入並依相同規則清除
+    def sweep_reports(self, grace_seconds):
+        root = os.path.join(static_folder, "reports"); now = time.time()
+        reports, freed, deleted, total = [], 0, 0, 0
+        for d, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(d, name)
+                try: stat = os.stat(path)
+                except FileNotFoundError: continue
+                if name.endswith(".pdf"): reports.append((stat.st_mtime, stat.st_size, path)); total += stat.st_size
+                elif name.endswith(".tmp") and stat.st_mtime < now - grace_seconds: # 中斷的渲染
+                    try: os.remove(path); freed += stat.st_size; deleted += 1
+                    except FileNotFoundError: pass
+        for pattern in ("WesmartAI_Report_*.pdf", "qr_*.png"):
+            for path in glob.glob(os.path.join(static_folder, pattern)):
+                try: stat = os.stat(path)
+                except FileNotFoundError: continue
+                reports.append((stat.st_mtime, stat.st_size, path)); total += stat.st_size
+        for mtime, size, path in sorted(reports):
+            if mtime >= now - REPORT_TTL and total <= REPORT_MAX_BYTES: break
+            try: os.remove(path)
+            except FileNotFoundError: continue
+            total -= size; freed += size; deleted += 1
+            if os.path.dirname(path) == static_folder: continue # 舊版檔案沒有進度檔與分層目錄
+            final_event_hash = os.path.basename(os.path.dirname(path)); report_id = os.path.basename(path)[len("WesmartAI_Report_"):-len(".pdf")]
+            try: os.remove(report_paths(final_event_hash, report_id)[1])
+            except FileNotFoundError: pass
+            for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))): # 移除空的分層目錄
+                try: os.rmdir(directory)
+                except OSError: break
+        self.last_usage['reports'] = total
+        return self.reclaim("reports", freed, deleted)
+
+retention_sweeper = RetentionSweeper()
+metrics.gauge("report_bytes", lambda: {(): retention_sweeper.last_usage['reports']} if 'reports' in retention_sweeper.last_usage else {}, merge="latest") # 最近一次清理的 worker
+
+@app.before_request
+def start_retention_sweeper(): retention_sweeper.start()
+
+# === E1. 生成流程 (已升級為 DALL-E 3，由背景工作執行) ===
+# 分為兩階段：fetch_generation (API 呼叫、下載、存檔，可並行) 與 commit_generation (時間戳、Step Hash、依序追加)
+def fetch_generation(prompt, size):
+    # E1-0. 已啟用生成結果快取時，先查詢相同 model/prompt/size 的先前結果 (命中時不呼叫 API、不佔用請求預算)
+    cache_key = None
+    if generation_cache is not None:
+        cache_key = generation_cache.key("dall-e-3", prompt, size)
+        cached = generation_cache.get(cache_key)
+        metrics.inc("generation_cache_total", result="hit" if cached else "miss")
+        if cached: return {"prompt": prompt, "size": size, "revised_prompt": cached['revised_prompt'], "file_hash": cached['file_hash'], "replay_of": cached['file_hash']}
+
+    # E1-1. 提交生成任務到 DALL-E 3 API (受每分鐘請求預算限制)
+    with metrics.timer("generation_phase_seconds", phase="rate_limit"): api_rate_limiter.acquire()
+    endpoint = f"{OPENAI_API_BASE}/images/generations"
+    headers = {"Authorization": f"Bearer {API_key}", "Content-Type": "application/json"}
+    payload = {
+        "model": "dall-e-3",
+        "prompt": prompt,
+        "size": size,
+        "n": 1,
+        "response_format": "url" # DALL-E 3 可以返回 URL 或 Base64，URL 較快
+    }
+    
+    # DALL-E 3 是同步請求，不需要輪詢
+    with metrics.timer("generation_phase_seconds", phase="api"):
+        response = http_client.post(endpoint, phase="api", headers=headers, json=payload, timeout=(HTTP_CONNECT_TIMEOUT, 120)) # 增加超時
         response.raise_for_status()
         result_data = response.json()
 
-        # E1-2. 獲取 DALL-E 3 的回傳資料
-        image_url = result_data['data'][0]['url']
-        revised_prompt = result_data['data'][0].get('revised_prompt', prompt) # 獲取修改後的提示詞
-        
-        # E1-3. 從返回的 URL 下載圖片
-        img_bytes = requests.get(image_url, timeout=60).content
-        
-        # E1-5. 儲存預覽圖檔案
-        filename = f"preview_v{len(session_previews) + 1}_{int(time.time())}.png"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        Image.open(io.BytesIO(img_bytes)).save(filepath)
-
-        # E1-6. 產生新·五重雜湊
-        timestamp_utc = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        img_base64_str = base64.b64encode(img_bytes).decode('utf-8') # 仍需 Base64 供 PDF 顯示
-
-        # 1. 新·五重雜湊
-        timestamp_hash = sha256_bytes(timestamp_utc.encode('utf-8'))
-        prompt_hash = sha256_bytes(prompt.encode('utf-8')) # 原始提示詞
-        revised_prompt_hash = sha256_bytes(revised_prompt.encode('utf-8')) # DALL-E 修改後的提示詞
-        size_hash = sha256_bytes(size.encode('utf-8')) # 尺寸字串 "1024x1024"
-        file_hash = sha256_bytes(img_bytes) # 原始二進位檔案雜湊
-
-        # 2. 打包生成 Step Hash
-        step_hash_input = json.dumps({
-            "timestamp_hash": timestamp_hash,
-            "prompt_hash": prompt_hash,
-            "revised_prompt_hash": revised_prompt_hash,
-            "size_hash": size_hash,
-            "file_hash": file_hash
-        }, sort_keys=True).encode('utf-8')
-        step_hash = sha256_bytes(step_hash_input)
-
-        # E1-7. 暫存所有紀錄
-        session_previews.append({
+    # E1-2. 獲取 DALL-E 3 的回傳資料
+    image_url = result_data['data'][0]['url']
+    revised_prompt = result_data['data'][0].get('revised_prompt', prompt) # 獲取修改後的提示詞
+    
+    # E1-3. 從返回的 URL 串流下載圖片，並直接寫入 Blob Store (單次讀取即完成 file_hash 計算與存檔，不經 PIL 重新編碼)
+    # E1-5. 檔案內容即為 file_hash 所雜湊的原始位元組，僅檢查 PNG 檔頭
+    #       (下載、雜湊與寫入在同一個迴圈內完成，故合併計時)
+    with metrics.timer("generation_phase_seconds", phase="download"), http_client.get(image_url, phase="cdn", timeout=(HTTP_CONNECT_TIMEOUT, 60), stream=True) as img_response:
+        img_response.raise_for_status()
+        file_hash = blob_store.put_stream(img_response.iter_content(DOWNLOAD_CHUNK_SIZE), validate_header=validate_png_header)
+    if cache_key: generation_cache.put(cache_key, file_hash, revised_prompt)
+
+    return {"prompt": prompt, "size": size, "revised_prompt": revised_prompt, "file_hash": file_hash}
+
+def commit_generation(sid, fetched):
+    prompt, size, revised_prompt, file_hash = fetched['prompt'], fetched['size'], fetched['revised_prompt'], fetched['file_hash']
+    file_size = blob_store.size(file_hash)
+
+    # E1-6. 產生新·五重雜湊 (時間戳於追加時產生，確保與 version_index 順序一致)
+    timestamp_utc = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    # 1. 新·五重雜湊
+    timestamp_hash = sha256_bytes(timestamp_utc.encode('utf-8'))
+    prompt_hash = sha256_bytes(prompt.encode('utf-8')) # 原始提示詞
+    revised_prompt_hash = sha256_bytes(revised_prompt.encode('utf-8')) # DALL-E 修改後的提示詞
+    size_hash = sha256_bytes(size.encode('utf-8')) # 尺寸字串 "1024x1024"
+    # file_hash 已於 E1-5 由 Blob Store 計算 (原始二進位檔案雜湊)
+
+    # 2. 打包生成 Step Hash
+    step_hash_input = json.dumps({
+        "timestamp_hash": timestamp_hash,
+        "prompt_hash": prompt_hash,
+        "revised_prompt_hash": revised_prompt_hash,
+        "size_hash": size_hash,
+        "file_hash": file_hash
+    }, sort_keys=True).encode('utf-8')
+    step_hash = sha256_bytes(step_hash_input)
+
+    # E1-7. 暫存所有紀錄 (於會話儲存中原子性地追加，版本號由追加順序決定)，並同步延伸證據鏈
+    #       紀錄已是證據正本中的快照格式，結束任務時可直接沿用
+    def append_preview(state):
+        chain = state['chain'] = extend_evidence_chain(session_evidence_chain(state), step_hash)
+        snapshot = {
+            "version_index": len(state['previews']) + 1,
             "prompt": prompt,
             "revised_prompt": revised_prompt, # 儲存修改後的提示詞
             "size": size, # 儲存尺寸
             "model": "dall-e-3",
-            "filepath": filepath,
+            "blob_path": blob_store.relpath(file_hash), # 相對於 static/，PDF 由磁碟讀取
             "timestamp_utc": timestamp_utc,
-            "content_base64": img_base64_str, # 供 PDF 顯示
             "hashes": {
                 "timestamp_hash": timestamp_hash,
                 "prompt_hash": prompt_hash,
@@ -279,80 +1693,148 @@ def generate():
                 "size_hash": size_hash,
                 "file_hash": file_hash,
                 "step_hash": step_hash
-            }
-        })
-        
-        return jsonify({
-            "success": True, 
-            "preview_url": url_for('static_preview', filename=filename),
-            "version": len(session_previews)
-        })
-
-# === [E1-EXCEPT] 錯誤處理 (修復 SyntaxError) ===
-    except requests.exceptions.RequestException as e:
+            },
+            "chain_hash": chain['chain_hash'] # 截至此版本的雜湊鏈頂端，可驗證中間狀態
+        }
+        if 'replay_of' in fetched: snapshot['replay_of'] = fetched['replay_of'] # 由生成結果快取重播，未重新呼叫 API
+        state['previews'].append(snapshot)
+        state['preview_bytes'] = state.get('preview_bytes', 0) + file_size
+        return len(state['previews'])
+
+    with metrics.timer("generation_phase_seconds", phase="commit"): version = session_store.update(sid, append_preview)
+    blob_store.incref([file_hash]) # 會話持有一份參照
+    renditions.schedule(file_hash)
+    return {"version": version, "preview_path": blob_store.relpath(file_hash), "file_hash": file_hash}
+
+def run_generation(sid, prompt, size): return commit_generation(sid, fetch_generation(prompt, size))
+
+# === [E1-EXCEPT] 錯誤訊息轉換 ===
+def generation_error_message(e):
+    metrics.inc("generation_errors_total", reason=generation_error_reason(e))
+    if isinstance(e, SessionLimitError): return str(e)
+    if isinstance(e, requests.exceptions.RequestException):
         # 處理 OpenAI API 的特定錯誤
         if e.response is not None:
-            error_details = e.response.json().get('error', {}).get('message', str(e))
-            return jsonify({"error": f"API 請求失敗: {error_details}"}), 500
-        return jsonify({"error": f"網路請求失敗: {str(e)}"}), 500
-    except Exception as e:
-        return jsonify({"error": f"生成過程中發生未知錯誤: {str(e)}"}), 500
+            try: error_details = e.response.json().get('error', {}).get('message', str(e))
+            except ValueError: error_details = str(e)
+            return f"API 請求失敗: {error_details}"
+        return f"網路請求失敗: {str(e)}"
+    return f"生成過程中發生未知錯誤: {str(e)}"
+
+# 錯誤分類 (指標標籤)：API 回應的 HTTP 狀態碼，或網路 / 斷路器 / 會話上限 / 其他
+def generation_error_reason(e):
+    if isinstance(e, SessionLimitError): return "session_limit"
+    if isinstance(e, CircuitOpenError): return "circuit_open"
+    if isinstance(e, requests.exceptions.RequestException): return str(e.response.status_code) if e.response is not None else "network"
+    return "other"
+
+# === E1-8. /generate: 步驟1: 提交生成工作，立即回傳 job_id ===
+@app.route('/generate', methods=['POST'])
+def generate():
+    if not API_key: 
+        return jsonify({"error": "後端尚未設定 OPENAI_API_KEY 環境變數"}), 500
+    
+    data = request.json
+    prompt = data.get('prompt')
+    size = data.get('size') # 從 index.html 獲取 "1024x1024" 格式
+    if not prompt or not size: 
+        return jsonify({"error": "Prompt 和 Size 為必填項"}), 400
+
+    try:
+        job_id = submit_generation_job(g.sid, prompt, size)
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"success": True, "job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+# === E1-10. /generate_batch: 一次提交多組 prompt/size (seed 僅記錄，DALL-E 3 API 不支援) ===
+@app.route('/generate_batch', methods=['POST'])
+def generate_batch():
+    if not API_key: 
+        return jsonify({"error": "後端尚未設定 OPENAI_API_KEY 環境變數"}), 500
+
+    items = (request.json or {}).get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items 必須為非空陣列"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"單一批次最多 {BATCH_MAX_ITEMS} 個項目"}), 400
+    if not all(isinstance(item, dict) and item.get('prompt') and item.get('size') for item in items):
+        return jsonify({"error": "每個項目的 Prompt 和 Size 皆為必填項"}), 400
+
+    try:
+        job_id = submit_batch_job(g.sid, items)
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"success": True, "job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+# === E1-9. /jobs/<job_id>: 查詢生成工作狀態 (前端輪詢) ===
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = session_store.get(g.sid).get('jobs', {}).get(job_id)
+    if job is None: return jsonify({"error": "找不到此工作"}), 404
+    job = dict(job, job_id=job_id)
+    for entry in [job] + job.get('items', []):
+        if not entry.get('preview_path'): continue
+        entry['original_url'] = url_for('static_preview', filename=entry.pop('preview_path'))
+        if entry.get('file_hash'): # 預覽改用衍生圖 (原圖仍可由 original_url 取得)
+            entry['preview_url'] = url_for('rendition', file_hash=entry['file_hash'], name="preview")
+            entry['thumb_url'] = url_for('rendition', file_hash=entry['file_hash'], name="thumb")
+        else: entry['preview_url'] = entry['original_url']
+    return jsonify(job)
 
 # === E2. /finalize_session: 步驟2: 結束任務，生成所有證據正本 ===
 @app.route('/finalize_session', methods=['POST'])
 def finalize_session():
-    global latest_proof_data, session_previews
     applicant_name = request.json.get('applicant_name')
     if not applicant_name: return jsonify({"error": "出證申請人名稱為必填項"}), 400
-    if not session_previews: return jsonify({"error": "沒有任何預覽圖像可供結束任務"}), 400
+    state = session_store.get(g.sid)
+    snapshots = state['previews'] # 生成時已是快照格式 (含五重雜湊、Step Hash 與 chain_hash)
+    if not snapshots: return jsonify({"error": "沒有任何預覽圖像可供結束任務"}), 400
 
     try:
-        snapshots = []
-        image_urls = []
-        
-        # E2-1. 迭代所有預覽圖快照 (已更新為 DALL-E 3)
-        for i, preview in enumerate(session_previews):
-            snapshots.append({
-                "version_index": i + 1,
-                "timestamp_utc": preview['timestamp_utc'],
-                "prompt": preview['prompt'],
-                "revised_prompt": preview['revised_prompt'], # 新增
-                "size": preview['size'], # 新增
-                "model": preview['model'],
-                "hashes": preview['hashes'], # 包含五重雜湊 + Step Hash
-                "content_base64": preview['content_base64']
-            })
-            image_urls.append(url_for('static_download', filename=os.path.basename(preview['filepath'])))
+        # E2-1. 原圖下載連結
+        image_urls = [url_for('static_download', filename=s['blob_path'], name=f"preview_v{s['version_index']}.png") for s in snapshots]
 
         # E2-2. 產生報告 ID 與 Final Event Hash (需求 #4)
         report_id = str(uuid.uuid4())
         issued_at_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
         
         # 需求 #4: 每個頁面step hash 最後打包成為 final event_hash
-        all_step_hashes = [s['hashes']['step_hash'] for s in snapshots]
-        final_hash_input = json.dumps(all_step_hashes, sort_keys=True).encode('utf-8')
-        final_event_hash = sha256_bytes(final_hash_input)
-
-        # 移除舊的 trace_token (已被 step_hash 取代)
-        # temp_proof_for_hashing ... (此段已不需要)
+        # 證據鏈已於每次生成時增量延伸，此處僅讀取結果；相容模式仍以原定義計算 final_event_hash
+        chain = session_evidence_chain(state)
+        merkle_root = merkle_root_from_peaks(chain['merkle_peaks'])
+        legacy_hash = legacy_final_event_hash([s['hashes']['step_hash'] for s in snapshots])
+        final_event_hash = merkle_root if FINAL_HASH_MODE == "merkle" else legacy_hash
 
         # E2-3. 組合並儲存 JSON 證據正本
         proof_data = {
             "report_id": report_id, "issuer": "WesmartAI Inc.", "applicant": applicant_name, "issued_at": issued_at_iso,
             "event_proof": {
                 "final_event_hash": final_event_hash,
+                "final_hash_mode": FINAL_HASH_MODE,
+                "chain": {
+                    "algorithm": "sha256", "genesis": CHAIN_GENESIS, "leaf_count": chain['count'],
+                    "chain_hash": chain['chain_hash'], "merkle_root": merkle_root, "legacy_final_event_hash": legacy_hash
+                },
                 "snapshots": snapshots # Snapshots 現在已包含所有 hashes
             },
             "verification": {"verify_url": f"https://wesmart.ai/verify?hash={final_event_hash}"}
         }
 
-        json_filename = f"proof_event_{report_id}.json"
-        json_filepath = os.path.join(app.config['UPLOAD_FOLDER'], json_filename)
+        json_filepath = proof_path(report_id) # 存於 DATA_DIR，不可經由 static/ 公開下載
+        os.makedirs(os.path.dirname(json_filepath), exist_ok=True)
         with open(json_filepath, 'w', encoding='utf-8') as f:
             json.dump(proof_data, f, ensure_ascii=False, indent=2)
-        print(f"證據正本已儲存至: {json_filename}")
+        print(f"證據正本已儲存至: {os.path.basename(json_filepath)}")
+        blob_store.incref([s['hashes']['file_hash'] for s in snapshots]) # 證據正本持有一份參照
+        blob_store.pin([s['hashes']['file_hash'] for s in snapshots])
+        evidence_index.add({"report_id": report_id, "final_event_hash": final_event_hash, "applicant": applicant_name, "issued_at": issued_at_iso},
+                           [{"version_index": s['version_index'], **s['hashes']} for s in snapshots], json_filepath)
 
-        latest_proof_data = proof_data
+        # E2-4. 僅保留證據摘要供 /create_report 使用 (完整內容由 JSON 正本讀取)
+        def store_proof(state):
+            state['proof'] = {"report_id": report_id, "json_filepath": json_filepath, "final_event_hash": final_event_hash}
+            state['preview_bytes'] = 0 # 預覽圖已由證據正本持有 (pinned)，不再計入預覽配額
+        session_store.update(g.sid, store_proof)
 
         return jsonify({"success": True, "image_urls": image_urls})
 
@@ -360,37 +1842,167 @@ def finalize_session():
         print(f"結束任務失敗: {e}")
         return jsonify({"error": f"結束任務失敗: {str(e)}"}), 500
 
-# === E3. /create_report: 步驟3: 產生 PDF 報告 ===
+# === E2-5. /proof/inclusion/<version>: 單一版本的 Merkle 包含證明 (無需整個任務內容即可驗證；可用 verify_proof.py --inclusion 離線驗證) ===
+def inclusion_proof_body(step_hashes, version, merkle_root):
+    return {"version_index": version, "step_hash": step_hashes[version - 1], "tree_size": len(step_hashes),
+            "merkle_root": merkle_root, "audit_path": merkle_inclusion_proof(step_hashes, version - 1)}
+
+@app.route('/proof/inclusion/<int:version>')
+def inclusion_proof(version):
+    state = session_store.get(g.sid)
+    step_hashes = [p['hashes']['step_hash'] for p in state['previews']]
+    if not 1 <= version <= len(step_hashes): return jsonify({"error": "找不到此版本"}), 404
+    return jsonify(inclusion_proof_body(step_hashes, version, merkle_root_from_peaks(session_evidence_chain(state)['merkle_peaks'])))
+
+# E2-6. 已結束任務的包含證明 (依 report_id 或 final_event_hash 由證據正本讀取，不受會話重置或過期影響)
+@app.route('/proof/<report_ref>/inclusion/<int:version>')
+def report_inclusion_proof(report_ref, version):
+    path = evidence_index.proof_file(report_ref)
+    if path is None or not os.path.exists(path): return jsonify({"error": "找不到此證據"}), 404
+    meta = {}; chain = new_evidence_chain()
+    with open(path, 'rb') as f: step_hashes = [s['hashes']['step_hash'] for s in verify_proof.iter_snapshots(f, meta)]
+    if not 1 <= version <= len(step_hashes): return jsonify({"error": "找不到此版本"}), 404
+    for step_hash in step_hashes: extend_evidence_chain(chain, step_hash)
+    body = inclusion_proof_body(step_hashes, version, merkle_root_from_peaks(chain['merkle_peaks']))
+    body.update(final_event_hash=meta.get('event_proof.final_event_hash'), final_hash_mode=meta.get('event_proof.final_hash_mode') or "compat")
+    return jsonify(body)
+
+# === E3. /create_report: 步驟3: 產生 PDF 報告 (背景渲染，相同 final_event_hash 直接回傳快取) ===
 @app.route('/create_report', methods=['POST'])
 def create_report():
-    if not latest_proof_data: return jsonify({"error": "請先結束任務並生成證據"}), 400
+    proof_ref = session_store.get(g.sid)['proof']
+    if not proof_ref: return jsonify({"error": "請先結束任務並生成證據"}), 400
     
     try:
-        # E3-1. 呼叫 PDF 類別產生報告
-        report_id = latest_proof_data['report_id']
-        pdf = WesmartPDFReport()
-        pdf.create_cover(latest_proof_data)
-        pdf.create_generation_details_page(latest_proof_data)
-        pdf.create_conclusion_page(latest_proof_data)
-        
-        # E3-2. 儲存 PDF 檔案
-        report_filename = f"WesmartAI_Report_{report_id}.pdf"
-        report_filepath = os.path.join(app.config['UPLOAD_FOLDER'], report_filename)
-        pdf.output(report_filepath)
-
-        return jsonify({"success": True, "report_url": url_for('static_download', filename=report_filename)})
+        # E3-1. 已渲染過則立即回傳，否則交由背景行程池渲染
+        status = submit_report(proof_path(proof_ref['report_id']), proof_ref['final_event_hash'], proof_ref['report_id'])
+        if status == "done":
+            return jsonify({"success": True, "status": "done", "report_url": report_download_url(proof_ref)})
+        return jsonify({"success": True, "status": status, "status_url": url_for('report_status')}), 202
     except Exception as e:
         print(f"報告生成失敗: {e}")
         return jsonify({"error": f"報告生成失敗: {str(e)}"}), 500
 
+# === E3-2. /report_status: 查詢報告渲染進度 (前端輪詢) ===
+@app.route('/report_status')
+def report_status():
+    proof_ref = session_store.get(g.sid)['proof']
+    if not proof_ref: return jsonify({"error": "請先結束任務並生成證據"}), 400
+    report_relpath, progress_path = report_paths(proof_ref['final_event_hash'], proof_ref['report_id'])
+    if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], report_relpath)):
+        return jsonify({"status": "done", "report_url": report_download_url(proof_ref)})
+    progress = read_report_progress(progress_path)
+    if progress is None or progress['status'] == "done": # PDF 已被背景清理刪除，重新渲染
+        status = submit_report(proof_path(proof_ref['report_id']), proof_ref['final_event_hash'], proof_ref['report_id'])
+        if status == "done": return jsonify({"status": "done", "report_url": report_download_url(proof_ref)})
+        progress = {"status": status}
+    return jsonify(progress)
+
+def report_download_url(proof_ref):
+    report_relpath, _ = report_paths(proof_ref['final_event_hash'], proof_ref['report_id'])
+    return url_for('static_download', filename=report_relpath, name=f"WesmartAI_Report_{proof_ref['report_id']}.pdf")
+
+# === E4. /verify: 依雜湊查詢證據 (final_event_hash、step_hash 或 file_hash；對應報告中的 verify_url) ===
+# file_hash 出現在預覽與下載網址中，任何人都能查詢；公開結果僅含比對結果，
+# report_id (可據以取得證據正本) 與申請人 (個資) 僅提供給帶有 EVIDENCE_ADMIN_TOKEN 的請求
+PUBLIC_VERIFY_FIELDS = ("match", "final_event_hash", "issued_at", "snapshot_count")
+
+def is_evidence_admin():
+    auth = request.headers.get('Authorization', '')
+    return bool(EVIDENCE_ADMIN_TOKEN) and hmac.compare_digest(auth.encode('utf-8'), f"Bearer {EVIDENCE_ADMIN_TOKEN}".encode('utf-8'))
+
+@app.route('/verify')
+def verify():
+    value = (request.args.get('hash') or '').strip().lower()
+    if not is_sha256_hex(value):
+        return jsonify({"error": "hash 必須為 64 位十六進位 SHA-256 值"}), 400
+    matches = evidence_index.lookup(value)
+    if not is_evidence_admin(): matches = [{key: match[key] for key in PUBLIC_VERIFY_FIELDS} for match in matches]
+    return jsonify({"hash": value, "found": bool(matches), "matches": matches})
+
+# === E5. /reports: 證據分頁列表 (需設定 EVIDENCE_ADMIN_TOKEN，並以 Bearer Token 存取) ===
+@app.route('/reports')
+def list_reports():
+    if not is_evidence_admin():
+        return jsonify({"error": "未授權"}), 403
+    try: limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError: return jsonify({"error": "limit 必須為整數"}), 400
+    cursor = request.args.get('cursor')
+    if cursor and "|" not in cursor: return jsonify({"error": "cursor 格式錯誤"}), 400
+    reports, next_cursor = evidence_index.list(request.args.get('applicant'), request.args.get('since'), request.args.get('until'), limit, cursor)
+    return jsonify({"reports": reports, "next_cursor": next_cursor})
+
 # === F. 靜態檔案路由 ===
 # F1. 預覽圖路由
 @app.route('/static/preview/<path:filename>')
 def static_preview(filename): return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+# F1-2. 衍生圖檔路由 (內容由 file_hash 決定，以 ETag 與 immutable 標頭長期快取；背景尚未產生時即時產生)
+@app.route('/renditions/<file_hash>/<name>')
+def rendition(file_hash, name):
+    if name not in RENDITIONS or not is_sha256_hex(file_hash) or not os.path.exists(blob_store.path(file_hash)):
+        return jsonify({"error": "找不到此圖檔"}), 404
+    try: path = renditions.ensure(file_hash, name)
+    except Exception as e:
+        print(f"產生衍生圖 {name} 失敗 ({file_hash}): {e}")
+        return jsonify({"error": "無法產生預覽圖"}), 500
+    response = send_file(os.path.abspath(path), mimetype=RENDITIONS[name]['mimetype'], conditional=True, etag=f"{file_hash}-{name}", max_age=365 * 86400)
+    response.cache_control.public = True; response.cache_control.immutable = True
+    return response
+
 # F2. 下載路由
 @app.route('/static/download/<path:filename>')
-def static_download(filename): return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+def static_download(filename): return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True, download_name=request.args.get('name'))
+
+# F3. 指標查詢 (API 呼叫與 CDN 下載的各階段延遲、錯誤與重試次數)
+@app.route('/stats')
+def stats(): return jsonify(metrics.snapshot())
+
+# F3-1. Prometheus 指標 (合併所有 worker 的計數與直方圖；會話與 Blob Store 量測值於輸出時計算)
+@app.route('/metrics')
+def prometheus_metrics(): return app.response_class(metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+# === F4. 維運指令 ===
+# F4-1. 回收無參照的預覽圖與中斷寫入的暫存檔: flask --app app gc-blobs --grace 3600
+@app.cli.command("gc-blobs")
+@click.option("--grace", default=3600, help="僅回收超過此秒數的檔案")
+def gc_blobs_command(grace):
+    freed = blob_store.gc(grace_seconds=grace)
+    freed += renditions.prune(blob_store.hashes(), grace_seconds=grace)
+    print(f"已回收 {freed} bytes")
+
+# F4-1a. 立即執行一次背景清理 (過期會話、預覽圖配額、無參照圖檔、PDF 報告): flask --app app sweep
+@app.cli.command("sweep")
+@click.option("--grace", default=RETENTION_GRACE, help="無參照圖檔與暫存檔的保留秒數")
+def sweep_command(grace):
+    reclaimed = retention_sweeper.sweep(grace_seconds=grace)
+    print("已回收 " + "，".join(f"{kind} {freed} bytes" for kind, freed in reclaimed.items()))
+
+# F4-2. 以多個行程平行渲染已結束任務的報告 (略過已快取者): flask --app app render-reports --workers 4 [proof_event_*.json ...]
+@app.cli.command("render-reports")
+@click.option("--workers", default=REPORT_WORKERS, help="渲染行程數")
+@click.argument("paths", nargs=-1)
+def render_reports_command(workers, paths):
+    paths = paths or sorted(glob.glob(os.path.join(PROOF_DIR, "**", "proof_event_*.json"), recursive=True))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=warm_pdf_assets) as executor:
+        futures = {}
+        for path in paths:
+            with open(path, encoding='utf-8') as f: proof_data = json.load(f)
+            report_relpath, progress_path = report_paths(proof_data['event_proof']['final_event_hash'], proof_data['report_id'])
+            if os.path.exists(os.path.join(static_folder, report_relpath)): continue
+            os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+            futures[executor.submit(render_report, path, report_relpath, progress_path)] = path
+        for done_count, future in enumerate(as_completed(futures), 1):
+            status = "失敗" if future.exception() else "完成"
+            print(f"[{done_count}/{len(futures)}] {status}: {futures[future]}")
+
+# F4-3. 由 PROOF_DIR 中的證據檔重建索引: flask --app app rebuild-index [proof_event_*.json ...]
+@app.cli.command("rebuild-index")
+@click.argument("paths", nargs=-1)
+def rebuild_index_command(paths):
+    paths = paths or sorted(glob.glob(os.path.join(PROOF_DIR, "**", "proof_event_*.json"), recursive=True))
+    print(f"已索引 {evidence_index.rebuild(paths)} 份證據檔")
+    blob_store.pin(evidence_index.file_hashes()) # 證據正本引用的圖檔不受背景清理影響
 
 # === G. 啟動服務 ===
 if __name__ == '__main__':
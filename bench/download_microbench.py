@@ -0,0 +1,76 @@
+# ====================================================================
+# [P] WesmartAI 單次生成的圖片處理微基準 (每個請求的 CPU 時間與記憶體配置)
+# --------------------------------------------------------------------
+# legacy:    requests.get(url).content -> PIL 解碼並重新編碼存檔 -> SHA-256 -> base64 (原本 generate() 的做法)
+# streaming: 共用 HttpClient 串流下載，邊寫入 Blob Store 邊更新 SHA-256，只檢查 PNG 檔頭
+# CPU 時間為本行程的 process_time (模擬 API 在另一個行程)；配置量為 tracemalloc 的峰值
+# (只計入 Python 物件配置，PIL 解碼用的 C 緩衝區不在其中，實際差距更大)。
+#
+# 用法: python bench/download_microbench.py --sizes 1024x1024,1792x1024 --iterations 20
+# ====================================================================
+
+# === P1. 套件匯入 ===
+import argparse, base64, hashlib, io, json, os, sys, time, tracemalloc, uuid
+import requests
+from PIL import Image
+import harness
+
+# === P2. 受測的兩種做法 ===
+def legacy(app, url):
+    img_bytes = requests.get(url, timeout=60).content
+    tmp_path = os.path.join(app.static_folder, f".tmp_{uuid.uuid4().hex}.png")
+    Image.open(io.BytesIO(img_bytes)).save(tmp_path)
+    img_base64_str = base64.b64encode(img_bytes).decode('utf-8')
+    file_hash = hashlib.sha256(img_bytes).hexdigest()
+    os.remove(tmp_path)
+    return file_hash, len(img_base64_str)
+
+def streaming(app, url):
+    with app.http_client.get(url, phase="cdn", timeout=(5, 60), stream=True) as response:
+        response.raise_for_status()
+        return app.blob_store.put_stream(response.iter_content(app.DOWNLOAD_CHUNK_SIZE), validate_header=app.validate_png_header), 0
+
+MODES = {"legacy": legacy, "streaming": streaming}
+
+# === P3. 量測 (每次使用不同的圖片，避免 Blob Store 去重) ===
+def measure(app, fn, urls):
+    fn(app, urls[0]) # 暖機 (建立連線、載入 PIL 外掛)
+    cpu = []
+    for url in urls[1:]:
+        start = time.process_time(); fn(app, url); cpu.append(time.process_time() - start)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak(); fn(app, urls[0]); peak = tracemalloc.get_traced_memory()[1]
+    finally: tracemalloc.stop()
+    return {"cpu_ms_mean": sum(cpu) / len(cpu) * 1000, "cpu_ms_min": min(cpu) * 1000, "alloc_peak_mb": peak / 1024 ** 2}
+
+# === P4. 命令列介面 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="單次生成的圖片處理微基準 (CPU 時間與記憶體配置)")
+    parser.add_argument("--sizes", default="1024x1024,1792x1024")
+    parser.add_argument("--iterations", type=int, default=20, help="每種尺寸與做法的量測次數")
+    parser.add_argument("--image-block", type=int, default=1, help="模擬圖片的雜訊區塊邊長 (1 時檔案最大)")
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    fake, api_base = harness.start_fake_openai("--latency", "0", "--block", str(args.image_block))
+    try:
+        app = harness.load_app(api_base)
+        cdn = api_base[:-len("/v1")]
+        results = []
+        print(f"{'尺寸':<12}{'做法':<12}{'PNG MB':>8}{'CPU ms (平均)':>16}{'CPU ms (最小)':>16}{'配置峰值 MB':>14}")
+        for size in args.sizes.split(","):
+            for mode, fn in MODES.items():
+                urls = [f"{cdn}/images/{mode}{k:02d}_{size}.png" for k in range(args.iterations + 1)]
+                png_mb = len(requests.get(urls[0]).content) / 1024 ** 2
+                row = {"size": size, "mode": mode, "png_mb": png_mb, **measure(app, fn, urls)}
+                results.append(row)
+                print(f"{size:<12}{mode:<12}{png_mb:>8.2f}{row['cpu_ms_mean']:>16.1f}{row['cpu_ms_min']:>16.1f}{row['alloc_peak_mb']:>14.2f}")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f: json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    finally:
+        fake.terminate(); fake.wait()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# ====================================================================
+# [E] WesmartAI 證據索引查詢延遲基準 (100k 份報告)
+# --------------------------------------------------------------------
+# 以 app.py 的 EvidenceIndex 建立含 --reports 份報告 (每份 --snapshots 個快照) 的索引，
+# 量測寫入速度，以及依 final_event_hash / step_hash / file_hash 查詢 (命中與未命中)、
+# 分頁列表 (全部、依申請人、依時間區間、以 cursor 翻頁) 與經由 Flask 的 GET /verify 的 p50/p95/p99 延遲。
+#
+# 用法: python bench/evidence_lookup.py --reports 100000 --snapshots 3 --queries 2000
+# ====================================================================
+
+# === E1. 套件匯入 ===
+import argparse, datetime, json, math, os, random, sys, time, uuid
+import harness
+
+def percentile(sorted_values, p): return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+def random_hash(rng): return "%064x" % rng.getrandbits(256)
+
+# === E2. 建立索引 ===
+def populate(index, args, rng):
+    start_time = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    samples = {"final_event_hash": [], "step_hash": [], "file_hash": [], "applicant": [], "issued_at": []}
+    conn = index._conn(); start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    for i in range(args.reports):
+        report = {"report_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)), "final_event_hash": random_hash(rng),
+                  "applicant": f"applicant-{rng.randrange(args.applicants)}", "issued_at": (start_time + datetime.timedelta(seconds=rng.randrange(365 * 86400))).isoformat()}
+        snapshots = [{"version_index": k + 1, "step_hash": random_hash(rng), "file_hash": random_hash(rng)} for k in range(args.snapshots)]
+        index._insert(conn, report, snapshots, f"proofs/{report['report_id'][:2]}/proof_event_{report['report_id']}.json")
+        if rng.random() < args.queries / args.reports: # 抽樣已存在的值作為命中查詢
+            samples['final_event_hash'].append(report['final_event_hash']); samples['applicant'].append(report['applicant']); samples['issued_at'].append(report['issued_at'])
+            samples['step_hash'].append(snapshots[-1]['step_hash']); samples['file_hash'].append(snapshots[0]['file_hash'])
+        if (i + 1) % 5000 == 0: conn.execute("COMMIT"); conn.execute("BEGIN IMMEDIATE")
+    conn.execute("COMMIT")
+    return time.perf_counter() - start, samples
+
+# === E3. 量測 ===
+def measure(fn, values):
+    latencies = []
+    for value in values:
+        start = time.perf_counter(); fn(value); latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {"count": len(latencies), "p50_ms": percentile(latencies, 50) * 1000, "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000, "max_ms": latencies[-1] * 1000}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="證據索引查詢延遲基準")
+    parser.add_argument("--reports", type=int, default=100000, help="索引中的報告數")
+    parser.add_argument("--snapshots", type=int, default=3, help="每份報告的快照數")
+    parser.add_argument("--applicants", type=int, default=1000, help="不同申請人數")
+    parser.add_argument("--queries", type=int, default=2000, help="每種查詢的次數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    app = harness.load_app("http://127.0.0.1:9/v1")
+    index = app.evidence_index # 暫存工作目錄中的新索引，/verify 亦查詢此索引
+    seconds, samples = populate(index, args, rng)
+    print(f"已寫入 {args.reports} 份報告 ({args.reports * args.snapshots} 個快照)，耗時 {seconds:.1f} 秒 ({args.reports / seconds:.0f} 份/秒)，"
+          f"索引大小 {os.path.getsize(index.path) / 1024 ** 2:.1f} MB")
+
+    client = app.app.test_client()
+    misses = [random_hash(rng) for _ in range(args.queries)]
+    cursor = index.list(limit=50)[1]
+    cases = {
+        "lookup final_event_hash": (index.lookup, samples['final_event_hash']),
+        "lookup step_hash": (index.lookup, samples['step_hash']),
+        "lookup file_hash": (index.lookup, samples['file_hash']),
+        "lookup 未命中": (index.lookup, misses),
+        "list 第一頁": (lambda _: index.list(limit=50), range(args.queries)),
+        "list 第二頁 (cursor)": (lambda _: index.list(limit=50, cursor=cursor), range(args.queries)),
+        "list 依申請人": (lambda applicant: index.list(applicant=applicant, limit=50), samples['applicant']),
+        "list 依時間區間": (lambda issued_at: index.list(since=issued_at[:10], until=issued_at, limit=50), samples['issued_at']),
+        "GET /verify (Flask)": (lambda value: client.get('/verify', query_string={"hash": value}), samples['final_event_hash']),
+    }
+    print(f"{'查詢':<28}{'次數':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'最大 ms':>10}")
+    results = {}
+    for name, (fn, values) in cases.items():
+        row = results[name] = measure(fn, list(values))
+        print(f"{name:<28}{row['count']:>8}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['max_ms']:>10.3f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump({"config": vars(args), "populate_seconds": seconds, "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# ====================================================================
+# [M] WesmartAI 壓力測試用 OpenAI Images 模擬伺服器
+# --------------------------------------------------------------------
+# 模擬 POST /v1/images/generations (回傳 url 與 revised_prompt) 與圖片 CDN (GET /images/...)。
+# 圖片內容由 prompt 與尺寸決定 (相同輸入得到相同 PNG)，API 延遲、CDN 延遲與錯誤率皆可調整，
+# 讓效能測試不必呼叫付費的 OpenAI API。只依賴標準函式庫。
+# 錯誤狀態碼可包含 drop：讀取請求後不回應並以 RST 中斷連線 (模擬連線被重置)；--fail-first 讓前 N 個請求必定失敗。
+#
+# 用法: python bench/fake_openai.py --port 8001 --latency 1.0 --jitter 0.3 --error-rate 0.02
+#       python bench/fake_openai.py --fail-first 2 --error-statuses drop,503
+#       OPENAI_API_BASE=http://127.0.0.1:8001/v1 gunicorn app:app
+# ====================================================================
+
+# === M1. 套件匯入 ===
+import argparse, functools, hashlib, json, random, socket, struct, threading, time, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === M2. 決定性 PNG 產生 (以 SHAKE-256 產生雜訊) ===
+# noise: 區塊雜訊，block 越大越容易壓縮、檔案越小 (PNG 有利，有損格式的最差情況)
+# photo: 平滑漸層加上細微顆粒，PNG 大小與壓縮特性接近真實照片 (有損格式有利)
+def png_chunk(kind, data): return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+def photo_rows(key, width, height, detail=8):
+    grain = hashlib.shake_256(key.encode('utf-8')).digest(width * height * 3)
+    cols = -(-width // detail)
+    patches = hashlib.shake_256(f"{key}/detail".encode('utf-8')).digest(cols * -(-height // detail) * 3)
+    row_bytes = width * 3
+    fine, coarse = int.from_bytes(b"\x1f" * row_bytes, "big"), int.from_bytes(b"\x3f" * row_bytes, "big") # 漸層 0~160 + 區塊 0~63 + 顆粒 0~31，不會進位
+    base = bytearray(row_bytes)
+    base[0::3] = bytes(x * 160 // width for x in range(width))
+    base[2::3] = bytes((grain[0] + x * 96 // width) % 160 for x in range(width))
+    for y in range(height):
+        base[1::3] = bytes([y * 160 // height]) * width
+        if y % detail == 0:
+            patch_row = patches[(y // detail) * cols * 3:(y // detail + 1) * cols * 3]
+            patch = int.from_bytes(b"".join(patch_row[x * 3:x * 3 + 3] * detail for x in range(cols))[:row_bytes], "big") & coarse
+        noise = int.from_bytes(grain[y * row_bytes:(y + 1) * row_bytes], "big") & fine
+        yield (int.from_bytes(base, "big") + patch + noise).to_bytes(row_bytes, "big")
+
+@functools.lru_cache(maxsize=64)
+def make_png(key, width, height, block=1, pattern="noise"):
+    raw = bytearray()
+    if pattern == "photo":
+        for line in photo_rows(key, width, height): raw += b"\x00" + line
+    else:
+        cols, rows = -(-width // block), -(-height // block)
+        noise = hashlib.shake_256(key.encode('utf-8')).digest(cols * rows * 3)
+        for y in range(rows):
+            row = noise[y * cols * 3:(y + 1) * cols * 3]
+            line = row if block == 1 else b"".join(row[x * 3:x * 3 + 3] * block for x in range(cols))[:width * 3]
+            for _ in range(min(block, height - y * block)): raw += b"\x00" + line
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0) # 8-bit RGB
+    return b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", ihdr) + png_chunk(b"IDAT", zlib.compress(bytes(raw), 1)) + png_chunk(b"IEND", b"")
+
+# === M3. 請求處理 ===
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 保持連線，與正式 API 的連線池行為一致
+    config = None; rng = random.Random(0); rng_lock = threading.Lock(); counters = {}
+
+    def log_message(self, format, *args):
+        if self.config.verbose: super().log_message(format, *args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items(): self.send_header(key, value)
+        self.end_headers(); self.wfile.write(data)
+
+    def count(self, name):
+        with self.rng_lock: self.counters[name] = self.counters.get(name, 0) + 1
+
+    def sleep(self, latency, jitter):
+        with self.rng_lock: delay = max(latency + self.rng.uniform(-jitter, jitter), 0)
+        time.sleep(delay)
+
+    # 依序判斷：前 fail_first 個請求 (api 與 cdn 分開計數) 依 error_statuses 輪流失敗，其後依錯誤率隨機失敗
+    def fail(self, kind, rate):
+        with self.rng_lock:
+            seen = self.counters[f"{kind}_requests"] = self.counters.get(f"{kind}_requests", 0) + 1
+            if seen <= self.config.fail_first: return self.config.error_statuses[(seen - 1) % len(self.config.error_statuses)]
+            if self.rng.random() >= rate: return None
+            return self.rng.choice(self.config.error_statuses)
+
+    def drop(self):
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)) # 關閉時送出 RST
+        self.close_connection = True
+
+    # M3-1. POST /v1/images/generations
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.rstrip('/') != "/v1/images/generations": return self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+        try: payload = json.loads(body); prompt = payload['prompt']; size = payload.get('size', "1024x1024")
+        except (ValueError, KeyError): return self.send_json(400, {"error": {"message": "Invalid request body", "type": "invalid_request_error"}})
+        try: width, height = (int(v) for v in (self.config.image_size or size).split("x"))
+        except ValueError: return self.send_json(400, {"error": {"message": f"Invalid size: {size}", "type": "invalid_request_error"}})
+
+        self.sleep(self.config.latency, self.config.jitter)
+        status = self.fail("api", self.config.error_rate)
+        if status:
+            self.count(f"api_{status}")
+            if status == "drop": return self.drop()
+            headers = {"Retry-After": self.config.retry_after} if status == 429 else None
+            return self.send_json(status, {"error": {"message": f"Simulated error {status}", "type": "server_error"}}, headers)
+        self.count("api_200")
+        key = hashlib.sha256(f"{prompt}|{size}".encode('utf-8')).hexdigest()[:32]
+        url = f"http://{self.headers.get('Host')}/images/{key}_{width}x{height}.png"
+        self.send_json(200, {"created": int(time.time()), "data": [{"url": url, "revised_prompt": f"{prompt} (revised)"}]})
+
+    # M3-2. GET /images/<key>_<寬>x<高>.png (模擬 CDN)；GET /stats 回傳各狀態的次數
+    def do_GET(self):
+        if self.path == "/stats": return self.send_json(200, self.counters)
+        if not (self.path.startswith("/images/") and self.path.endswith(".png")): return self.send_json(404, {"error": {"message": "Not found"}})
+        try:
+            key, dims = self.path[len("/images/"):-len(".png")].rsplit("_", 1)
+            width, height = (int(v) for v in dims.split("x"))
+        except ValueError: return self.send_json(404, {"error": {"message": "Not found"}})
+        self.sleep(self.config.cdn_latency, 0)
+        status = self.fail("cdn", self.config.cdn_error_rate)
+        if status: self.count(f"cdn_{status}"); return self.drop() if status == "drop" else self.send_json(status, {"error": {"message": f"Simulated error {status}"}})
+        self.count("cdn_200")
+        data = make_png(key, width, height, self.config.block, self.config.pattern)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png"); self.send_header("Content-Length", str(len(data)))
+        self.end_headers(); self.wfile.write(data)
+
+# === M4. 命令列介面 (create_server 亦供 tests/ 於同一行程內啟動，每個伺服器各自的設定與計數) ===
+def create_server(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI Images API 模擬伺服器 (壓力測試用)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=1.0, help="API 回應延遲秒數")
+    parser.add_argument("--jitter", type=float, default=0.0, help="API 延遲的隨機浮動 (±秒)")
+    parser.add_argument("--cdn-latency", type=float, default=0.0, help="圖片下載延遲秒數")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="API 回傳錯誤的比例 (0~1)")
+    parser.add_argument("--cdn-error-rate", type=float, default=0.0, help="圖片下載回傳錯誤的比例 (0~1)")
+    parser.add_argument("--error-statuses", default="429,500,503", help="隨機選用的錯誤狀態碼 (drop 表示中斷連線)")
+    parser.add_argument("--fail-first", type=int, default=0, help="前 N 個 API 請求與前 N 個圖片下載必定失敗")
+    parser.add_argument("--retry-after", default="1", help="429 回應的 Retry-After 標頭值")
+    parser.add_argument("--image-size", default=None, help="固定輸出尺寸 (例如 256x256；預設依請求的 size)")
+    parser.add_argument("--block", type=int, default=1, help="雜訊區塊邊長 (像素)，調整 PNG 壓縮後大小")
+    parser.add_argument("--pattern", choices=["noise", "photo"], default="noise", help="圖片內容 (photo 的壓縮特性接近真實照片)")
+    parser.add_argument("--seed", type=int, default=0, help="延遲與錯誤的亂數種子")
+    parser.add_argument("--verbose", action="store_true", help="輸出每個請求的記錄")
+    args = parser.parse_args(argv)
+    args.error_statuses = [s if s == "drop" else int(s) for s in args.error_statuses.split(",")]
+
+    handler = type("FakeOpenAIHandler", (FakeOpenAIHandler,), {"config": args, "rng": random.Random(args.seed), "rng_lock": threading.Lock(), "counters": {}})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+def main(argv=None):
+    server = create_server(argv)
+    args = server.RequestHandlerClass.config
+    print(f"模擬 OpenAI Images API: http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# ====================================================================
+# [H] WesmartAI 基準測試共用工具
+# --------------------------------------------------------------------
+# 於暫存工作目錄載入 app (目前版本，或以 git 版本號載入舊版作為比較基準)、啟動 bench/fake_openai.py，
+# 並以 Flask test client 驅動生成流程。舊版直接呼叫 https://api.openai.com/v1，一律改導向模擬 API。
+# 每個受測版本應在獨立行程中執行 (參見 run_isolated)，記憶體與模組狀態才不會互相影響。
+# ====================================================================
+
+# === H1. 套件匯入 ===
+import atexit, importlib.util, json, os, resource, shutil, socket, subprocess, sys, tempfile, time
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+OPENAI_URL = "https://api.openai.com/v1"
+
+# === H2. 模擬 API (獨立行程，避免其記憶體與 CPU 計入受測行程) ===
+def free_port():
+    with socket.socket() as s: s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+# 輪詢直到服務回應 (worker 啟動中可能連線被拒或讀取逾時，皆視為尚未就緒)；process 為 None 時不檢查行程是否結束
+def wait_until_ready(url, process=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None: raise RuntimeError(f"行程已結束 (代碼 {process.returncode}): {url}")
+        try:
+            requests.get(url, timeout=1); return
+        except requests.exceptions.RequestException: time.sleep(0.1)
+    raise RuntimeError(f"等待服務啟動逾時: {url}")
+
+def start_fake_openai(*argv):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(port), *argv], stdout=subprocess.DEVNULL)
+    wait_until_ready(f"http://127.0.0.1:{port}/stats", process)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+# === H3. 載入受測版本 ===
+# rev 為 None 時載入工作目錄的 app.py；否則以 git show 取出該版本 (例如 0a31a9f~1)
+# workdir 為 None 時使用新的暫存目錄 (結束時刪除)；指定時沿用既有目錄 (例如子行程讀取父行程準備的資料)
+def load_app(api_base, rev=None, env=None, font=None, workdir=None):
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="wesmart-bench-")
+        atexit.register(shutil.rmtree, workdir, True)
+    os.chdir(workdir)
+    os.environ.update({"OPENAI_API_KEY": "bench", "OPENAI_API_BASE": api_base, "DATA_DIR": os.path.join(workdir, "data"), "RETENTION_INTERVAL_SECONDS": "0", **(env or {})})
+    if font: shutil.copyfile(font, os.path.join(workdir, "NotoSansTC.otf")) # 離線環境以本機字型代替下載
+    if os.path.exists(os.path.join(REPO_DIR, "LOGO.jpg")): shutil.copyfile(os.path.join(REPO_DIR, "LOGO.jpg"), os.path.join(workdir, "LOGO.jpg"))
+
+    original_request = requests.Session.request
+    def redirect(self, method, url, *args, **kwargs):
+        if url.startswith(OPENAI_URL): url = api_base + url[len(OPENAI_URL):]
+        return original_request(self, method, url, *args, **kwargs)
+    requests.Session.request = redirect
+
+    path = os.path.join(REPO_DIR, "app.py")
+    if rev is not None:
+        path = os.path.join(workdir, f"app_{rev.replace('~', '_').replace('^', '_')}.py")
+        with open(path, "wb") as f: f.write(subprocess.run(["git", "show", f"{rev}:app.py"], cwd=REPO_DIR, check=True, capture_output=True).stdout)
+    if REPO_DIR not in sys.path: sys.path.insert(0, REPO_DIR) # verify_proof 等同層模組
+    spec = importlib.util.spec_from_file_location("app", path)
+    module = importlib.util.module_from_spec(spec); sys.modules["app"] = module
+    spec.loader.exec_module(module)
+    module.app.config['UPLOAD_FOLDER'] = os.path.abspath(module.app.config['UPLOAD_FOLDER']) # send_from_directory 的相對路徑以 app.py 所在目錄為準
+    return module
+
+# === H4. 驅動流程 (同步版 /generate 直接回傳結果；背景工作版回傳 202 後輪詢) ===
+def poll(client, url, timeout=300, done_status="done"):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = client.get(url).get_json()
+        if result.get('status') in (done_status, "error"): return result
+        time.sleep(0.01)
+    raise RuntimeError(f"輪詢逾時: {url}")
+
+def generate(client, prompt, size):
+    response = client.post('/generate', json={"prompt": prompt, "size": size})
+    result = response.get_json()
+    if response.status_code == 202: result = poll(client, result['status_url'])
+    if response.status_code >= 400 or result.get('status', "done") != "done": raise RuntimeError(f"生成失敗: {result}")
+    return result
+
+def create_report(client):
+    response = client.post('/create_report')
+    result = response.get_json()
+    if response.status_code == 202: result = poll(client, '/report_status')
+    if response.status_code >= 400 or result.get('status', "done") != "done": raise RuntimeError(f"報告產生失敗: {result}")
+    return result
+
+# === H5. 量測 ===
+def peak_rss_mb(): return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Linux 以 KB 回報
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+# 以獨立行程執行 script --variant <name>，子行程最後一行輸出 JSON 結果
+def run_isolated(script, variant, argv):
+    result = subprocess.run([sys.executable, script, "--variant", variant, "--child", *argv], capture_output=True, text=True)
+    if result.returncode != 0: raise RuntimeError(f"{variant} 執行失敗:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,223 @@
+# ====================================================================
+# [L] WesmartAI 壓力測試 (generate -> finalize_session -> create_report)
+# --------------------------------------------------------------------
+# 啟動 bench/fake_openai.py 與真正的 gunicorn worker，以多個模擬使用者並行跑完整流程，
+# 回報各 HTTP 端點與各流程步驟的 p50/p95/p99 延遲，以及每秒請求數，作為效能回歸的基準。
+# 每個模擬使用者有自己的 cookie (會話)；多個 worker 時以 SESSION_BACKEND=sqlite 共用會話。
+# --batch N 改為比較吞吐量：同一批 N 組 prompt 以 N 次循序 /generate 與一次 /generate_batch 的耗時。
+#
+# 用法: python bench/loadtest.py --users 8 --iterations 3 --generations 3 --workers 4
+#       python bench/loadtest.py --target http://127.0.0.1:8000 --duration 60   (對已啟動的服務)
+#       python bench/loadtest.py --batch 8 --users 1 --iterations 3
+# ====================================================================
+
+# === L1. 套件匯入 ===
+import argparse, json, math, os, shutil, signal, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from harness import wait_until_ready
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# === L2. 啟動受測服務 ===
+def start_fake_openai(args):
+    cmd = [sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(args.fake_port), "--latency", str(args.api_latency), "--jitter", str(args.api_jitter),
+           "--cdn-latency", str(args.cdn_latency), "--error-rate", str(args.api_error_rate), "--block", str(args.image_block)]
+    if args.image_size: cmd += ["--image-size", args.image_size]
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    wait_until_ready(f"http://127.0.0.1:{args.fake_port}/stats", process)
+    return process
+
+# L2-1. gunicorn 於暫存工作目錄執行 (static/ 與 DATA_DIR 皆在其中，不寫入專案目錄)，並停用背景清理
+def start_gunicorn(args, api_base):
+    font = args.font or os.path.join(REPO_DIR, "NotoSansTC.otf") # 已下載過的字型，或離線環境以本機字型代替
+    if os.path.exists(font): shutil.copyfile(font, os.path.join(args.workdir, "NotoSansTC.otf"))
+    shutil.copyfile(os.path.join(REPO_DIR, "LOGO.jpg"), os.path.join(args.workdir, "LOGO.jpg"))
+    env = dict(os.environ, OPENAI_API_KEY="bench", OPENAI_API_BASE=api_base, SESSION_BACKEND="sqlite", DATA_DIR=args.data_dir, RETENTION_INTERVAL_SECONDS="0")
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--pythonpath", REPO_DIR, "--workers", str(args.workers), "--threads", str(args.threads),
+           "--bind", f"127.0.0.1:{args.port}", "--timeout", "300", "--log-level", "warning"]
+    process = subprocess.Popen(cmd, cwd=args.workdir, env=env)
+    wait_until_ready(f"http://127.0.0.1:{args.port}/stats", process)
+    return process
+
+# === L3. 延遲紀錄 ===
+def percentile(sorted_values, p): return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {} # 名稱 -> [秒數]
+        self.errors = {} # 名稱 -> 次數
+        self.requests = 0
+
+    def record(self, name, seconds):
+        with self.lock: self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name):
+        with self.lock: self.errors[name] = self.errors.get(name, 0) + 1
+
+    # L3-1. requests 的 response hook：每個 HTTP 請求依端點分別記錄
+    def on_response(self, response, *args, **kwargs):
+        path = urlsplit(response.url).path
+        if path.startswith("/jobs/"): path = "/jobs/<job_id>"
+        name = f"{response.request.method} {path}"
+        with self.lock:
+            self.requests += 1
+            self.latencies.setdefault(name, []).append(response.elapsed.total_seconds())
+            if response.status_code >= 500: self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        with self.lock:
+            rows = {}
+            for name in sorted(set(self.latencies) | set(self.errors)):
+                values = sorted(self.latencies.get(name, []))
+                row = {"count": len(values), "errors": self.errors.get(name, 0)}
+                if values:
+                    row.update(p50=percentile(values, 50), p95=percentile(values, 95), p99=percentile(values, 99), mean=sum(values) / len(values), max=values[-1])
+                rows[name] = row
+            return rows, self.requests
+
+# === L4. 模擬使用者流程 ===
+def poll(session, url, args, done_status="done"):
+    while True:
+        result = session.get(url, timeout=args.request_timeout).json()
+        if result.get('status') in (done_status, "error"): return result
+        time.sleep(args.poll_interval)
+
+def run_flow(base, user, iteration, args, recorder):
+    session = requests.Session(); session.hooks['response'].append(recorder.on_response)
+    flow_start = time.monotonic()
+    session.get(f"{base}/", timeout=args.request_timeout) # 取得 cookie 並重置會話
+    generated = 0
+    for k in range(args.generations):
+        start = time.monotonic()
+        response = session.post(f"{base}/generate", json={"prompt": f"bench u{user} i{iteration} g{k % args.distinct_prompts}", "size": args.size}, timeout=args.request_timeout)
+        if response.status_code != 202: recorder.error("generate"); continue
+        result = poll(session, base + response.json()['status_url'], args)
+        if result['status'] != "done": recorder.error("generate"); continue
+        recorder.record("generate", time.monotonic() - start); generated += 1
+    if not generated: recorder.error("flow"); return
+
+    start = time.monotonic()
+    response = session.post(f"{base}/finalize_session", json={"applicant_name": f"bench-user-{user}"}, timeout=args.request_timeout)
+    if response.status_code != 200: recorder.error("finalize"); recorder.error("flow"); return
+    recorder.record("finalize", time.monotonic() - start)
+
+    if not args.skip_report:
+        start = time.monotonic()
+        response = session.post(f"{base}/create_report", timeout=args.request_timeout)
+        result = response.json()
+        if response.status_code == 202: result = poll(session, f"{base}/report_status", args)
+        if result.get('status') != "done": recorder.error("report"); recorder.error("flow"); return
+        recorder.record("report", time.monotonic() - start)
+    recorder.record("flow", time.monotonic() - flow_start)
+
+# L4-1. 批次吞吐量：同一組 prompt 先以循序 /generate 逐一完成，重置會話後再以單次 /generate_batch 完成
+def run_batch_flow(base, user, iteration, args, recorder):
+    session = requests.Session(); session.hooks['response'].append(recorder.on_response)
+    items = [{"prompt": f"bench u{user} i{iteration} b{k}", "size": args.size} for k in range(args.batch)]
+    session.get(f"{base}/", timeout=args.request_timeout)
+    start = time.monotonic()
+    for item in items:
+        response = session.post(f"{base}/generate", json=item, timeout=args.request_timeout)
+        if response.status_code != 202 or poll(session, base + response.json()['status_url'], args)['status'] != "done": recorder.error("sequential"); recorder.error("flow"); return
+    recorder.record("sequential", time.monotonic() - start)
+
+    session.get(f"{base}/", timeout=args.request_timeout)
+    start = time.monotonic()
+    response = session.post(f"{base}/generate_batch", json={"items": items}, timeout=args.request_timeout)
+    if response.status_code != 202: recorder.error("batch"); recorder.error("flow"); return
+    result = poll(session, base + response.json()['status_url'], args)
+    if result['status'] != "done" or any(item['status'] != "done" for item in result['items']): recorder.error("batch"); recorder.error("flow"); return
+    recorder.record("batch", time.monotonic() - start)
+    recorder.record("flow", time.monotonic() - start)
+
+def run_user(base, user, args, recorder, deadline):
+    iteration = 0
+    while (iteration < args.iterations) if deadline is None else (time.monotonic() < deadline):
+        try: (run_batch_flow if args.batch else run_flow)(base, user, iteration, args, recorder)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            recorder.error("flow"); print(f"使用者 {user} 第 {iteration} 輪失敗: {e}", file=sys.stderr)
+        iteration += 1
+
+# === L5. 結果輸出 ===
+def print_summary(rows, total_requests, elapsed):
+    print(f"{'名稱':<28}{'次數':>8}{'錯誤':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'平均':>10}{'最大':>10}")
+    for name, row in rows.items():
+        if not row['count']: print(f"{name:<28}{0:>8}{row['errors']:>8}"); continue
+        print(f"{name:<28}{row['count']:>8}{row['errors']:>8}" + "".join(f"{row[k]:>10.3f}" for k in ("p50", "p95", "p99", "mean", "max")))
+    flows = rows.get("flow", {}).get("count", 0)
+    print(f"\n總時間 {elapsed:.1f} 秒，HTTP 請求 {total_requests} 次 ({total_requests / elapsed:.1f} req/s)，完成流程 {flows} 次 ({flows / elapsed:.2f} flow/s)")
+    if rows.get("sequential", {}).get("count") and rows.get("batch", {}).get("count"):
+        print(f"批次 / 循序平均耗時: {rows['batch']['mean']:.2f} / {rows['sequential']['mean']:.2f} 秒 (加速 {rows['sequential']['mean'] / rows['batch']['mean']:.1f} 倍)")
+
+# === L6. 命令列介面 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WesmartAI 壓力測試 (generate -> finalize_session -> create_report)")
+    parser.add_argument("--target", default=None, help="已啟動服務的網址 (未指定時自動啟動 gunicorn 與模擬 API)")
+    parser.add_argument("--users", type=int, default=8, help="並行的模擬使用者數")
+    parser.add_argument("--iterations", type=int, default=3, help="每位使用者執行的流程次數")
+    parser.add_argument("--duration", type=float, default=None, help="改為持續執行指定秒數")
+    parser.add_argument("--generations", type=int, default=3, help="每個流程生成的版本數")
+    parser.add_argument("--distinct-prompts", type=int, default=1000000, help="每個流程內不同 prompt 的數量 (較小時可測試生成結果快取)")
+    parser.add_argument("--size", default="1024x1024")
+    parser.add_argument("--skip-report", action="store_true", help="不產生 PDF 報告")
+    parser.add_argument("--batch", type=int, default=0, help="改為比較 N 次循序 /generate 與一次 /generate_batch 的耗時 (N 不可超過 BATCH_MAX_ITEMS)")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker 數")
+    parser.add_argument("--threads", type=int, default=8, help="每個 gunicorn worker 的執行緒數")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workdir", default=None, help="受測服務的工作目錄 (static/ 所在；預設為暫存目錄，結束時刪除)")
+    parser.add_argument("--data-dir", default=None, help="受測服務的 DATA_DIR (預設為工作目錄下的 data/)")
+    parser.add_argument("--font", default=None, help="報告字型檔 (離線環境以本機字型代替下載)")
+    parser.add_argument("--api-base", default=None, help="使用已啟動的 OpenAI 相容 API (未指定時啟動模擬 API)")
+    parser.add_argument("--fake-port", type=int, default=8001)
+    parser.add_argument("--api-latency", type=float, default=1.0, help="模擬 API 延遲秒數")
+    parser.add_argument("--api-jitter", type=float, default=0.2)
+    parser.add_argument("--cdn-latency", type=float, default=0.05)
+    parser.add_argument("--api-error-rate", type=float, default=0.0)
+    parser.add_argument("--image-size", default=None, help="模擬 API 固定輸出的圖片尺寸 (例如 256x256)")
+    parser.add_argument("--image-block", type=int, default=2, help="模擬圖片的雜訊區塊邊長 (控制 PNG 大小)")
+    parser.add_argument("--json", default=None, help="將結果 (含服務端 /stats) 寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    processes = []; cleanup = []
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1)) # 被終止時仍關閉子行程
+    try:
+        base = args.target
+        if base is None:
+            if args.api_base is None: processes.append(start_fake_openai(args))
+            if args.workdir is None:
+                args.workdir = tempfile.mkdtemp(prefix="wesmart-bench-"); cleanup.append(args.workdir)
+            args.data_dir = args.data_dir or os.path.join(args.workdir, "data")
+            processes.append(start_gunicorn(args, args.api_base or f"http://127.0.0.1:{args.fake_port}/v1"))
+            base = f"http://127.0.0.1:{args.port}"
+        base = base.rstrip("/")
+
+        recorder = Recorder()
+        deadline = time.monotonic() + args.duration if args.duration else None
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.users) as executor:
+            for future in [executor.submit(run_user, base, user, args, recorder, deadline) for user in range(args.users)]: future.result()
+        elapsed = time.monotonic() - start
+
+        rows, total_requests = recorder.summary()
+        print_summary(rows, total_requests, elapsed)
+        if args.json:
+            try: server_stats = requests.get(f"{base}/stats", timeout=10).json()
+            except (requests.exceptions.RequestException, ValueError): server_stats = None
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({"config": vars(args), "elapsed": elapsed, "requests": total_requests, "rps": total_requests / elapsed, "results": rows, "server_stats": server_stats}, f, ensure_ascii=False, indent=2)
+        return 1 if rows.get("flow", {}).get("errors") else 0
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try: process.wait(timeout=10)
+            except subprocess.TimeoutExpired: process.kill()
+        for path in cleanup: shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
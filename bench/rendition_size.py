@@ -0,0 +1,91 @@
+# ====================================================================
+# [S] WesmartAI 衍生圖檔基準 (預覽傳輸量與 PDF 檔案大小)
+# --------------------------------------------------------------------
+# 以模擬 API 生成數個版本後，經由 Flask 路由下載原圖 PNG 與各種衍生圖 (thumb / preview WebP / preview_jpg)，
+# 比較每張圖片的傳輸位元組數，以及帶 If-None-Match 重新驗證時的回應大小 (304，無內容)。
+# 接著結束任務並渲染兩份 PDF：內嵌 PDF 版面解析度 JPEG 衍生圖 (目前做法) 與內嵌原圖 PNG (衍生圖之前的做法)。
+# 離線環境無法下載 NotoSansTC 字型時，以 --font 指定本機字型檔代替。
+#
+# 用法: python bench/rendition_size.py --versions 10 --sizes 1024x1024,1792x1024 --font /path/to/NotoSansTC.otf
+# ====================================================================
+
+# === S1. 套件匯入 ===
+import argparse, contextlib, io, json, os, sys, uuid
+import harness
+
+KINDS = ("original", "thumb", "preview", "preview_jpg")
+
+# === S2. 預覽傳輸量 ===
+def measure_previews(app, client, items):
+    totals = {kind: 0 for kind in KINDS}; revalidated = 0
+    with app.app.test_request_context():
+        urls = [{"original": item['original_url'], **{name: app.url_for('rendition', file_hash=item['file_hash'], name=name) for name in KINDS[1:]}} for item in items]
+    for entry in urls:
+        for kind, url in entry.items():
+            response = client.get(url)
+            if response.status_code != 200: raise RuntimeError(f"下載失敗 ({response.status_code}): {url}")
+            totals[kind] += len(response.data)
+            if kind == "preview":
+                again = client.get(url, headers={"If-None-Match": response.headers['ETag']})
+                if again.status_code != 304: raise RuntimeError(f"重新驗證未回傳 304: {url}")
+                revalidated += len(again.data)
+    return totals, revalidated
+
+# === S3. PDF 大小 (原圖版本讓 PDF 衍生圖失敗，渲染程式即退回內嵌原圖) ===
+def render_pdf(app, json_filepath, originals):
+    with open(json_filepath, encoding='utf-8') as f: final_event_hash = json.load(f)['event_proof']['final_event_hash']
+    report_relpath, progress_path = app.report_paths(final_event_hash, uuid.uuid4().hex)
+    os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+    ensure = app.renditions.ensure
+    def without_pdf_rendition(file_hash, name):
+        if name == "pdf": raise RuntimeError("bench: 內嵌原圖")
+        return ensure(file_hash, name)
+    if originals: app.renditions.ensure = without_pdf_rendition
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): app.render_report(json_filepath, report_relpath, progress_path)
+    finally: app.renditions.ensure = ensure
+    return os.path.getsize(os.path.join(app.static_folder, report_relpath))
+
+# === S4. 命令列介面 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="衍生圖檔基準 (預覽傳輸量與 PDF 檔案大小)")
+    parser.add_argument("--versions", type=int, default=10, help="每種尺寸生成的版本數")
+    parser.add_argument("--sizes", default="1024x1024,1792x1024")
+    parser.add_argument("--image-pattern", choices=["photo", "noise"], default="photo", help="模擬圖片內容 (noise 為有損格式的最差情況)")
+    parser.add_argument("--image-block", type=int, default=4, help="noise 圖片的雜訊區塊邊長")
+    parser.add_argument("--font", default=None, help="以本機字型檔代替下載的 NotoSansTC.otf")
+    parser.add_argument("--skip-pdf", action="store_true", help="不比較 PDF 大小")
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    fake, api_base = harness.start_fake_openai("--latency", "0", "--pattern", args.image_pattern, "--block", str(args.image_block))
+    try:
+        app = harness.load_app(api_base, font=args.font, env={"GENERATION_CACHE": "0"})
+        client = app.app.test_client()
+        items = [harness.generate(client, f"rendition bench {size} {k}", size) for size in args.sizes.split(",") for k in range(args.versions)]
+        if app.renditions.executor is not None: app.renditions.executor.shutdown(wait=True)
+        totals, revalidated = measure_previews(app, client, items)
+
+        print(f"{len(items)} 張圖片 ({args.sizes}，{args.image_pattern})")
+        print(f"{'內容':<14}{'總計 MB':>10}{'每張 KB':>10}{'相對原圖':>10}")
+        for kind in KINDS:
+            print(f"{kind:<14}{totals[kind] / 1024 ** 2:>10.2f}{totals[kind] / len(items) / 1024:>10.1f}{totals[kind] / totals['original']:>10.1%}")
+        print(f"preview 以 If-None-Match 重新驗證: 304，內容 {revalidated} bytes")
+        result = {"config": vars(args), "images": len(items), "bytes": totals, "revalidated_bytes": revalidated}
+
+        if not args.skip_pdf:
+            response = client.post('/finalize_session', json={"applicant_name": "bench"})
+            if response.status_code != 200: raise RuntimeError(f"結束任務失敗: {response.get_json()}")
+            json_filepath = app.session_store.get(client.get_cookie(app.SESSION_COOKIE).value)['proof']['json_filepath']
+            pdf = {"renditions": render_pdf(app, json_filepath, originals=False), "originals": render_pdf(app, json_filepath, originals=True)}
+            print(f"PDF ({len(items)} 個版本): 內嵌原圖 {pdf['originals'] / 1024 ** 2:.2f} MB -> 內嵌衍生圖 {pdf['renditions'] / 1024 ** 2:.2f} MB "
+                  f"(減少 {1 - pdf['renditions'] / pdf['originals']:.1%})")
+            result['pdf_bytes'] = pdf
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f: json.dump(result, f, ensure_ascii=False, indent=2)
+    finally:
+        fake.terminate(); fake.wait()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# ====================================================================
+# [Q] WesmartAI PDF 報告渲染基準 (1 / 10 / 50 個版本的渲染時間與峰值記憶體、啟動時間與冷/熱報告延遲)
+# --------------------------------------------------------------------
+# 先以模擬 API 生成並結束含不同版本數的任務 (共用一個暫存工作目錄)，再於獨立行程中以 render_report
+# 渲染各份證據正本，量測牆鐘時間、各階段秒數與峰值 RSS (扣除載入 app 後的起始值)。
+# 每個子行程另外量測啟動時間 (載入 app 與等待 PDF 素材預載完成)，並連續渲染 --repeat 次：
+# 第一次為冷報告 (首次解析字型)，其後為熱報告。--compare-rev 以舊版 app.py 渲染相同的證據正本作為對照。
+# 離線環境無法下載 NotoSansTC 字型時，以 --font 指定本機字型檔代替。
+#
+# 用法: python bench/report_render.py --snapshots 1,10,50 --size 1792x1024 --font /path/to/NotoSansTC.otf
+#       python bench/report_render.py --snapshots 1,10 --repeat 5 --compare-rev 291247f~1   (字型/Logo 快取之前)
+# ====================================================================
+
+# === Q1. 套件匯入 ===
+import argparse, gc, json, os, sys, time, uuid
+import harness
+
+# === Q2. 準備證據正本 (父行程) ===
+def prepare(args):
+    fake, api_base = harness.start_fake_openai("--latency", "0", "--block", str(args.image_block))
+    try:
+        app = harness.load_app(api_base, font=args.font, env={"GENERATION_CACHE": "0"})
+        proofs = {}
+        for count in args.snapshots:
+            client = app.app.test_client()
+            for k in range(count): harness.generate(client, f"report bench {count} version {k + 1}", args.size)
+            response = client.post('/finalize_session', json={"applicant_name": f"bench-{count}"})
+            if response.status_code != 200: raise RuntimeError(f"結束任務失敗: {response.get_json()}")
+            proofs[count] = app.session_store.get(client.get_cookie(app.SESSION_COOKIE).value)['proof']['json_filepath']
+        if app.renditions.executor is not None: app.renditions.executor.shutdown(wait=True) # 報告使用已產生的 PDF 衍生圖
+        return os.getcwd(), proofs
+    finally:
+        fake.terminate(); fake.wait()
+
+# === Q3. 渲染報告 (子行程；舊版的 render_report 只回傳路徑，沒有各階段秒數) ===
+def render(args):
+    start = time.perf_counter()
+    app = harness.load_app("http://127.0.0.1:9/v1", rev=args.rev, workdir=args.workdir)
+    import_seconds = time.perf_counter() - start
+    if hasattr(app, "pdf_assets"): app.pdf_assets.load_font(); app.pdf_assets.load_logo() # 等待背景預載完成
+    startup_seconds = time.perf_counter() - start
+    gc.collect(); baseline = harness.current_rss_mb()
+    with open(args.proof, encoding='utf-8') as f: proof_data = json.load(f)
+    seconds = []
+    for _ in range(args.repeat):
+        report_relpath, progress_path = app.report_paths(proof_data['event_proof']['final_event_hash'], uuid.uuid4().hex)
+        os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+        start = time.perf_counter()
+        result = app.render_report(args.proof, report_relpath, progress_path)
+        seconds.append(time.perf_counter() - start)
+        if len(seconds) == 1: phases = result.get('phases', {}) if isinstance(result, dict) else {}
+    return {"snapshots": int(args.variant), "rev": args.rev or "working tree", "import_seconds": import_seconds, "startup_seconds": startup_seconds,
+            "seconds": seconds[0], "warm_seconds": sum(seconds[1:]) / len(seconds[1:]) if len(seconds) > 1 else None, "phases": phases,
+            "baseline_mb": baseline, "peak_mb": harness.peak_rss_mb(), "pdf_mb": os.path.getsize(os.path.join(app.static_folder, report_relpath)) / 1024 ** 2}
+
+# === Q4. 命令列介面 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF 報告渲染基準 (渲染時間與峰值記憶體)")
+    parser.add_argument("--snapshots", default="1,10,50", help="各報告的版本數 (逗號分隔)")
+    parser.add_argument("--size", default="1792x1024")
+    parser.add_argument("--image-block", type=int, default=2, help="模擬圖片的雜訊區塊邊長 (控制 PNG 大小)")
+    parser.add_argument("--font", default=None, help="以本機字型檔代替下載的 NotoSansTC.otf")
+    parser.add_argument("--repeat", type=int, default=3, help="每個行程連續渲染的次數 (第一次為冷報告)")
+    parser.add_argument("--compare-rev", default=None, help="另以此 git 版本的 app.py 渲染作為對照")
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    parser.add_argument("--variant", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--proof", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--rev", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child: print(json.dumps(render(args))); return 0
+    args.snapshots = [int(n) for n in args.snapshots.split(",")]
+    workdir, proofs = prepare(args)
+    revs = [None] + ([args.compare_rev] if args.compare_rev else [])
+    results = [harness.run_isolated(os.path.abspath(__file__), str(count), ["--workdir", workdir, "--proof", proofs[count], "--repeat", str(args.repeat)] + (["--rev", rev] if rev else []))
+               for rev in revs for count in args.snapshots]
+
+    print(f"{'app.py':<14}{'版本數':<8}{'啟動秒數':>10}{'冷報告':>8}{'熱報告':>8}{'峰值 MB':>10}{'峰值增量':>10}{'PDF MB':>9}  各階段秒數 (冷報告)")
+    for r in results:
+        phases = " ".join(f"{phase}={seconds:.2f}" for phase, seconds in r['phases'].items())
+        warm = f"{r['warm_seconds']:>8.2f}" if r['warm_seconds'] is not None else f"{'-':>8}"
+        print(f"{r['rev']:<14}{r['snapshots']:<8}{r['startup_seconds']:>10.2f}{r['seconds']:>8.2f}{warm}{r['peak_mb']:>10.1f}{r['peak_mb'] - r['baseline_mb']:>10.1f}{r['pdf_mb']:>9.2f}  {phases}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+# ====================================================================
+# [R] WesmartAI 會話記憶體基準 (預覽圖 base64 內嵌於會話 vs Blob Store)
+# --------------------------------------------------------------------
+# 以同一組模擬 API 圖片生成 N 個版本並結束任務，分別量測舊版 (--before-rev，預覽圖以 content_base64
+# 保存在會話與證據正本中) 與目前版本 (會話只保存 file_hash) 的峰值 RSS 與結束後仍占用的 RSS。
+# 兩個版本各在獨立行程中執行。
+#
+# 用法: python bench/session_memory.py --versions 50 --size 1792x1024
+# ====================================================================
+
+# === R1. 套件匯入 ===
+import argparse, gc, json, os, sys
+import harness
+
+# === R2. 單一版本量測 (子行程) ===
+def run_variant(args):
+    rev = args.before_rev if args.variant == "before" else None
+    fake, api_base = harness.start_fake_openai("--latency", "0", "--block", str(args.image_block))
+    try:
+        # 舊版的會話大小上限以預設值計會先觸發，基準測試時放寬
+        app = harness.load_app(api_base, rev=rev, env={"SESSION_MAX_BYTES": str(2 ** 40), "SESSION_MAX_TOTAL_BYTES": str(2 ** 40), "GENERATION_CACHE": "0"})
+        client = app.app.test_client()
+        gc.collect(); baseline = harness.current_rss_mb()
+        for k in range(args.versions): harness.generate(client, f"memory bench version {k + 1}", args.size)
+        generated = harness.current_rss_mb()
+        response = client.post('/finalize_session', json={"applicant_name": "bench"})
+        if response.status_code != 200: raise RuntimeError(f"結束任務失敗: {response.get_json()}")
+        gc.collect()
+        return {"variant": args.variant, "rev": rev or "working tree", "baseline_mb": baseline, "after_generate_mb": generated,
+                "after_finalize_mb": harness.current_rss_mb(), "peak_mb": harness.peak_rss_mb()}
+    finally:
+        fake.terminate(); fake.wait()
+
+# === R3. 命令列介面 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="會話記憶體基準 (峰值 RSS，舊版 vs 目前版本)")
+    parser.add_argument("--versions", type=int, default=50, help="每個會話生成的版本數")
+    parser.add_argument("--size", default="1792x1024")
+    parser.add_argument("--image-block", type=int, default=2, help="模擬圖片的雜訊區塊邊長 (控制 PNG 大小)")
+    parser.add_argument("--before-rev", default="0a31a9f~1", help="比較基準的 git 版本 (Blob Store 之前)")
+    parser.add_argument("--variant", choices=["before", "after", "both"], default="both")
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child: print(json.dumps(run_variant(args))); return 0
+    passthrough = ["--versions", str(args.versions), "--size", args.size, "--image-block", str(args.image_block), "--before-rev", args.before_rev]
+    variants = ["before", "after"] if args.variant == "both" else [args.variant]
+    results = [harness.run_isolated(os.path.abspath(__file__), variant, passthrough) for variant in variants]
+
+    print(f"{args.versions} 個版本 ({args.size})")
+    print(f"{'版本':<14}{'起始 MB':>10}{'生成後 MB':>12}{'結束後 MB':>12}{'峰值 MB':>10}{'峰值增量':>10}")
+    for r in results:
+        print(f"{r['variant']:<14}{r['baseline_mb']:>10.1f}{r['after_generate_mb']:>12.1f}{r['after_finalize_mb']:>12.1f}{r['peak_mb']:>10.1f}{r['peak_mb'] - r['baseline_mb']:>10.1f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
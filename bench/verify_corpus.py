@@ -0,0 +1,104 @@
+# ====================================================================
+# [C] WesmartAI 離線驗證基準 (合成的 10k 份證據檔)
+# --------------------------------------------------------------------
+# 以 verify_proof.py 的雜湊定義產生合成語料：--reports 份證據檔 (proofs/<前兩碼>/proof_event_<id>.json)，
+# 每份 --snapshots 個快照，引用共用的原圖池 (static/blobs/...)，並刻意竄改 --corrupt 比例的檔案。
+# 接著以不同的行程數執行 verify_many，回報每秒驗證的檔案數、快照數與雜湊的原圖位元組，
+# 並確認偵測到的不一致數量與竄改數量相同。重複執行時檔案已在頁面快取中 (熱快取)。
+#
+# 用法: python bench/verify_corpus.py --reports 10000 --snapshots 3 --workers 1,4,8
+# ====================================================================
+
+# === C1. 套件匯入 ===
+import argparse, datetime, json, os, random, shutil, sys, tempfile, time, uuid
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import verify_proof
+from verify_proof import ChainState, sha256_bytes, sha256_text, step_hash_of
+
+# === C2. 產生合成語料 ===
+def write_blob_pool(static_root, count, size, rng):
+    hashes = []
+    for _ in range(count):
+        data = b"\x89PNG\r\n\x1a\n" + rng.randbytes(size - 8); file_hash = sha256_bytes(data)
+        path = os.path.join(static_root, "blobs", file_hash[:2], f"{file_hash}.png")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f: f.write(data)
+        hashes.append(file_hash)
+    return hashes
+
+def make_proof(report_id, snapshot_count, blob_hashes, rng, corrupt):
+    chain = ChainState(); snapshots = []
+    issued_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=rng.randrange(365 * 86400))
+    for k in range(snapshot_count):
+        snapshot = {"version_index": k + 1, "prompt": f"synthetic prompt {report_id} {k}", "revised_prompt": f"revised prompt {report_id} {k}", "size": "1024x1024",
+                    "model": "dall-e-3", "timestamp_utc": (issued_at - datetime.timedelta(minutes=snapshot_count - k)).isoformat()}
+        file_hash = rng.choice(blob_hashes)
+        snapshot['blob_path'] = f"blobs/{file_hash[:2]}/{file_hash}.png"
+        hashes = {"timestamp_hash": sha256_text(snapshot['timestamp_utc']), "prompt_hash": sha256_text(snapshot['prompt']),
+                  "revised_prompt_hash": sha256_text(snapshot['revised_prompt']), "size_hash": sha256_text(snapshot['size']), "file_hash": file_hash}
+        hashes['step_hash'] = step_hash_of(hashes); snapshot['hashes'] = hashes
+        chain.extend(hashes['step_hash']); snapshot['chain_hash'] = chain.chain_hash
+        snapshots.append(snapshot)
+    if corrupt: snapshots[rng.randrange(snapshot_count)]['prompt'] += " (edited)" # 記錄的雜湊不再相符
+    return {"report_id": report_id, "issuer": "WesmartAI Inc.", "applicant": f"applicant-{rng.randrange(1000)}", "issued_at": issued_at.isoformat(),
+            "event_proof": {"final_event_hash": chain.legacy_final_event_hash(), "final_hash_mode": "compat",
+                            "chain": {"algorithm": "sha256", "genesis": verify_proof.CHAIN_GENESIS, "leaf_count": chain.count, "chain_hash": chain.chain_hash,
+                                      "merkle_root": chain.merkle_root(), "legacy_final_event_hash": chain.legacy_final_event_hash()},
+                            "snapshots": snapshots}}
+
+def build_corpus(root, args):
+    rng = random.Random(args.seed)
+    blob_hashes = write_blob_pool(os.path.join(root, "static"), args.blob_pool, args.blob_kb * 1024, rng)
+    corrupted = 0
+    for _ in range(args.reports):
+        report_id = str(uuid.UUID(int=rng.getrandbits(128), version=4)); corrupt = rng.random() < args.corrupt
+        path = os.path.join(root, "proofs", report_id[:2], f"proof_event_{report_id}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f: json.dump(make_proof(report_id, args.snapshots, blob_hashes, rng, corrupt), f, ensure_ascii=False, indent=2)
+        corrupted += corrupt
+    return corrupted
+
+# === C3. 命令列介面 ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線驗證基準 (合成證據檔語料)")
+    parser.add_argument("--reports", type=int, default=10000, help="證據檔數量")
+    parser.add_argument("--snapshots", type=int, default=3, help="每份證據檔的快照數")
+    parser.add_argument("--blob-pool", type=int, default=512, help="原圖池的檔案數 (快照隨機引用)")
+    parser.add_argument("--blob-kb", type=int, default=64, help="每個原圖的大小 (KB)")
+    parser.add_argument("--corrupt", type=float, default=0.01, help="刻意竄改的證據檔比例")
+    parser.add_argument("--workers", default=",".join(str(w) for w in sorted({1, os.cpu_count() or 1})), help="要比較的驗證行程數 (逗號分隔)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", default=None, help="語料目錄 (預設為暫存目錄，結束後刪除；指定且已存在時沿用)")
+    parser.add_argument("--json", default=None, help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    root = args.corpus or tempfile.mkdtemp(prefix="wesmart-corpus-")
+    try:
+        corrupted = None
+        if not os.path.isdir(os.path.join(root, "proofs")):
+            start = time.perf_counter(); corrupted = build_corpus(root, args)
+            print(f"已產生 {args.reports} 份證據檔 ({args.snapshots} 個快照，竄改 {corrupted} 份)，耗時 {time.perf_counter() - start:.1f} 秒")
+        paths = list(verify_proof.expand_paths([os.path.join(root, "proofs")]))
+        static_root = os.path.join(root, "static")
+        print(f"JSON 解析: {'ijson 串流' if verify_proof.ijson else 'json 整檔'}")
+        print(f"{'行程數':<8}{'秒數':>8}{'檔案/秒':>10}{'快照/秒':>10}{'原圖 MB/秒':>12}{'不一致':>8}")
+        results = []
+        for workers in [int(w) for w in args.workers.split(",")]:
+            start = time.perf_counter(); failed = snapshots = 0
+            for result in verify_proof.verify_many(paths, static_root, workers):
+                failed += not result['ok']; snapshots += result['snapshots']
+            elapsed = time.perf_counter() - start
+            row = {"workers": workers, "seconds": elapsed, "files_per_second": len(paths) / elapsed, "snapshots_per_second": snapshots / elapsed,
+                   "blob_mb_per_second": snapshots * args.blob_kb / 1024 / elapsed, "failed": failed}
+            results.append(row)
+            print(f"{workers:<8}{elapsed:>8.2f}{row['files_per_second']:>10.0f}{row['snapshots_per_second']:>10.0f}{row['blob_mb_per_second']:>12.1f}{failed:>8}")
+            if corrupted is not None and failed != corrupted: print(f"警告: 偵測到 {failed} 份不一致，預期 {corrupted} 份", file=sys.stderr); return 1
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f: json.dump({"config": vars(args), "files": len(paths), "results": results}, f, ensure_ascii=False, indent=2)
+        return 0
+    finally:
+        if args.corpus is None: shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
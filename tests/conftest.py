@@ -0,0 +1,36 @@
+# 測試環境：在匯入 app 之前切換到暫存目錄並設定環境變數，避免寫入專案的 static/ 與 data/
+import os, sys, tempfile, threading
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR); sys.path.insert(0, os.path.join(REPO_DIR, "bench"))
+WORK_DIR = tempfile.mkdtemp(prefix="wesmart-test-")
+os.chdir(WORK_DIR)
+os.environ.update(OPENAI_API_KEY="test", DATA_DIR=os.path.join(WORK_DIR, "data"), RETENTION_INTERVAL_SECONDS="0",
+                  HTTP_BACKOFF_BASE="0.01", HTTP_BACKOFF_MAX="0.1", FONT_URL="") # 不下載報告字型 (渲染子行程同樣沿用)
+
+import app as wesmart
+import fake_openai
+
+wesmart.PdfAssets.prefetch = lambda self: None
+
+# 啟動同一行程內的模擬 OpenAI Images API；回傳 (伺服器, API 網址)
+@pytest.fixture
+def fake_api():
+    servers = []
+    def start(*argv):
+        server = fake_openai.create_server(["--port", "0", "--latency", "0", *argv])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield start
+    for server in servers: server.shutdown(); server.server_close()
+
+@pytest.fixture
+def app_module(): return wesmart
+
+# 結束前等待背景衍生圖完成 (pytest 結束時會切回原本的工作目錄)
+@pytest.fixture(scope="session", autouse=True)
+def drain_background_work():
+    yield
+    if wesmart.renditions.executor is not None: wesmart.renditions.executor.shutdown(wait=True)
@@ -0,0 +1,29 @@
+# /generate_batch 的依序追加：項目完成順序與 as_completed 回傳順序不同時，已追加的項目不可被改回 fetched
+import threading, time, uuid
+import fake_openai
+
+def test_prefix_commit_is_not_overwritten_by_late_fetched_update(app_module, monkeypatch):
+    item1_may_finish, item1_finished = threading.Event(), threading.Event()
+    def fetch_generation(prompt, size):
+        if prompt == "item 1": item1_may_finish.wait(5)
+        file_hash = app_module.blob_store.put_stream([fake_openai.make_png(prompt, 32, 32)], validate_header=app_module.validate_png_header)
+        if prompt == "item 1": item1_finished.set()
+        return {"prompt": prompt, "size": size, "revised_prompt": prompt, "file_hash": file_hash}
+
+    # 項目 0 標記為 fetched 後才讓項目 1 完成：前綴迴圈會一併追加項目 1，之後 as_completed 才回傳項目 1
+    original_set_batch_item = app_module.set_batch_item
+    def set_batch_item(sid, job_id, index, **fields):
+        original_set_batch_item(sid, job_id, index, **fields)
+        if index == 0 and fields.get('status') == "fetched":
+            item1_may_finish.set(); item1_finished.wait(5); time.sleep(0.05) # 等待 future 標記為完成
+    monkeypatch.setattr(app_module, "fetch_generation", fetch_generation)
+    monkeypatch.setattr(app_module, "set_batch_item", set_batch_item)
+
+    sid, job_id = uuid.uuid4().hex, uuid.uuid4().hex
+    items = [{"prompt": f"item {i}", "size": "1024x1024"} for i in range(2)]
+    app_module.set_job_state(sid, job_id, status="running", kind="batch", items=[{"status": "queued", **item} for item in items])
+    assert app_module.run_batch(sid, job_id, items) == {"completed": 2}
+
+    state = app_module.session_store.get(sid)
+    assert [item['status'] for item in state['jobs'][job_id]['items']] == ["done", "done"]
+    assert [p['prompt'] for p in state['previews']] == ["item 0", "item 1"]
@@ -0,0 +1,60 @@
+# Blob Store 參照計數與垃圾回收：只刪除無參照且未被證據正本引用的圖檔；索引中沒有紀錄的原圖與舊版預覽檔一律保留
+import os, time, uuid
+import pytest
+
+@pytest.fixture
+def store(app_module, tmp_path):
+    return app_module.BlobStore(root=str(tmp_path / "blobs"), index_path=str(tmp_path / "blobs.sqlite3"))
+
+def refcount(store, file_hash):
+    row = store._conn().execute("SELECT refcount FROM blobs WHERE hash = ?", (file_hash,)).fetchone()
+    return row and row[0]
+
+def age(path, seconds=7200): os.utime(path, (time.time() - seconds,) * 2)
+
+def test_put_deduplicates_and_refcounts_never_go_negative(store):
+    data = os.urandom(256)
+    file_hash = store.put(data)
+    assert store.put(data) == file_hash and store.size(file_hash) == 256
+    store.incref([file_hash, file_hash]); store.decref([file_hash])
+    assert refcount(store, file_hash) == 1
+    store.decref([file_hash, file_hash])
+    assert refcount(store, file_hash) == 0
+
+def test_gc_removes_only_unreferenced_unpinned_blobs(store):
+    unreferenced, referenced, pinned = (store.put(os.urandom(128)) for _ in range(3))
+    store.incref([referenced]); store.pin([pinned])
+    time.sleep(0.01)
+    assert store.gc(grace_seconds=0) == 128
+    assert not os.path.exists(store.path(unreferenced))
+    assert os.path.exists(store.path(referenced)) and os.path.exists(store.path(pinned))
+
+def test_gc_keeps_recent_blobs_within_grace(store):
+    file_hash = store.put(os.urandom(128))
+    assert store.gc(grace_seconds=3600) == 0
+    assert os.path.exists(store.path(file_hash))
+
+def test_gc_pins_blobs_referenced_by_indexed_proofs(app_module, store):
+    file_hash = store.put(os.urandom(128))
+    report = {"report_id": str(uuid.uuid4()), "final_event_hash": uuid.uuid4().hex * 2, "applicant": "gc", "issued_at": "2024-01-01T00:00:00+00:00"}
+    app_module.evidence_index.add(report, [{"version_index": 1, "step_hash": uuid.uuid4().hex * 2, "file_hash": file_hash}], "proof.json")
+    time.sleep(0.01)
+    assert store.gc(grace_seconds=0) == 0
+    assert os.path.exists(store.path(file_hash))
+    assert store.usage()['pinned'][0] == 1
+
+def test_gc_keeps_files_missing_from_the_index(app_module, store):
+    file_hash = uuid.uuid4().hex * 2 # 索引遺失 (例如 DATA_DIR 重建) 後仍在磁碟上的原圖
+    orphan = store.path(file_hash)
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+    with open(orphan, 'wb') as f: f.write(b"\x89PNG")
+    legacy = os.path.join(app_module.static_folder, f"preview_v1_{uuid.uuid4().hex}.png")
+    with open(legacy, 'wb') as f: f.write(b"\x89PNG")
+    partial = os.path.join(store.root, f".{uuid.uuid4().hex}.tmp")
+    with open(partial, 'wb') as f: f.write(b"partial")
+    for path in (orphan, legacy, partial): age(path)
+    try:
+        assert store.gc(grace_seconds=3600) == len(b"partial")
+        assert os.path.exists(orphan) and os.path.exists(legacy) and not os.path.exists(partial)
+    finally:
+        os.remove(legacy)
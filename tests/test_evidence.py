@@ -0,0 +1,38 @@
+# /verify 的公開結果不可洩漏 report_id 與申請人；帶有管理權杖時才回傳完整內容
+import uuid
+import pytest
+
+@pytest.fixture
+def report(app_module):
+    report = {"report_id": str(uuid.uuid4()), "final_event_hash": uuid.uuid4().hex * 2, "applicant": "王小明", "issued_at": "2024-05-01T00:00:00+00:00"}
+    snapshots = [{"version_index": 1, "step_hash": uuid.uuid4().hex * 2, "file_hash": uuid.uuid4().hex * 2}]
+    app_module.evidence_index.add(report, snapshots, "proof.json")
+    return report, snapshots
+
+def test_public_verify_hides_report_id_and_applicant(app_module, report, monkeypatch):
+    monkeypatch.setattr(app_module, "EVIDENCE_ADMIN_TOKEN", "secret")
+    report, snapshots = report
+    client = app_module.app.test_client()
+    for value, match in ((report['final_event_hash'], "final_event_hash"), (snapshots[0]['file_hash'], "file_hash")):
+        for headers in ({}, {"Authorization": "Bearer wrong"}):
+            body = client.get('/verify', query_string={"hash": value}, headers=headers).get_json()
+            assert body['found'] and body['matches'] == [{"match": match, "final_event_hash": report['final_event_hash'], "issued_at": report['issued_at'], "snapshot_count": 1}]
+
+def test_admin_verify_includes_report_id_and_applicant(app_module, report, monkeypatch):
+    monkeypatch.setattr(app_module, "EVIDENCE_ADMIN_TOKEN", "secret")
+    report, snapshots = report
+    body = app_module.app.test_client().get('/verify', query_string={"hash": snapshots[0]['step_hash']}, headers={"Authorization": "Bearer secret"}).get_json()
+    assert body['matches'][0]['report_id'] == report['report_id'] and body['matches'][0]['applicant'] == "王小明"
+
+def test_verify_without_configured_token_is_public_only(app_module, report, monkeypatch):
+    monkeypatch.setattr(app_module, "EVIDENCE_ADMIN_TOKEN", None)
+    report, _ = report
+    body = app_module.app.test_client().get('/verify', query_string={"hash": report['final_event_hash']}, headers={"Authorization": "Bearer None"}).get_json()
+    assert "report_id" not in body['matches'][0]
+
+def test_reports_listing_requires_token(app_module, report, monkeypatch):
+    monkeypatch.setattr(app_module, "EVIDENCE_ADMIN_TOKEN", "secret")
+    client = app_module.app.test_client()
+    assert client.get('/reports').status_code == 403
+    assert client.get('/reports', headers={"Authorization": "Bearer 密碼"}).status_code == 403
+    assert client.get('/reports', headers={"Authorization": "Bearer secret"}).status_code == 200
@@ -0,0 +1,94 @@
+# 證據鏈：雜湊鏈與 Merkle 樹根的增量計算、包含證明 (app.py 與獨立實作的 verify_proof.py 互相驗證)、
+# 相容 / merkle 兩種 final_event_hash，以及已結束任務於會話重置後仍可取得包含證明
+import hashlib, json, os
+import pytest
+import verify_proof
+
+def step_hashes(n): return [hashlib.sha256(f"step {i}".encode()).hexdigest() for i in range(n)]
+
+def build_chain(app_module, hashes):
+    chain = app_module.new_evidence_chain()
+    for step_hash in hashes: app_module.extend_evidence_chain(chain, step_hash)
+    return chain
+
+def test_chain_hash_and_small_merkle_roots(app_module):
+    a, b, c = step_hashes(3)
+    chain = build_chain(app_module, [a, b, c])
+    expected = app_module.CHAIN_GENESIS
+    for step_hash in (a, b, c): expected = hashlib.sha256((expected + step_hash).encode()).hexdigest()
+    assert chain['chain_hash'] == expected and chain['count'] == 3
+    leaf = app_module.merkle_leaf; node = app_module.merkle_node
+    assert app_module.merkle_root_from_peaks(build_chain(app_module, [a])['merkle_peaks']) == leaf(a).hex()
+    assert app_module.merkle_root_from_peaks(build_chain(app_module, [a, b])['merkle_peaks']) == node(leaf(a), leaf(b)).hex()
+    assert app_module.merkle_root_from_peaks(chain['merkle_peaks']) == node(node(leaf(a), leaf(b)), leaf(c)).hex()
+    assert app_module.merkle_root_from_peaks([]) == hashlib.sha256(b"").hexdigest()
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 13, 39])
+def test_incremental_root_matches_tree_and_verifier(app_module, size):
+    hashes = step_hashes(size)
+    root = app_module.merkle_root_from_peaks(build_chain(app_module, hashes)['merkle_peaks'])
+    assert root == app_module._merkle_tree_hash([app_module.merkle_leaf(h) for h in hashes]).hex()
+    state = verify_proof.ChainState()
+    for step_hash in hashes: state.extend(step_hash)
+    assert state.merkle_root() == root and state.chain_hash == build_chain(app_module, hashes)['chain_hash']
+    for index in range(size):
+        audit_path = app_module.merkle_inclusion_proof(hashes, index)
+        assert app_module.verify_merkle_inclusion(hashes[index], index, size, audit_path, root)
+        inclusion = {"version_index": index + 1, "step_hash": hashes[index], "tree_size": size, "merkle_root": root, "audit_path": audit_path}
+        assert verify_proof.verify_inclusion(inclusion) == []
+
+def test_tampered_inclusion_proofs_are_rejected(app_module):
+    hashes = step_hashes(6)
+    root = app_module.merkle_root_from_peaks(build_chain(app_module, hashes)['merkle_peaks'])
+    audit_path = app_module.merkle_inclusion_proof(hashes, 2)
+    assert not app_module.verify_merkle_inclusion(hashes[3], 2, 6, audit_path, root) # 其他版本的 step_hash
+    assert not app_module.verify_merkle_inclusion(hashes[2], 3, 6, audit_path, root) # 錯誤的位置
+    assert not app_module.verify_merkle_inclusion(hashes[2], 2, 6, audit_path[:-1], root)
+    assert not app_module.verify_merkle_inclusion(hashes[2], 6, 6, audit_path, root)
+    inclusion = {"version_index": 3, "step_hash": hashes[2], "tree_size": 6, "merkle_root": root, "audit_path": audit_path}
+    assert verify_proof.verify_inclusion(dict(inclusion, step_hash=hashes[3]))
+    assert verify_proof.verify_inclusion(dict(inclusion, audit_path=audit_path + [root])) == ["audit_path 過長"]
+    assert verify_proof.verify_inclusion(dict(inclusion, final_hash_mode="merkle", final_event_hash=hashes[0])) == ["final_event_hash 與 merkle_root 不一致"]
+
+def test_legacy_final_event_hash(app_module):
+    hashes = step_hashes(4)
+    assert app_module.legacy_final_event_hash(hashes) == hashlib.sha256(json.dumps(hashes).encode()).hexdigest()
+
+def finalize(app_module, client, versions):
+    client.get('/')
+    sid = client.get_cookie(app_module.SESSION_COOKIE).value
+    for k in range(versions):
+        file_hash = app_module.blob_store.put(os.urandom(512))
+        app_module.commit_generation(sid, {"prompt": f"chain {k}", "size": "1024x1024", "revised_prompt": f"chain {k} revised", "file_hash": file_hash})
+    assert client.post('/finalize_session', json={"applicant_name": "chain"}).status_code == 200
+    return app_module.session_store.get(sid)['proof']
+
+@pytest.mark.parametrize("mode", ["compat", "merkle"])
+def test_finalized_proof_verifies_in_both_hash_modes(app_module, mode, monkeypatch):
+    monkeypatch.setattr(app_module, "FINAL_HASH_MODE", mode)
+    monkeypatch.setattr(app_module.renditions, "schedule", lambda file_hash: None)
+    proof_ref = finalize(app_module, app_module.app.test_client(), 5)
+    with open(proof_ref['json_filepath'], encoding='utf-8') as f: event_proof = json.load(f)['event_proof']
+    expected = event_proof['chain']['merkle_root'] if mode == "merkle" else event_proof['chain']['legacy_final_event_hash']
+    assert event_proof['final_hash_mode'] == mode and event_proof['final_event_hash'] == expected == proof_ref['final_event_hash']
+    result = verify_proof.verify_proof_file(proof_ref['json_filepath'], app_module.static_folder)
+    assert result['ok'], result['errors']
+
+def test_inclusion_proof_survives_session_reset(app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "FINAL_HASH_MODE", "merkle")
+    monkeypatch.setattr(app_module.renditions, "schedule", lambda file_hash: None)
+    client = app_module.app.test_client()
+    proof_ref = finalize(app_module, client, 4)
+    live = client.get('/proof/inclusion/3').get_json()
+    client.get('/') # 重置會話
+    assert client.get('/proof/inclusion/3').status_code == 404
+    for ref in (proof_ref['report_id'], proof_ref['final_event_hash']):
+        inclusion = client.get(f"/proof/{ref}/inclusion/3").get_json()
+        assert {k: inclusion[k] for k in live} == live and inclusion['final_event_hash'] == inclusion['merkle_root']
+        assert verify_proof.verify_inclusion(inclusion) == []
+    assert client.get(f"/proof/{proof_ref['report_id']}/inclusion/5").status_code == 404
+    assert client.get(f"/proof/{'0' * 64}/inclusion/1").status_code == 404
+    path = tmp_path / "inclusion.json"; path.write_text(json.dumps(inclusion))
+    assert verify_proof.main(["--inclusion", str(path)]) == 0
+    path.write_text(json.dumps(dict(inclusion, version_index=2)))
+    assert verify_proof.main(["--inclusion", str(path)]) == 1
@@ -0,0 +1,66 @@
+# 生成結果快取：命中/未命中計數、重播快照 (replay_of，時間戳與 Step Hash 重新產生)、TTL 與筆數上限淘汰，以及淘汰時釋放 Blob 參照
+import os, time, uuid
+import pytest
+
+@pytest.fixture
+def cache(app_module, tmp_path, monkeypatch):
+    def create(**kwargs):
+        cache = app_module.GenerationCache(path=str(tmp_path / f"cache_{uuid.uuid4().hex}.sqlite3"), **kwargs)
+        monkeypatch.setattr(app_module, "generation_cache", cache)
+        return cache
+    return create
+
+def counter(app_module, name, **labels): return app_module.metrics.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+def refcount(app_module, file_hash): return app_module.blob_store._conn().execute("SELECT refcount FROM blobs WHERE hash = ?", (file_hash,)).fetchone()[0]
+
+def test_replay_reuses_the_image_with_fresh_evidence(app_module, cache, fake_api, monkeypatch):
+    server, api_base = fake_api()
+    monkeypatch.setattr(app_module, "OPENAI_API_BASE", api_base)
+    cache(ttl=3600, max_entries=10)
+    prompt = f"cache {uuid.uuid4().hex}"; sid = uuid.uuid4().hex
+    hits, misses = counter(app_module, "generation_cache_total", result="hit"), counter(app_module, "generation_cache_total", result="miss")
+    first = app_module.run_generation(sid, prompt, "1024x1024")
+    second = app_module.run_generation(sid, prompt, "1024x1024")
+    assert counter(app_module, "generation_cache_total", result="miss") == misses + 1
+    assert counter(app_module, "generation_cache_total", result="hit") == hits + 1
+    assert server.RequestHandlerClass.counters['api_200'] == 1 # 命中時不呼叫 API
+    original, replay = app_module.session_store.get(sid)['previews']
+    assert first['file_hash'] == second['file_hash'] == replay['replay_of'] and 'replay_of' not in original
+    assert replay['timestamp_utc'] != original['timestamp_utc']
+    assert replay['hashes']['step_hash'] != original['hashes']['step_hash'] and replay['hashes']['file_hash'] == original['hashes']['file_hash']
+
+def test_expired_entries_miss_and_are_evicted(app_module, cache):
+    generation_cache = cache(ttl=0.05, max_entries=10)
+    file_hash = app_module.blob_store.put(os.urandom(64))
+    generation_cache.put("expired", file_hash, "revised")
+    assert generation_cache.get("expired")['file_hash'] == file_hash and refcount(app_module, file_hash) == 1
+    time.sleep(0.1)
+    assert generation_cache.get("expired") is None
+    generation_cache.put("fresh", app_module.blob_store.put(os.urandom(64)), "revised")
+    assert refcount(app_module, file_hash) == 0
+
+def test_least_recently_used_entries_are_evicted_over_the_limit(app_module, cache):
+    generation_cache = cache(ttl=3600, max_entries=2)
+    hashes = [app_module.blob_store.put(os.urandom(64)) for _ in range(3)]
+    evictions = counter(app_module, "generation_cache_evictions_total")
+    generation_cache.put("a", hashes[0], "a"); generation_cache.put("b", hashes[1], "b")
+    generation_cache.get("a") # a 較 b 新近使用
+    generation_cache.put("c", hashes[2], "c")
+    assert generation_cache.get("b") is None and generation_cache.get("a") and generation_cache.get("c")
+    assert [refcount(app_module, h) for h in hashes] == [1, 0, 1]
+    assert counter(app_module, "generation_cache_evictions_total") == evictions + 1
+
+def test_replacing_an_entry_releases_the_previous_blob(app_module, cache):
+    generation_cache = cache(ttl=3600, max_entries=10)
+    old, new = (app_module.blob_store.put(os.urandom(64)) for _ in range(2))
+    generation_cache.put("key", old, "old"); generation_cache.put("key", new, "new")
+    assert refcount(app_module, old) == 0 and refcount(app_module, new) == 1
+    assert generation_cache.get("key") == {"file_hash": new, "revised_prompt": "new"}
+
+def test_missing_blob_is_a_miss(app_module, cache):
+    generation_cache = cache(ttl=3600, max_entries=10)
+    file_hash = app_module.blob_store.put(os.urandom(64))
+    generation_cache.put("gone", file_hash, "revised")
+    os.remove(app_module.blob_store.path(file_hash))
+    assert generation_cache.get("gone") is None
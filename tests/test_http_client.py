@@ -0,0 +1,90 @@
+# HttpClient 對模擬 API 的重試、Retry-After、退避、斷路器與連線中斷行為
+import time
+import pytest
+import requests
+from harness import free_port
+
+def make_client(app_module, **kwargs):
+    options = dict(max_retries=3, backoff_base=0.01, backoff_max=5, breaker_threshold=100, breaker_cooldown=60)
+    options.update(kwargs)
+    return app_module.HttpClient(**options)
+
+def image_url(api_base): return api_base.replace("/v1", "/images/test_16x16.png")
+
+def generate(client, api_base):
+    return client.post(f"{api_base}/images/generations", phase="api", timeout=(1, 5), json={"prompt": "test", "size": "16x16"})
+
+def counters(server): return server.RequestHandlerClass.counters
+
+def test_get_retries_server_errors(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "2", "--error-statuses", "503,500")
+    response = make_client(app_module).get(image_url(api_base), phase="cdn", timeout=(1, 5))
+    assert response.status_code == 200
+    assert (counters(server)["cdn_503"], counters(server)["cdn_500"], counters(server)["cdn_200"]) == (1, 1, 1)
+
+def test_get_returns_last_response_after_max_retries(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "10", "--error-statuses", "503")
+    response = make_client(app_module, max_retries=2).get(image_url(api_base), phase="cdn", timeout=(1, 5))
+    assert response.status_code == 503 and counters(server)["cdn_503"] == 3
+
+def test_retry_after_is_honored(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "1", "--error-statuses", "429", "--retry-after", "0.3")
+    start = time.monotonic()
+    response = generate(make_client(app_module), api_base)
+    assert response.status_code == 200 and time.monotonic() - start >= 0.3
+    assert counters(server)["api_429"] == 1
+
+def test_backoff_is_capped_exponential_with_jitter(app_module):
+    client = make_client(app_module, backoff_base=0.5, backoff_max=3)
+    for attempt in range(6):
+        assert all(0 <= client._backoff(attempt) <= min(3, 0.5 * 2 ** attempt) for _ in range(200))
+    assert client._backoff(0, retry_after="2") == 2 and client._backoff(0, retry_after="120") == 3
+
+def test_post_is_not_retried_on_server_error(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "1", "--error-statuses", "500")
+    assert generate(make_client(app_module), api_base).status_code == 500
+    assert counters(server)["api_500"] == 1 and "api_200" not in counters(server)
+
+def test_post_is_not_retried_after_connection_reset(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "1", "--error-statuses", "drop")
+    with pytest.raises(requests.exceptions.ConnectionError): generate(make_client(app_module), api_base)
+    assert counters(server)["api_drop"] == 1 and "api_200" not in counters(server)
+
+def test_get_is_retried_after_connection_reset(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "2", "--error-statuses", "drop")
+    assert make_client(app_module).get(image_url(api_base), phase="cdn", timeout=(1, 5)).status_code == 200
+    assert counters(server)["cdn_drop"] == 2 and counters(server)["cdn_200"] == 1
+
+def test_post_is_retried_when_connection_refused(app_module):
+    client = make_client(app_module, max_retries=2); attempts = []
+    original_request = client.session.request
+    client.session.request = lambda *args, **kwargs: (attempts.append(1), original_request(*args, **kwargs))[1]
+    with pytest.raises(requests.exceptions.ConnectionError): generate(client, f"http://127.0.0.1:{free_port()}/v1")
+    assert len(attempts) == 3
+
+def test_breaker_opens_after_consecutive_failures_and_recovers(app_module, fake_api):
+    server, api_base = fake_api("--fail-first", "2", "--error-statuses", "503")
+    client = make_client(app_module, max_retries=0, breaker_threshold=2, breaker_cooldown=0.3)
+    url = image_url(api_base)
+    assert [client.get(url, phase="cdn", timeout=(1, 5)).status_code for _ in range(2)] == [503, 503]
+    with pytest.raises(app_module.CircuitOpenError): client.get(url, phase="cdn", timeout=(1, 5))
+    assert counters(server)["cdn_requests"] == 2 # 斷路器開啟時不送出請求
+    time.sleep(0.35)
+    assert client.get(url, phase="cdn", timeout=(1, 5)).status_code == 200
+
+def test_streamed_body_holds_the_host_slot_until_closed(app_module, fake_api):
+    _, api_base = fake_api()
+    client = make_client(app_module, per_host_limit=1)
+    slot = client._slot(api_base.split("/")[2])
+    with client.get(image_url(api_base), phase="cdn", timeout=(1, 5), stream=True) as response:
+        assert not slot.acquire(blocking=False) # 串流本體尚未讀取完畢，名額仍被佔用
+        assert response.raw.read(8) == b"\x89PNG\r\n\x1a\n"
+    assert slot.acquire(blocking=False); slot.release()
+    client.get(image_url(api_base), phase="cdn", timeout=(1, 5)).close()
+    assert slot.acquire(blocking=False); slot.release()
+
+def test_failed_requests_release_the_host_slot(app_module):
+    client = make_client(app_module, per_host_limit=1, max_retries=1)
+    host = f"127.0.0.1:{free_port()}"
+    with pytest.raises(requests.exceptions.ConnectionError): client.get(f"http://{host}/", phase="cdn", timeout=(1, 1), stream=True)
+    assert client._slot(host).acquire(blocking=False)
@@ -0,0 +1,60 @@
+# 背景工作佇列：各使用者輪流執行、每位使用者的同時執行上限，以及排隊數超過上限時 /generate 回傳 429
+import threading, time
+import pytest
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline: raise AssertionError("等待逾時")
+        time.sleep(0.005)
+
+def test_users_are_served_round_robin(app_module):
+    queue = app_module.JobQueue(workers=1, max_active_per_user=1, max_pending_per_user=10)
+    started, gate, order = threading.Event(), threading.Event(), []
+    queue.submit("gate", lambda: (started.set(), gate.wait(5)))
+    started.wait(5) # 唯一的執行緒被佔用，其後的工作全部排隊
+    for sid, count in (("a", 3), ("b", 2)):
+        for _ in range(count): queue.submit(sid, lambda sid=sid: order.append(sid))
+    gate.set()
+    wait_for(lambda: len(order) == 5)
+    assert order == ["a", "b", "a", "b", "a"]
+
+def test_active_jobs_per_user_are_capped(app_module):
+    queue = app_module.JobQueue(workers=4, max_active_per_user=2, max_pending_per_user=10)
+    gate, lock, running, peak = threading.Event(), threading.Lock(), {}, {}
+    def job(sid):
+        with lock: running[sid] = running.get(sid, 0) + 1; peak[sid] = max(peak.get(sid, 0), running[sid])
+        gate.wait(5)
+        with lock: running[sid] -= 1
+    for _ in range(4): queue.submit("a", lambda: job("a"))
+    wait_for(lambda: running.get("a") == 2)
+    queue.submit("b", lambda: job("b")) # 尚有閒置執行緒，其他使用者不必等待 a 的排隊工作
+    wait_for(lambda: running.get("b") == 1)
+    assert queue.stats() == {"pending": 2, "active": 3}
+    gate.set()
+    wait_for(lambda: queue.stats() == {"pending": 0, "active": 0})
+    assert peak == {"a": 2, "b": 1}
+
+def test_pending_limit_counts_active_jobs(app_module):
+    queue = app_module.JobQueue(workers=1, max_active_per_user=1, max_pending_per_user=2)
+    gate = threading.Event()
+    queue.submit("a", gate.wait); queue.submit("a", gate.wait)
+    with pytest.raises(app_module.JobQueueFullError): queue.submit("a", gate.wait)
+    queue.submit("b", gate.wait) # 上限以使用者為單位
+    gate.set()
+    wait_for(lambda: queue.stats() == {"pending": 0, "active": 0})
+    queue.submit("a", gate.wait)
+
+def test_generate_returns_429_when_the_user_queue_is_full(app_module, monkeypatch):
+    gate = threading.Event()
+    monkeypatch.setattr(app_module, "job_queue", app_module.JobQueue(workers=1, max_active_per_user=1, max_pending_per_user=2))
+    monkeypatch.setattr(app_module, "run_generation", lambda sid, prompt, size: gate.wait(5) and {})
+    client = app_module.app.test_client()
+    try:
+        statuses = [client.post('/generate', json={"prompt": f"queue {k}", "size": "1024x1024"}).status_code for k in range(3)]
+        assert statuses == [202, 202, 429]
+        assert "最多 2 個" in client.post('/generate', json={"prompt": "queue", "size": "1024x1024"}).get_json()['error']
+        other = app_module.app.test_client()
+        assert other.post('/generate', json={"prompt": "other", "size": "1024x1024"}).status_code == 202
+    finally:
+        gate.set()
@@ -0,0 +1,35 @@
+# /metrics 合併所有 worker 的指標：任一 worker 回應的計數與直方圖皆為全體的總和
+import json, os, time
+import pytest
+
+@pytest.fixture
+def workers(app_module, tmp_path):
+    return [app_module.Metrics(directory=str(tmp_path), flush_interval=3600) for _ in range(2)]
+
+def test_counters_and_histograms_are_merged_across_workers(workers):
+    first, second = workers
+    first.inc("generation_errors_total", reason="network")
+    second.inc("generation_errors_total", 2, reason="network"); second.observe("job_queue_wait_seconds", 0.2)
+    second.flush()
+    text = first.exposition()
+    assert 'wesmart_generation_errors_total{reason="network"} 3' in text
+    assert 'wesmart_job_queue_wait_seconds_bucket{le="0.25"} 1' in text and "wesmart_job_queue_wait_seconds_count 1" in text
+    assert first.snapshot()['counters']['generation_errors_total{reason="network"}'] == 3
+
+def test_per_worker_gauges_are_summed_and_stale_workers_ignored(workers, tmp_path):
+    first, second = workers
+    for index, worker in enumerate(workers): worker.gauge("jobs", lambda index=index: {(("state", "pending"),): index + 1}, merge="sum")
+    second.inc("jobs_total"); second.flush()
+    assert 'wesmart_jobs{state="pending"} 3' in first.exposition()
+    with open(second.path, encoding='utf-8') as f: data = json.load(f)
+    data['updated_at'] = time.time() - 3 * 3600 - 1 # 已結束的 worker
+    with open(second.path, 'w', encoding='utf-8') as f: json.dump(data, f)
+    text = first.exposition()
+    assert 'wesmart_jobs{state="pending"} 1' in text and "wesmart_jobs_total 1" in text
+
+def test_forked_worker_starts_from_zero_in_its_own_file(workers, monkeypatch):
+    first, _ = workers
+    first.inc("requests_total"); path = first.path
+    monkeypatch.setattr(os, "getpid", lambda: 999999)
+    first.inc("requests_total")
+    assert first.path != path and first.counters[("requests_total", ())] == 1
@@ -0,0 +1,29 @@
+# X-Profile 剖析：同時只剖析一個請求，其餘請求照常處理 (不因 cProfile 衝突而失敗)
+import cProfile
+import pytest
+
+@pytest.fixture
+def profiled(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(app_module, "PROFILE_DIR", str(tmp_path))
+    return app_module.app.test_client()
+
+def test_profiled_request_dumps_stats_and_releases_lock(app_module, profiled, tmp_path):
+    response = profiled.get('/', headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    assert (tmp_path / response.headers['X-Profile-Dump']).exists()
+    assert not app_module.profile_lock.locked()
+
+def test_concurrent_profile_request_is_skipped(app_module, profiled):
+    with app_module.profile_lock:
+        response = profiled.get('/', headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    assert response.headers['X-Profile-Skipped'] == "busy" and 'X-Profile-Dump' not in response.headers
+
+def test_active_profiler_is_skipped(app_module, profiled, monkeypatch):
+    class ActiveProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs): raise ValueError("Another profiling tool is already active")
+    monkeypatch.setattr(app_module.cProfile, "Profile", ActiveProfile)
+    response = profiled.get('/', headers={"X-Profile": "secret"})
+    assert response.status_code == 200 and response.headers['X-Profile-Skipped'] == "active"
+    assert not app_module.profile_lock.locked()
@@ -0,0 +1,71 @@
+# 背景報告渲染：行程池中的子行程異常結束後不可永久失效，提交失敗時進度檔不可停在 queued
+import concurrent.futures, os, time, uuid
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fpdf import FPDF
+
+def wait_for_progress(app_module, progress_path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        progress = app_module.read_report_progress(progress_path)
+        if progress and progress['status'] in ("done", "error"): return progress
+        time.sleep(0.05)
+    raise AssertionError(f"報告進度逾時: {progress_path}")
+
+def test_broken_pool_is_replaced_on_next_submit(app_module):
+    broken = app_module.get_report_executor()
+    with pytest.raises(BrokenProcessPool): broken.submit(os._exit, 1).result(timeout=60) # 模擬渲染子行程被終止
+    final_event_hash, report_id = uuid.uuid4().hex * 2, str(uuid.uuid4())
+    assert app_module.submit_report("missing_proof.json", final_event_hash, report_id) == "queued"
+    assert app_module.get_report_executor() is not broken
+    progress = wait_for_progress(app_module, app_module.report_paths(final_event_hash, report_id)[1])
+    assert progress['status'] == "error" and "missing_proof.json" in progress['error'] # 由新的子行程執行並回報
+
+def test_dead_child_marks_report_as_error(app_module):
+    final_event_hash, report_id = uuid.uuid4().hex * 2, str(uuid.uuid4())
+    _, progress_path = app_module.report_paths(final_event_hash, report_id)
+    os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+    app_module.write_report_progress(progress_path, status="rendering", done=1, total=3)
+    executor = app_module.get_report_executor()
+    future = concurrent.futures.Future(); future.set_exception(BrokenProcessPool("child died"))
+    app_module.record_report_render(future, executor, progress_path)
+    assert app_module.read_report_progress(progress_path)['status'] == "error"
+    assert app_module.get_report_executor() is not executor
+
+def test_failed_submit_writes_error_status(app_module, monkeypatch):
+    class FailingExecutor:
+        def submit(self, *args): raise RuntimeError("cannot start worker")
+    monkeypatch.setattr(app_module, "get_report_executor", FailingExecutor)
+    final_event_hash, report_id = uuid.uuid4().hex * 2, str(uuid.uuid4())
+    with pytest.raises(RuntimeError): app_module.submit_report("proof.json", final_event_hash, report_id)
+    progress = app_module.read_report_progress(app_module.report_paths(final_event_hash, report_id)[1])
+    assert progress['status'] == "error" and "cannot start worker" in progress['error']
+
+# 最小的 TrueType 字型 (A 與空白)，代替需下載的 NotoSansTC
+def build_font(path):
+    names = [".notdef", "space", "A"]
+    pen = TTGlyphPen(None); pen.moveTo((0, 0)); pen.lineTo((500, 0)); pen.lineTo((250, 700)); pen.closePath(); triangle = pen.glyph()
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names); builder.setupCharacterMap({32: "space", 65: "A"})
+    builder.setupGlyf({".notdef": triangle, "space": TTGlyphPen(None).glyph(), "A": triangle})
+    builder.setupHorizontalMetrics({name: (600, 0) for name in names}); builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "Test", "styleName": "Regular"}); builder.setupOS2(); builder.setupPost()
+    builder.save(str(path))
+
+def test_reports_do_not_share_font_descriptor(app_module, tmp_path):
+    build_font(tmp_path / "font.ttf")
+    assets = app_module.PdfAssets(font_path=str(tmp_path / "font.ttf"), logo_path=str(tmp_path / "missing.jpg"))
+    pdfs = [FPDF(), FPDF()]
+    for pdf in pdfs:
+        assets.add_font(pdf, "NotoSansTC"); pdf.add_page(); pdf.set_font("NotoSansTC", size=12); pdf.cell(0, 10, "A A")
+    first = bytes(pdfs[0].output())
+    template = assets.font_templates["notosanstc"]
+    assert pdfs[1].fonts["notosanstc"].desc is not template.desc
+    assert getattr(template.desc, "font_file2", None) is None # 第一份報告的輸出不可寫回共用的範本
+    assert bytes(pdfs[1].output())[:4] == first[:4] == b"%PDF"
+
+def test_importing_app_does_not_fetch_pdf_assets(app_module):
+    assert not app_module.pdf_assets.prefetch_started and app_module.pdf_assets.font_bytes is None
+    assert app_module.get_report_executor()._initializer is app_module.warm_pdf_assets
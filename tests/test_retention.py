@@ -0,0 +1,88 @@
+# 證據正本存放於 DATA_DIR (不可經由 static/ 下載)；預覽配額只計算會話持有的預覽圖，生成結果快取與證據正本引用的圖檔不觸發淘汰
+import json, os, time, uuid
+import pytest
+
+@pytest.fixture(params=["memory", "sqlite"])
+def session_store(request, app_module, tmp_path, monkeypatch):
+    if request.param == "sqlite": store = app_module.SQLiteSessionStore(path=str(tmp_path / "sessions.sqlite3"), on_release=app_module.release_session_blobs)
+    else: store = app_module.MemorySessionStore(on_release=app_module.release_session_blobs)
+    monkeypatch.setattr(app_module, "session_store", store)
+    return store
+
+def add_preview(app_module, sid, data):
+    file_hash = app_module.blob_store.put(data)
+    fetched = {"prompt": f"retention {sid}", "size": "1024x1024", "revised_prompt": "revised", "file_hash": file_hash}
+    app_module.commit_generation(sid, fetched)
+    return file_hash
+
+def test_cache_only_blobs_do_not_evict_sessions(app_module, session_store, monkeypatch):
+    cached = app_module.blob_store.put(os.urandom(64 * 1024))
+    app_module.blob_store.incref([cached]) # 僅由生成結果快取持有
+    sid = uuid.uuid4().hex
+    add_preview(app_module, sid, os.urandom(1024))
+    monkeypatch.setattr(app_module, "PREVIEW_MAX_BYTES", 16 * 1024)
+    app_module.retention_sweeper.sweep()
+    assert session_store.count() == 1
+    assert session_store.usage()['preview_bytes'] == 1024
+
+def test_sessions_over_preview_quota_are_evicted_oldest_first(app_module, session_store, monkeypatch):
+    sids = [uuid.uuid4().hex for _ in range(3)]
+    for sid in sids: add_preview(app_module, sid, os.urandom(8 * 1024))
+    monkeypatch.setattr(app_module, "PREVIEW_MAX_BYTES", 20 * 1024)
+    app_module.retention_sweeper.sweep()
+    assert [sid for sid in sids if session_store.get(sid)['previews']] == sids[1:]
+
+def test_finalized_session_does_not_count_toward_quota(app_module, session_store, fake_api, monkeypatch):
+    _, api_base = fake_api()
+    monkeypatch.setattr(app_module, "OPENAI_API_BASE", api_base)
+    client = app_module.app.test_client()
+    client.get('/')
+    sid = client.get_cookie(app_module.SESSION_COOKIE).value
+    add_preview(app_module, sid, os.urandom(1024))
+    assert client.post('/finalize_session', json={"applicant_name": "retention"}).status_code == 200
+    proof = session_store.get(sid)['proof']
+    assert os.path.abspath(proof['json_filepath']).startswith(os.path.abspath(app_module.PROOF_DIR) + os.sep)
+    assert not os.path.abspath(proof['json_filepath']).startswith(os.path.abspath(app_module.static_folder) + os.sep)
+    assert session_store.usage()['preview_bytes'] == 0
+
+def test_quota_never_evicts_finalized_sessions(app_module, session_store, monkeypatch):
+    client = app_module.app.test_client()
+    client.get('/')
+    finalized = client.get_cookie(app_module.SESSION_COOKIE).value
+    add_preview(app_module, finalized, os.urandom(1024))
+    assert client.post('/finalize_session', json={"applicant_name": "retention"}).status_code == 200
+    live = uuid.uuid4().hex
+    add_preview(app_module, live, os.urandom(8 * 1024))
+    monkeypatch.setattr(app_module, "PREVIEW_MAX_BYTES", 4 * 1024)
+    app_module.retention_sweeper.sweep()
+    assert session_store.get(finalized)['proof'] is not None
+    assert session_store.get(live)['previews'] == []
+
+def test_migration_moves_legacy_proofs_and_pins_blobs(app_module):
+    file_hash = app_module.blob_store.put(os.urandom(1024))
+    report_id = str(uuid.uuid4())
+    snapshot = {"version_index": 1, "hashes": {"step_hash": uuid.uuid4().hex * 2, "file_hash": file_hash}}
+    legacy = os.path.join(app_module.static_folder, "proofs", report_id[:2], f"proof_event_{report_id}.json")
+    os.makedirs(os.path.dirname(legacy), exist_ok=True)
+    with open(legacy, 'w', encoding='utf-8') as f:
+        json.dump({"report_id": report_id, "applicant": "舊版", "issued_at": "2024-01-01T00:00:00+00:00",
+                   "event_proof": {"final_event_hash": uuid.uuid4().hex * 2, "snapshots": [snapshot]}}, f)
+    app_module.blob_store._conn().execute("PRAGMA user_version = 0")
+    app_module.migrate_evidence()
+    assert not os.path.exists(legacy) and os.path.exists(app_module.proof_path(report_id))
+    assert app_module.blob_store._conn().execute("SELECT pinned FROM blobs WHERE hash = ?", (file_hash,)).fetchone()[0] == 1
+    assert app_module.evidence_index.lookup(file_hash)[0]['report_id'] == report_id
+
+def test_legacy_flat_reports_and_qr_codes_are_swept(app_module, monkeypatch):
+    old, fresh = time.time() - 2 * app_module.REPORT_TTL, time.time()
+    paths = {}
+    for name, mtime in (("WesmartAI_Report_old.pdf", old), ("qr_old.png", old), ("WesmartAI_Report_new.pdf", fresh), ("qr_new.png", fresh)):
+        paths[name] = os.path.join(app_module.static_folder, name)
+        with open(paths[name], 'wb') as f: f.write(os.urandom(1024))
+        os.utime(paths[name], (mtime, mtime))
+    app_module.retention_sweeper.sweep()
+    assert sorted(name for name, path in paths.items() if os.path.exists(path)) == ["WesmartAI_Report_new.pdf", "qr_new.png"]
+    assert app_module.retention_sweeper.last_usage['reports'] >= 2048
+    monkeypatch.setattr(app_module, "REPORT_MAX_BYTES", 0) # 超過配額時連同未過期的舊版檔案一併刪除
+    app_module.retention_sweeper.sweep()
+    assert not any(os.path.exists(path) for path in paths.values())
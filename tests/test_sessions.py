@@ -0,0 +1,69 @@
+# 多位模擬使用者同時生成與結束任務 (對模擬 Images API)，兩種會話儲存後端的狀態皆不可互相混用
+import threading, time
+import pytest
+
+USERS = 12
+GENERATIONS = 3
+
+@pytest.fixture(params=["memory", "sqlite"])
+def session_store(request, app_module, tmp_path, monkeypatch):
+    if request.param == "sqlite": store = app_module.SQLiteSessionStore(path=str(tmp_path / "sessions.sqlite3"), on_release=app_module.release_session_blobs)
+    else: store = app_module.MemorySessionStore(on_release=app_module.release_session_blobs)
+    monkeypatch.setattr(app_module, "session_store", store)
+    return store
+
+def wait_for_job(client, status_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ("done", "error"): return job
+        time.sleep(0.01)
+    raise AssertionError(f"工作逾時: {status_url}")
+
+def run_user(app_module, user, results):
+    client = app_module.app.test_client()
+    client.get('/')
+    for k in range(GENERATIONS):
+        response = client.post('/generate', json={"prompt": f"user {user} version {k + 1}", "size": "1024x1024"})
+        assert response.status_code == 202, response.get_json()
+        job = wait_for_job(client, response.get_json()['status_url'])
+        assert job['status'] == "done", job
+    response = client.post('/finalize_session', json={"applicant_name": f"user-{user}"})
+    assert response.status_code == 200, response.get_json()
+    results[user] = (client.get_cookie(app_module.SESSION_COOKIE).value, response.get_json())
+
+def test_concurrent_users_keep_separate_sessions(app_module, session_store, fake_api, monkeypatch):
+    server, api_base = fake_api("--latency", "0.02", "--image-size", "64x64")
+    monkeypatch.setattr(app_module, "OPENAI_API_BASE", api_base)
+    results, errors = {}, []
+    def user(i):
+        try: run_user(app_module, i, results)
+        except BaseException as e: errors.append(e)
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(USERS)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert not errors, errors
+
+    assert len({sid for sid, _ in results.values()}) == USERS
+    assert server.RequestHandlerClass.counters.get("api_200") == USERS * GENERATIONS
+    for user, (sid, finalized) in results.items():
+        assert len(finalized['image_urls']) == GENERATIONS
+        state = session_store.get(sid)
+        assert [p['version_index'] for p in state['previews']] == list(range(1, GENERATIONS + 1))
+        assert [p['prompt'] for p in state['previews']] == [f"user {user} version {k + 1}" for k in range(GENERATIONS)]
+        assert state['chain']['count'] == GENERATIONS and state['chain']['chain_hash'] == state['previews'][-1]['chain_hash']
+        assert state['proof'] is not None
+        assert app_module.evidence_index.lookup(state['proof']['final_event_hash'])
+
+def test_index_resets_only_own_session(app_module, session_store, fake_api, monkeypatch):
+    _, api_base = fake_api("--image-size", "64x64")
+    monkeypatch.setattr(app_module, "OPENAI_API_BASE", api_base)
+    clients = [app_module.app.test_client() for _ in range(2)]
+    for i, client in enumerate(clients):
+        client.get('/')
+        response = client.post('/generate', json={"prompt": f"reset {i}", "size": "1024x1024"})
+        assert wait_for_job(client, response.get_json()['status_url'])['status'] == "done"
+    clients[0].get('/')
+    sids = [client.get_cookie(app_module.SESSION_COOKIE).value for client in clients]
+    assert session_store.get(sids[0])['previews'] == []
+    assert [p['prompt'] for p in session_store.get(sids[1])['previews']] == ["reset 1"]
@@ -0,0 +1,24 @@
+# verify_proof.py 的串流解析 (ijson) 與整檔解析結果一致
+import io, json
+import pytest
+import verify_proof
+
+PROOF = {
+    "report_id": "r-1", "applicant": "串流", "issued_at": "2024-01-01T00:00:00+00:00",
+    "event_proof": {"final_event_hash": "f" * 64, "final_hash_mode": "merkle", "chain": {"leaf_count": 2, "merkle_root": "a" * 64},
+                    "snapshots": [{"version_index": i, "size": "1024x1024", "hashes": {"step_hash": f"{i}" * 64}} for i in (1, 2)]}
+}
+
+def parse(monkeypatch, streaming):
+    if not streaming: monkeypatch.setattr(verify_proof, "ijson", None)
+    meta = {}
+    snapshots = list(verify_proof.iter_snapshots(io.BytesIO(json.dumps(PROOF).encode('utf-8')), meta))
+    return snapshots, meta
+
+def test_streaming_and_full_parse_agree(monkeypatch):
+    if verify_proof.ijson is None: pytest.skip("未安裝 ijson")
+    streamed = parse(monkeypatch, True)
+    assert streamed == parse(monkeypatch, False)
+    snapshots, meta = streamed
+    assert [s['version_index'] for s in snapshots] == [1, 2]
+    assert meta['report_id'] == "r-1" and meta['event_proof.chain.merkle_root'] == "a" * 64
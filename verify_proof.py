@@ -0,0 +1,216 @@
+# ====================================================================
+# [V] WesmartAI 證據檔離線驗證工具
+# --------------------------------------------------------------------
+# 由 proof_event_*.json 中記錄的欄位與原圖位元組，重新推導每個快照的五重雜湊、
+# Step Hash、雜湊鏈與 final_event_hash，並回報所有不一致之處。
+# 刻意不匯入 app.py：驗證端為獨立實作，只依賴標準函式庫與 ijson (列於 requirements.txt，以串流方式解析大型證據檔；
+# 未安裝時退回整檔 json.load)。
+#
+# 用法: python verify_proof.py data/proofs/ --static-root static --workers 8
+#       python verify_proof.py --inclusion inclusion_v3.json   (GET /proof/<report_id>/inclusion/3 的回應)
+# ====================================================================
+
+# === V1. 套件匯入 ===
+import argparse, base64, glob, hashlib, json, os, sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import ijson # 大型 JSON 檔以串流方式逐一讀取快照 (requirements.txt；未安裝時退回整檔解析)
+except ImportError:
+    ijson = None
+
+CHAIN_GENESIS = "0" * 64
+HASH_FIELDS = ("timestamp_hash", "prompt_hash", "revised_prompt_hash", "size_hash", "file_hash")
+CHUNK_SIZE = 1024 * 1024
+
+# === V2. 雜湊工具 (與 app.py 的定義相同，獨立實作) ===
+def sha256_bytes(b): return hashlib.sha256(b).hexdigest()
+
+def sha256_text(s): return sha256_bytes(s.encode('utf-8'))
+
+def sha256_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''): hasher.update(chunk)
+    return hasher.hexdigest()
+
+def step_hash_of(hashes): return sha256_bytes(json.dumps({k: hashes[k] for k in HASH_FIELDS}, sort_keys=True).encode('utf-8'))
+
+def merkle_leaf(step_hash): return hashlib.sha256(b"\x00" + bytes.fromhex(step_hash)).digest()
+
+def merkle_node(left, right): return hashlib.sha256(b"\x01" + left + right).digest()
+
+# V2-1. 以 peaks 增量計算 Merkle 樹根與雜湊鏈 (串流時不需保留所有快照)
+class ChainState:
+    def __init__(self):
+        self.count = 0; self.chain_hash = CHAIN_GENESIS; self.peaks = []; self.step_hashes = []
+
+    def extend(self, step_hash):
+        self.count += 1; self.step_hashes.append(step_hash)
+        self.chain_hash = sha256_text(self.chain_hash + step_hash)
+        self.peaks.append((0, merkle_leaf(step_hash)))
+        while len(self.peaks) > 1 and self.peaks[-1][0] == self.peaks[-2][0]:
+            height, right = self.peaks.pop(); _, left = self.peaks.pop()
+            self.peaks.append((height + 1, merkle_node(left, right)))
+
+    def merkle_root(self):
+        if not self.peaks: return sha256_bytes(b"")
+        root = self.peaks[-1][1]
+        for _, peak in reversed(self.peaks[:-1]): root = merkle_node(peak, root)
+        return root.hex()
+
+    def legacy_final_event_hash(self): return sha256_bytes(json.dumps(self.step_hashes, sort_keys=True).encode('utf-8'))
+
+# === V3. 讀取證據檔 (串流或整檔) ===
+SNAPSHOT_PREFIX = "event_proof.snapshots.item"
+META_PREFIXES = {
+    "report_id", "applicant", "issued_at", "event_proof.final_event_hash", "event_proof.final_hash_mode",
+    "event_proof.chain.leaf_count", "event_proof.chain.chain_hash", "event_proof.chain.merkle_root",
+    "event_proof.chain.legacy_final_event_hash", "event_proof.chain.genesis"
+}
+
+# V3-1. 逐一交出快照，讀取完畢後將 meta 欄位填入傳入的 dict
+def iter_snapshots(f, meta):
+    if ijson is None:
+        proof = json.load(f)
+        event_proof = proof.get('event_proof', {})
+        for key in ("report_id", "applicant", "issued_at"): meta[key] = proof.get(key)
+        meta["event_proof.final_event_hash"] = event_proof.get('final_event_hash')
+        meta["event_proof.final_hash_mode"] = event_proof.get('final_hash_mode')
+        for key, value in event_proof.get('chain', {}).items(): meta[f"event_proof.chain.{key}"] = value
+        yield from event_proof.get('snapshots', [])
+        return
+    builder = None
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if builder is None and prefix == SNAPSHOT_PREFIX and event == 'start_map': builder = ijson.ObjectBuilder()
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == SNAPSHOT_PREFIX and event == 'end_map':
+                yield builder.value; builder = None
+        elif prefix in META_PREFIXES and event in ('string', 'number'):
+            meta[prefix] = value
+
+# === V4. 驗證 ===
+# V4-1. 單一快照：由原始欄位與原圖重新推導五重雜湊與 Step Hash
+def verify_snapshot(snapshot, static_root):
+    errors = []; label = f"版本 {snapshot.get('version_index')}"
+    hashes = snapshot.get('hashes', {})
+    derived = {
+        "timestamp_hash": sha256_text(snapshot['timestamp_utc']),
+        "prompt_hash": sha256_text(snapshot['prompt']),
+        "revised_prompt_hash": sha256_text(snapshot.get('revised_prompt', snapshot['prompt'])),
+        "size_hash": sha256_text(snapshot['size']),
+    }
+    try:
+        if 'blob_path' in snapshot: derived['file_hash'] = sha256_file(os.path.join(static_root, snapshot['blob_path']))
+        elif 'content_base64' in snapshot: derived['file_hash'] = sha256_bytes(base64.b64decode(snapshot['content_base64']))
+        else: errors.append(f"{label}: 缺少原圖 (blob_path / content_base64)")
+    except OSError as e:
+        errors.append(f"{label}: 無法讀取原圖: {e}")
+    for key, value in derived.items():
+        if hashes.get(key) != value: errors.append(f"{label}: {key} 不一致 (記錄 {hashes.get(key)}, 重算 {value})")
+    if all(key in hashes for key in HASH_FIELDS) and hashes.get('step_hash') != step_hash_of(hashes):
+        errors.append(f"{label}: step_hash 不一致")
+    return errors
+
+# V4-2. 單一證據檔：快照、雜湊鏈、Merkle 樹根與 final_event_hash
+def verify_proof_file(path, static_root="static"):
+    result = {"path": path, "report_id": None, "snapshots": 0, "ok": False, "errors": []}
+    meta = {}; chain = ChainState(); errors = result['errors']
+    try:
+        with open(path, 'rb') as f:
+            for snapshot in iter_snapshots(f, meta):
+                errors.extend(verify_snapshot(snapshot, static_root))
+                step_hash = snapshot.get('hashes', {}).get('step_hash', '')
+                if snapshot.get('version_index') != chain.count + 1: errors.append(f"版本 {snapshot.get('version_index')}: version_index 不連續")
+                chain.extend(step_hash)
+                if 'chain_hash' in snapshot and snapshot['chain_hash'] != chain.chain_hash:
+                    errors.append(f"版本 {snapshot.get('version_index')}: chain_hash 不一致")
+    except (OSError, ValueError, KeyError) as e:
+        errors.append(f"無法解析證據檔: {e!r}")
+        return result
+
+    result['report_id'] = meta.get('report_id'); result['snapshots'] = chain.count
+    legacy_hash, merkle_root = chain.legacy_final_event_hash(), chain.merkle_root()
+    mode = meta.get('event_proof.final_hash_mode') or "compat"
+    expected = merkle_root if mode == "merkle" else legacy_hash
+    if meta.get('event_proof.final_event_hash') != expected: errors.append(f"final_event_hash 不一致 (模式 {mode}, 重算 {expected})")
+    if 'event_proof.chain.chain_hash' in meta:
+        checks = {"leaf_count": chain.count, "chain_hash": chain.chain_hash, "merkle_root": merkle_root, "legacy_final_event_hash": legacy_hash, "genesis": CHAIN_GENESIS}
+        for key, value in checks.items():
+            recorded = meta.get(f"event_proof.chain.{key}")
+            if recorded is not None and recorded != value: errors.append(f"chain.{key} 不一致")
+    result['ok'] = not errors
+    return result
+
+# V4-2a. Merkle 包含證明 (/proof/<report_id 或 final_event_hash>/inclusion/<版本> 的回應)：
+#        由 step_hash 與 audit_path 重算樹根並與 merkle_root 比對 (RFC 9162 2.1.3.2)；merkle 模式下樹根即 final_event_hash
+def verify_inclusion(inclusion):
+    try:
+        index, tree_size = int(inclusion['version_index']) - 1, int(inclusion['tree_size'])
+        node = merkle_leaf(inclusion['step_hash']); audit_path = [bytes.fromhex(h) for h in inclusion['audit_path']]
+    except (KeyError, TypeError, ValueError) as e:
+        return [f"無法解析包含證明: {e!r}"]
+    if not 0 <= index < tree_size: return ["version_index 超出 tree_size"]
+    fn, sn = index, tree_size - 1
+    for sibling in audit_path:
+        if sn == 0: return ["audit_path 過長"]
+        if fn & 1 or fn == sn:
+            node = merkle_node(sibling, node)
+            while not fn & 1 and fn != 0: fn >>= 1; sn >>= 1
+        else: node = merkle_node(node, sibling)
+        fn >>= 1; sn >>= 1
+    errors = []
+    if sn != 0: errors.append("audit_path 過短")
+    elif node.hex() != inclusion.get('merkle_root'): errors.append(f"merkle_root 不一致 (重算 {node.hex()})")
+    if inclusion.get('final_hash_mode') == "merkle" and inclusion.get('final_event_hash') != inclusion.get('merkle_root'):
+        errors.append("final_event_hash 與 merkle_root 不一致")
+    return errors
+
+def _verify_one(args): return verify_proof_file(*args)
+
+# V4-3. 多個證據檔以行程池平行驗證 (依提交順序逐一交出結果；chunksize 個一批分派以降低行程間往返)
+def verify_many(paths, static_root="static", workers=None, chunksize=16):
+    if workers == 1:
+        for path in paths: yield verify_proof_file(path, static_root)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_verify_one, [(path, static_root) for path in paths], chunksize=chunksize)
+
+def expand_paths(inputs):
+    for item in inputs:
+        if os.path.isdir(item): yield from sorted(glob.glob(os.path.join(item, "**", "proof_event_*.json"), recursive=True))
+        else: yield item
+
+# === V5. 命令列介面 (有任何不一致時結束代碼為 1) ===
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線驗證 WesmartAI proof_event_*.json 證據檔")
+    parser.add_argument("paths", nargs="*", help="證據檔或目錄 (預設 data/proofs/；僅指定 --inclusion 時不驗證證據檔)")
+    parser.add_argument("--inclusion", action="append", default=[], help="Merkle 包含證明 JSON 檔 (可重複指定)")
+    parser.add_argument("--static-root", default="static", help="blob_path 的相對根目錄")
+    parser.add_argument("--workers", type=int, default=None, help="驗證行程數 (預設為 CPU 核心數)")
+    parser.add_argument("--json", action="store_true", help="每行輸出一筆 JSON 結果")
+    args = parser.parse_args(argv)
+
+    total = failed = 0
+    for path in args.inclusion:
+        try:
+            with open(path, encoding='utf-8') as f: errors = verify_inclusion(json.load(f))
+        except (OSError, ValueError) as e: errors = [f"無法讀取包含證明: {e!r}"]
+        total += 1; failed += bool(errors)
+        if args.json: print(json.dumps({"path": path, "ok": not errors, "errors": errors}, ensure_ascii=False))
+        elif errors:
+            print(f"✗ {path}")
+            for error in errors: print(f"    - {error}")
+    paths = args.paths or ([] if args.inclusion else [os.path.join("data", "proofs")])
+    for result in verify_many(list(expand_paths(paths)), args.static_root, args.workers):
+        total += 1; failed += not result['ok']
+        if args.json: print(json.dumps(result, ensure_ascii=False))
+        elif not result['ok']:
+            print(f"✗ {result['path']} ({result['report_id']})")
+            for error in result['errors']: print(f"    - {error}")
+    if not args.json: print(f"共驗證 {total} 份證據檔與包含證明，{total - failed} 份通過，{failed} 份不一致")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())